@@ -0,0 +1,42 @@
+"""Waiting on the IOLoop for the graph to reach a checkpoint.
+
+Clients that just made a change, or that want to hear about the next one, ask the API for a
+minimum checkpoint instead of polling.  Their requests wait here without blocking other requests,
+and are woken when the refresher publishes a new graph snapshot.
+"""
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.locks import Condition
+
+
+class CheckpointWaiter(object):
+    def __init__(self, graph):
+        self.graph = graph
+        self._condition = None
+        self._io_loop = None
+
+    def _published(self, snapshot):
+        # Called from the refresh thread, so hand the wakeup over to the IOLoop.
+        self._io_loop.add_callback(self._condition.notify_all)
+
+    @gen.coroutine
+    def wait(self, checkpoint, timeout):
+        """Wait until the graph reaches checkpoint or timeout seconds pass.
+
+        Returns:
+            a Future resolving to the graph's snapshot at that point, which may be older than
+            checkpoint if the timeout expired
+        """
+        # Bind to the IOLoop on first use, because servers fork after creating the application.
+        if self._io_loop is None:
+            self._io_loop = IOLoop.current()
+            self._condition = Condition()
+            self.graph.add_publish_listener(self._published)
+
+        deadline = self._io_loop.time() + timeout
+        while self.graph.snapshot.checkpoint < checkpoint:
+            notified = yield self._condition.wait(deadline)
+            if not notified:
+                break
+        raise gen.Return(self.graph.snapshot)
@@ -0,0 +1,45 @@
+"""Encodings of API responses that are cheaper to send and to parse.
+
+Bulk responses repeat the same keys for every permission of every user, so clients can ask for
+format=compact to get lists of dicts as tables instead, and clients that accept gzip get
+compressed responses.  Cached responses are compressed once per checkpoint and served as is.
+"""
+
+from gzip import GzipFile
+from io import BytesIO
+
+# Cached responses are compressed on the IOLoop, like those tornado compresses on the fly, so they
+# get the same level: higher ones take much longer for little gain.
+CACHED_GZIP_LEVEL = 6
+
+
+def gzip_encode(body, level=CACHED_GZIP_LEVEL):
+    """Returns body compressed with gzip."""
+    out = BytesIO()
+    with GzipFile(mode="wb", fileobj=out, compresslevel=level) as gzip_file:
+        gzip_file.write(body)
+    return out.getvalue()
+
+
+def columnize(value):
+    """Returns value with every non-empty list of dicts that all have the same keys replaced by a
+    table of {"columns": [key, ...], "rows": [[value, ...], ...]}, at any depth.
+
+    Keys are sorted, and each row has the values of one dict in the order of the columns.
+    """
+    if isinstance(value, dict):
+        return {key: columnize(item) for key, item in value.iteritems()}
+    if not isinstance(value, (list, tuple)):
+        return value
+
+    items = [columnize(item) for item in value]
+    if not items or not all(isinstance(item, dict) for item in items):
+        return items
+    columns = sorted(items[0])
+    keys = set(columns)
+    if any(len(item) != len(keys) or not keys.issuperset(item) for item in items):
+        return items
+    return {
+        "columns": columns,
+        "rows": [[item[column] for column in columns] for item in items],
+    }
@@ -3,20 +3,35 @@ import csv
 from datetime import datetime
 import re
 import sys
+import time
 import traceback
 
+from tornado import gen
+from tornado.concurrent import Future  # noqa: F401
+from tornado.escape import json_encode
 from tornado.web import HTTPError, RequestHandler
-from typing import Any, Dict, Optional  # noqa: F401
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple  # noqa: F401
 
 from grouper import stats
+from grouper.api.encoding import columnize, gzip_encode
 from grouper.constants import TOKEN_FORMAT
-from grouper.graph import NoSuchUser
-from grouper.models.base.session import Session
+from grouper.graph import GROUP_DETAILS_FIELDS, NoSuchUser, USER_DETAILS_FIELDS, UserTokenTuple
+from grouper.models.base.session import Session  # noqa: F401
 from grouper.models.public_key import PublicKey
 from grouper.models.user import User
-from grouper.models.user_token import UserToken
+from grouper.models.user_token import check_hashed_secret, UserToken
 from grouper.util import try_update
 
+# Entities written between flushes of a streamed /multi/* response.
+STREAM_BATCH_SIZE = 100
+
+# What can be asked for with fields= on the user endpoints: the user's details from the graph,
+# and parts of the user's metadata.
+USER_METADATA_FIELDS = frozenset(["passwords", "public_keys", "metadata"])
+USER_FIELDS = USER_DETAILS_FIELDS | USER_METADATA_FIELDS
+
+TOKEN_VALIDATOR = re.compile(TOKEN_FORMAT)
+
 # if raven library around, pull in SentryMixin
 try:
     from raven.contrib.tornado import SentryMixin
@@ -28,8 +43,15 @@ else:
     RequestHandler = SentryHandler  # type: ignore # no support for conditional declarations #1152
 
 
-def get_individual_user_info(handler, name, cutoff, service_account):
-    # type: (GraphHandler, str, int, Optional[bool]) -> Dict[str, Any]
+def get_individual_user_info(
+        handler,  # type: GraphHandler
+        name,  # type: str
+        cutoff,  # type: int
+        service_account,  # type: Optional[bool]
+        details=None,  # type: Optional[Dict[str, Any]]
+        fields=None,  # type: Optional[FrozenSet[str]]
+        ):
+    # type: (...) -> Dict[str, Any]
     """This is a helper function to retrieve all information about a user.
 
     Args:
@@ -38,6 +60,8 @@ def get_individual_user_info(handler, name, cutoff, service_account):
         cutoff: the maximum distance of groups to use for permission checking
         service_account: a boolean indicating if this request is for a service account or not. This
             can be None if you want to support users and service accounts (deprecated)
+        details: the user's details from the graph, if they have already been looked up
+        fields: the USER_FIELDS to include, or None for all of them
 
     Returns:
         A dictionary containing all of the user's data
@@ -46,35 +70,196 @@ def get_individual_user_info(handler, name, cutoff, service_account):
         NoSuchUser: When no user with the given name exists, or has the the wrong serviceaccount
             type
     """
-    with handler.graph.lock:
-        if name not in handler.graph.user_metadata:
+    snapshot = handler.snapshot
+    if name not in snapshot.user_metadata:
+        raise NoSuchUser
+    md = snapshot.user_metadata[name]
+    if service_account is not None:
+        is_service_account = md["role_user"] or "service_account" in md
+        if service_account != is_service_account:
             raise NoSuchUser
-        md = handler.graph.user_metadata[name]
-        if service_account is not None:
-            is_service_account = md["role_user"] or "service_account" in md
-            if service_account != is_service_account:
-                raise NoSuchUser
 
-        details = handler.graph.get_user_details(name, cutoff, expose_aliases=False)
-        out = {"user": {"name": name}}
-        # Updates the output with the user's metadata
-        try_update(out["user"], md)
-        # Updates the output with the user's details (such as permissions)
-        try_update(out, details)
-        return out
+    if details is None:
+        details = snapshot.get_user_details(
+            name, cutoff, expose_aliases=False,
+            fields=None if fields is None else fields & USER_DETAILS_FIELDS)
+    out = {"user": {"name": name}}
+    if fields is not None:
+        md = {key: value for key, value in md.iteritems()
+              if key not in USER_METADATA_FIELDS or key in fields}
+    # Updates the output with the user's metadata
+    try_update(out["user"], md)
+    # Updates the output with the user's details (such as permissions)
+    try_update(out, details)
+    return out
+
+
+def get_individual_group_info(
+        handler,  # type: GraphHandler
+        name,  # type: str
+        cutoff,  # type: int
+        details=None,  # type: Optional[Dict[str, Any]]
+        fields=None,  # type: Optional[FrozenSet[str]]
+        ):
+    # type: (...) -> Dict[str, Any]
+    """Returns all information about a group.
+
+    Args:
+        handler: the GraphHandler for this request
+        name: the name of the group whose data is being retrieved
+        cutoff: the maximum distance of members and parents to include
+        details: the group's details from the graph, if they have already been looked up
+        fields: the GROUP_DETAILS_FIELDS to include, or None for all of them
+
+    Raises:
+        NoSuchGroup: When no group with the given name exists
+    """
+    if details is None:
+        details = handler.snapshot.get_group_details(
+            name, cutoff, expose_aliases=False, fields=fields)
+    out = {"group": {"name": name}}
+    try_update(out["group"], handler.snapshot.group_metadata.get(name, {}))
+    try_update(out, details)
+    return out
+
+
+def get_individual_permission_info(handler, name, details=None):
+    # type: (GraphHandler, str, Optional[Dict[str, Any]]) -> Dict[str, Any]
+    """Returns all information about a permission.
+
+    Args:
+        handler: the GraphHandler for this request
+        name: the name of the permission whose data is being retrieved
+        details: the permission's details from the graph, if they have already been looked up
+    """
+    if details is None:
+        details = handler.snapshot.get_permission_details(name, expose_aliases=False)
+    out = {"permission": {"name": name}}
+    try_update(out, details)
+    return out
 
 
 class GraphHandler(RequestHandler):
+    # Whether responses to GET depend only on the request and the graph snapshot, so that they
+    # can be cached and tagged with the snapshot's checkpoint.
+    cacheable = False
+
     def initialize(self):
         self.graph = self.application.my_settings.get("graph")
-        self.session = self.application.my_settings.get("db_session")()
+        # Everything this request reads comes from the graph as of this point, so responses are
+        # consistent even if the graph is refreshed meanwhile.
+        self.snapshot = self.graph.snapshot
+        self._session = None
+        self.response_cache = self.application.my_settings.get("response_cache")
+        self.checkpoint_waiter = self.application.my_settings.get("checkpoint_waiter")
 
         self._request_start_time = datetime.utcnow()
 
         stats.log_rate("requests", 1)
         stats.log_rate("requests_{}".format(self.__class__.__name__), 1)
 
+    @property
+    def session(self):
+        # type: () -> Session
+        """The database session of this request, created on first use.
+
+        Most requests are answered from the graph alone, so they never take a connection from the
+        pool.  A session that was created is closed when the request finishes.
+        """
+        if self._session is None:
+            self._session = self.application.my_settings.get("db_session")()
+        return self._session
+
+    def _is_cacheable(self):
+        return self.cacheable and self.request.method == "GET"
+
+    def _cache_key(self):
+        # Responses are cached as sent, so gzipped ones are kept apart from the others.
+        accepts_gzip = (self.application.settings.get("compress_response") and
+                        "gzip" in self.request.headers.get("Accept-Encoding", ""))
+        return (self.request.uri, "gzip" if accepts_gzip else None)
+
+    def _write_encoded(self, body, content_encoding):
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        if content_encoding is not None:
+            self.set_header("Content-Encoding", content_encoding)
+        self.write(body)
+
+    def _is_compact(self):
+        return self.get_argument("format", "json") == "compact"
+
+    def get_fields(self, allowed):
+        # type: (FrozenSet[str]) -> Optional[FrozenSet[str]]
+        """Returns the fields asked for with a comma-separated fields argument, or None if it
+        wasn't given.  Raises HTTPError for fields that aren't in allowed."""
+        value = self.get_argument("fields", None)
+        if value is None:
+            return None
+        fields = frozenset(field for field in value.split(",") if field)
+        unknown = fields - allowed
+        if unknown:
+            raise HTTPError(400, "Unknown fields: {}".format(", ".join(sorted(unknown))))
+        return fields
+
+    def get_number_argument(self, name, convert, default=None):
+        """Get the named argument as a number, converted with convert (int or float).
+
+        Responds with 400 if the argument isn't a number, or if it's missing and there's no
+        default.
+        """
+        if default is None:
+            value = self.get_argument(name)
+        else:
+            value = self.get_argument(name, None)
+            if value is None:
+                return default
+        try:
+            number = convert(value)
+        except ValueError:
+            number = None
+        if number is None or number != number:  # NaN isn't equal to itself.
+            raise HTTPError(400, "Invalid {}: {!r}".format(name, value))
+        return number
+
+    @gen.coroutine
+    def prepare(self):
+        # With min_checkpoint, wait (up to `wait` seconds) for the graph to reach that checkpoint
+        # and answer from there, so that clients see their own writes or the next change.
+        min_checkpoint = self.get_number_argument("min_checkpoint", int, 0)
+        max_wait = self.application.my_settings.get("max_checkpoint_wait", 0)
+        wait = max(0, min(self.get_number_argument("wait", float, max_wait), max_wait))
+        if self.checkpoint_waiter is not None and min_checkpoint > self.snapshot.checkpoint:
+            self.snapshot = yield self.checkpoint_waiter.wait(min_checkpoint, wait)
+
+        if not self._is_cacheable():
+            return
+
+        # A client that has the response for this checkpoint already has this response.
+        self.set_etag_header()
+        if self.check_etag_header():
+            self.set_status(304)
+            self.finish()
+            return
+        # Successful responses get the header set again when they finish.
+        self.clear_header("Etag")
+
+        if self.response_cache is not None:
+            key = self._cache_key()
+            body = self.response_cache.get(self.snapshot.checkpoint, key)
+            if body is not None:
+                self._write_encoded(body, key[1])
+                self.finish()
+
+    def compute_etag(self):
+        if self._is_cacheable():
+            return '"{}-{}"'.format(self.snapshot.checkpoint, self.snapshot.checkpoint_time)
+        return super(GraphHandler, self).compute_etag()
+
     def on_finish(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
         # log request duration
         duration = datetime.utcnow() - self._request_start_time
         duration_ms = int(duration.total_seconds() * 1000)
@@ -92,26 +277,33 @@ class GraphHandler(RequestHandler):
         errors = [
             {"code": code, "message": message} for code, message in errors
         ]
-        with self.graph.lock:
-            checkpoint = self.graph.checkpoint
-            checkpoint_time = self.graph.checkpoint_time
-            self.write({
-                "status": "error",
-                "errors": errors,
-                "checkpoint": checkpoint,
-                "checkpoint_time": checkpoint_time,
-            })
+        self.write({
+            "status": "error",
+            "errors": errors,
+            "checkpoint": self.snapshot.checkpoint,
+            "checkpoint_time": self.snapshot.checkpoint_time,
+        })
 
     def success(self, data):
-        with self.graph.lock:
-            checkpoint = self.graph.checkpoint
-            checkpoint_time = self.graph.checkpoint_time
-            self.write({
-                "status": "ok",
-                "data": data,
-                "checkpoint": checkpoint,
-                "checkpoint_time": checkpoint_time,
-            })
+        if self._is_compact():
+            data = columnize(data)
+        body = json_encode({
+            "status": "ok",
+            "data": data,
+            "checkpoint": self.snapshot.checkpoint,
+            "checkpoint_time": self.snapshot.checkpoint_time,
+        })
+        content_encoding = None
+        if (self._is_cacheable() and self.response_cache is not None and
+                self.response_cache.accepts(self.snapshot.checkpoint, len(body))):
+            # Compress cached responses once here; tornado compresses the rest on the way out.
+            # Compressing only makes the body smaller, so the cache still takes it.
+            key = self._cache_key()
+            content_encoding = key[1]
+            if content_encoding == "gzip":
+                body = gzip_encode(body)
+            self.response_cache.put(self.snapshot.checkpoint, key, body)
+        self._write_encoded(body, content_encoding)
 
     def raise_and_log_exception(self, exc):
         try:
@@ -134,6 +326,8 @@ class GraphHandler(RequestHandler):
 
 
 class Users(GraphHandler):
+    cacheable = True
+
     def get(self, name=None):
         cutoff = int(self.get_argument("cutoff", 100))
         # Deprecated 2016-08-10, use the ServiceAccounts endpoint to lookup service accounts
@@ -144,48 +338,118 @@ class Users(GraphHandler):
             # because there are too many existing integrations that expect the
             # /users/foo@example.com endpoint to work for both. :(
             try:
-                return self.success(
-                    get_individual_user_info(self, name, cutoff, service_account=None)
-                )
+                return self.success(get_individual_user_info(
+                    self, name, cutoff, service_account=None, fields=self.get_fields(USER_FIELDS)
+                ))
             except NoSuchUser:
                 return self.notfound("User ({}) not found.".format(name))
 
-        with self.graph.lock:
-            return self.success({
-                "users": sorted([
-                    k for k, v in self.graph.user_metadata.iteritems()
-                    if (include_service_accounts or not ("service_account" in v or v["role_user"]))
-                ]),
-            })
+        return self.success({
+            "users": sorted([
+                k for k, v in self.snapshot.user_metadata.iteritems()
+                if (include_service_accounts or not ("service_account" in v or v["role_user"]))
+            ]),
+        })
+
+
+class MultiHandler(GraphHandler):
+    """Base class for API endpoints for bulk retrieval of data.
 
+    Subclasses return the data of every entity named by a repeated argument, or of all entities
+    if none are named, as a dict of name: data.
+
+    With stream=yes, the response is written STREAM_BATCH_SIZE entities at a time and flushed
+    after each batch, so the data of all entities is never held in memory at once.  The response
+    is the same JSON, but errors after the first batch can only cut it short.
+    """
+    cacheable = True
+    # The argument naming the entities to return.
+    name_argument = "name"
 
-class MultiUsers(GraphHandler):
+    def get_all_names(self):
+        # type: () -> Iterable[str]
+        """Returns the names of all entities, for requests that don't name any."""
+        raise NotImplementedError()
+
+    def get_data_many(self, names):
+        # type: (List[str]) -> Dict[str, Any]
+        """Returns a dict of name: data for each of names that exists."""
+        raise NotImplementedError()
+
+    @gen.coroutine
+    def get(self):
+        names = self.get_arguments(self.name_argument)
+        if not names:
+            names = list(self.get_all_names())
+
+        if self.get_argument("stream", "no") == "yes":
+            yield self.stream(names)
+            return
+
+        self.success(self.get_data_many(names))
+
+    @gen.coroutine
+    def stream(self, names):
+        self.set_header("Content-Type", "application/json; charset=UTF-8")
+        self.set_etag_header()
+        self.write('{{"status": "ok", "checkpoint": {}, "checkpoint_time": {}, "data": {{'.format(
+            json_encode(self.snapshot.checkpoint), json_encode(self.snapshot.checkpoint_time)))
+
+        compact = self._is_compact()
+        written = 0
+        for start in xrange(0, len(names), STREAM_BATCH_SIZE):
+            batch = names[start:start + STREAM_BATCH_SIZE]
+            batch_data = self.get_data_many(batch)
+            for name in batch:
+                if name not in batch_data:
+                    continue
+                data = batch_data[name]
+                if compact:
+                    data = columnize(data)
+                self.write("{}{}: {}".format(
+                    ", " if written else "", json_encode(name), json_encode(data)))
+                written += 1
+            # Send what we have, letting the IOLoop serve other requests meanwhile.
+            yield self.flush()
+
+        self.write("}}")
+
+
+class MultiUsers(MultiHandler):
     """API endpoint for bulk retrieval of user data.
 
     This returns the same information as the Users and ServiceAccounts endpoints, but supports
     multiple returning the data of multiple users to save on API call overhead.
     """
-    def get(self):
-        usernames = self.get_arguments("username")
-        if not usernames:
-            usernames = self.graph.user_metadata.iterkeys()
+    name_argument = "username"
 
+    def get_all_names(self):
+        return self.snapshot.user_metadata.iterkeys()
+
+    def get_data_many(self, names):
         cutoff = int(self.get_argument("cutoff", 100))
+        fields = self.get_fields(USER_FIELDS)
+        details = self.snapshot.get_user_details_many(
+            names, cutoff, expose_aliases=False,
+            fields=None if fields is None else fields & USER_DETAILS_FIELDS)
 
-        with self.graph.lock:
-            data = {}
-            for username in usernames:
-                try:
-                    data[username] = get_individual_user_info(
-                        self, username, cutoff, service_account=None
-                    )
-                except NoSuchUser:
-                    continue
-            self.success(data)
+        data = {}
+        for username, user_details in details.iteritems():
+            data[username] = get_individual_user_info(
+                self, username, cutoff, service_account=None, details=user_details, fields=fields
+            )
+        return data
 
 
 class UsersPublicKeys(GraphHandler):
+    @gen.coroutine
     def get(self):
+        body = yield self.application.run_in_executor(self.get_public_keys_csv)
+        self.set_header("Content-Type", "text/csv")
+        self.write(body)
+
+    def get_public_keys_csv(self):
+        # type: () -> str
         fh = StringIO()
         w_csv = csv.writer(fh, lineterminator="\n")
 
@@ -200,7 +464,7 @@ class UsersPublicKeys(GraphHandler):
             'comment',
         ])
 
-        user_key_list = Session().query(PublicKey, User).filter(User.id == PublicKey.user_id)
+        user_key_list = self.session.query(PublicKey, User).filter(User.id == PublicKey.user_id)
         for key, user in user_key_list:
             w_csv.writerow([
                 user.name,
@@ -212,104 +476,216 @@ class UsersPublicKeys(GraphHandler):
                 key.comment,
             ])
 
-        self.set_header("Content-Type", "text/csv")
-        self.write(fh.getvalue())
+        return fh.getvalue()
 
 
 class Groups(GraphHandler):
+    cacheable = True
+
     def get(self, name=None):
         cutoff = int(self.get_argument("cutoff", 100))
 
-        with self.graph.lock:
-            if not name:
-                return self.success({
-                    "groups": [
-                        group
-                        for group in self.graph.groups
-                    ],
-                })
-
-            if name not in self.graph.groups:
-                return self.notfound("Group (%s) not found." % name)
+        if not name:
+            return self.success({
+                "groups": [
+                    group
+                    for group in self.snapshot.groups
+                ],
+            })
 
-            details = self.graph.get_group_details(name, cutoff, expose_aliases=False)
+        if name not in self.snapshot.groups:
+            return self.notfound("Group (%s) not found." % name)
 
-            out = {"group": {"name": name}}
-            try_update(out["group"], self.graph.group_metadata.get(name, {}))
-            try_update(out, details)
-            return self.success(out)
+        return self.success(get_individual_group_info(
+            self, name, cutoff, fields=self.get_fields(GROUP_DETAILS_FIELDS)))
 
 
 class Permissions(GraphHandler):
+    cacheable = True
+
     def get(self, name=None):
-        with self.graph.lock:
-            if not name:
-                return self.success({
-                    "permissions": [
-                        permission
-                        for permission in self.graph.permissions
-                    ],
-                })
+        if not name:
+            return self.success({
+                "permissions": [
+                    permission
+                    for permission in self.snapshot.permissions
+                ],
+            })
 
-            if name not in self.graph.permissions:
-                return self.notfound("Permission (%s) not found." % name)
+        if name not in self.snapshot.permissions:
+            return self.notfound("Permission (%s) not found." % name)
 
-            details = self.graph.get_permission_details(name, expose_aliases=False)
+        return self.success(get_individual_permission_info(self, name))
 
-            out = {"permission": {"name": name}}
-            try_update(out, details)
-            return self.success(out)
 
+class MultiGroups(MultiHandler):
+    """API endpoint for bulk retrieval of group data, as returned by the Groups endpoint."""
 
-class TokenValidate(GraphHandler):
-    validator = re.compile(TOKEN_FORMAT)
+    def get_all_names(self):
+        return self.snapshot.groups
 
-    def post(self):
-        supplied_token = self.get_body_argument("token")
-        match = TokenValidate.validator.match(supplied_token)
-        if not match:
-            return self.error(((1, "Token format not recognized"),))
+    def get_data_many(self, names):
+        cutoff = int(self.get_argument("cutoff", 100))
+        fields = self.get_fields(GROUP_DETAILS_FIELDS)
+        details = self.snapshot.get_group_details_many(
+            names, cutoff, expose_aliases=False, fields=fields)
+        return {
+            name: get_individual_group_info(self, name, cutoff, details=group_details)
+            for name, group_details in details.iteritems()
+        }
+
+
+class MultiPermissions(MultiHandler):
+    """API endpoint for bulk retrieval of permission data, as returned by the Permissions
+    endpoint.  Groups granted several of the requested permissions are only walked once."""
+
+    def get_all_names(self):
+        return self.snapshot.permissions
 
-        sess = Session()
+    def get_data_many(self, names):
+        details = self.snapshot.get_permission_details_many(names, expose_aliases=False)
+        return {
+            name: get_individual_permission_info(self, name, details=permission_details)
+            for name, permission_details in details.iteritems()
+        }
 
-        token_name = match.group("token_name")
-        token_secret = match.group("token_secret")
-        username = match.group("name")
 
-        token = UserToken.get_by_value(sess, username, token_name)
-        if token is None:
-            return self.error(((2, "Token specified does not exist"),))
-        if not token.enabled:
-            return self.error(((3, "Token is disabled"),))
-        if not token.check_secret(token_secret):
-            return self.error(((4, "Token secret mismatch"),))
+class Changes(GraphHandler):
+    """API endpoint for what changed since a checkpoint.
+
+    Returns the names of the users, groups, permissions and service accounts whose data may
+    differ from what was served at checkpoint `since`.  If the server no longer remembers that
+    far back, responds with 410 and the client has to fetch everything again.
+    """
+    cacheable = True
+
+    def get(self):
+        since = self.get_number_argument("since", int)
+        if since >= self.snapshot.checkpoint:
+            users, groups, permissions, service_accounts = [], [], [], []
+        else:
+            diff = self.graph.change_history.since(since)
+            if diff is None:
+                self.set_status(410)
+                return self.error([(410, "Changes since checkpoint {} are not available.".format(
+                    since))])
+            users, groups, permissions, service_accounts = (
+                diff.users, diff.groups, diff.permissions, diff.service_accounts)
 
         return self.success({
-            "owner": username,
-            "identity": str(token),
-            "act_as_owner": True,
-            "valid": True,
+            "since": since,
+            "users": sorted(users),
+            "groups": sorted(groups),
+            "permissions": sorted(permissions),
+            "service_accounts": sorted(service_accounts),
         })
 
 
+@gen.coroutine
+def validate_token(handler, supplied_token):
+    # type: (GraphHandler, str) -> Future
+    """Validates a token against the tokens loaded into the graph.
+
+    Tokens created since the graph was last refreshed aren't in it yet, so those are looked up in
+    the database instead, on the application's executor.  So are tokens the graph finds valid
+    once it's older than the token_graph_max_age setting (0 if unset), since the token or its
+    user may have been disabled since; that bounds how long a disabled token keeps validating,
+    even while refreshes are failing.
+
+    Returns:
+        a Future resolving to the response data and None if the token is valid, or None and the
+        (code, message) of the error if not
+    """
+    match = TOKEN_VALIDATOR.match(supplied_token)
+    if not match:
+        raise gen.Return((None, (1, "Token format not recognized")))
+
+    token_name = match.group("token_name")
+    token_secret = match.group("token_secret")
+    username = match.group("name")
+
+    token = handler.snapshot.get_user_token(username, token_name)
+    if token is None:
+        stats.log_rate("token_validate_db_lookups", 1)
+        token = yield handler.application.run_in_executor(
+            _get_user_token_from_db, handler.session, username, token_name)
+    elif token.enabled and check_hashed_secret(token_secret, token.hashed_secret):
+        max_age = handler.application.my_settings.get("token_graph_max_age", 0)
+        if time.time() - handler.graph.refreshed_at > max_age:
+            stats.log_rate("token_validate_db_confirmations", 1)
+            token = yield handler.application.run_in_executor(
+                _get_user_token_from_db, handler.session, username, token_name)
+    if token is None:
+        raise gen.Return((None, (2, "Token specified does not exist")))
+    if not token.enabled:
+        raise gen.Return((None, (3, "Token is disabled")))
+    if not check_hashed_secret(token_secret, token.hashed_secret):
+        raise gen.Return((None, (4, "Token secret mismatch")))
+
+    raise gen.Return(({
+        "owner": username,
+        "identity": "{}/{}".format(username, token_name),
+        "act_as_owner": True,
+        "valid": True,
+    }, None))
+
+
+def _get_user_token_from_db(session, username, token_name):
+    # type: (Session, str, str) -> Optional[UserTokenTuple]
+    token = UserToken.get_by_value(session, username, token_name)
+    if token is None:
+        return None
+    return UserTokenTuple(token.name, token.hashed_secret, token.enabled and token.user.enabled)
+
+
+class TokenValidate(GraphHandler):
+    @gen.coroutine
+    def post(self):
+        data, error = yield validate_token(self, self.get_body_argument("token"))
+        if error is not None:
+            self.error((error,))
+            return
+        self.success(data)
+
+
+class MultiTokenValidate(GraphHandler):
+    """API endpoint for validating many tokens at once.
+
+    Takes repeated token arguments and returns a result for each, in the same order: what
+    TokenValidate returns for a valid token, or {"valid": false, "error": {"code", "message"}}.
+    """
+
+    @gen.coroutine
+    def post(self):
+        results = []
+        for supplied_token in self.get_body_arguments("token"):
+            data, error = yield validate_token(self, supplied_token)
+            if error is not None:
+                code, message = error
+                data = {"valid": False, "error": {"code": code, "message": message}}
+            results.append(data)
+        self.success({"tokens": results})
+
+
 class ServiceAccounts(GraphHandler):
+    cacheable = True
+
     def get(self, name=None):
         cutoff = int(self.get_argument("cutoff", 100))
         if name is not None:
             try:
-                return self.success(
-                    get_individual_user_info(self, name, cutoff, service_account=True)
-                )
+                return self.success(get_individual_user_info(
+                    self, name, cutoff, service_account=True, fields=self.get_fields(USER_FIELDS)
+                ))
             except NoSuchUser:
                 return self.notfound("User ({}) not found.".format(name))
 
-        with self.graph.lock:
-            return self.success({
-                "service_accounts": sorted([
-                    k for k, v in self.graph.user_metadata.iteritems()
-                    if "service_account" in v or v["role_user"]
-                ]),
-            })
+        return self.success({
+            "service_accounts": sorted([
+                k for k, v in self.snapshot.user_metadata.iteritems()
+                if "service_account" in v or v["role_user"]
+            ]),
+        })
 
 
 class NotFound(GraphHandler):
@@ -7,41 +7,59 @@ import tornado.httpserver
 import tornado.ioloop
 
 from grouper import stats
+from grouper.api.checkpoint_waiter import CheckpointWaiter
+from grouper.api.response_cache import ResponseCache
 from grouper.api.routes import HANDLERS
 from grouper.api.settings import settings
 from grouper.app import Application
-from grouper.database import DbRefreshThread
+from grouper.database import start_graph_refresher
 from grouper.error_reporting import get_sentry_client, setup_signal_handlers
+from grouper.executor import BoundedExecutor
 from grouper.graph import Graph
+from grouper.graph_builder import GraphBuilder
+from grouper.graph_engine import GRAPH_ENGINES
 from grouper.models.base.session import get_db_engine, Session
 from grouper.plugin import initialize_plugins
 from grouper.plugin.exceptions import PluginsDirectoryDoesNotExist
 from grouper.setup import build_arg_parser, setup_logging
-from grouper.util import get_database_url
+from grouper.util import get_database_url, get_db_pool_settings
 
 if TYPE_CHECKING:
     import argparse  # noqa: F401
-    from typing import List  # noqa: F401
+    from typing import List, Optional  # noqa: F401
     from grouper.error_reporting import SentryProxy  # noqa: F401
     from grouper.fe.settings import Settings  # noqa: F401
     from grouper.graph import GroupGraph  # noqa: F401
 
 
+def get_executor(settings):
+    # type: (Settings) -> Optional[BoundedExecutor]
+    if not settings.db_executor_threads:
+        return None
+    return BoundedExecutor(settings.db_executor_threads, settings.db_executor_max_queue)
+
+
 def get_application(graph, settings, sentry_client):
     # type: (GroupGraph, Settings, SentryProxy) -> Application
     my_settings = {
         "graph": graph,
         "db_session": Session,
+        "response_cache": ResponseCache(settings.response_cache_max_bytes),
+        "checkpoint_waiter": CheckpointWaiter(graph),
+        "max_checkpoint_wait": settings.max_checkpoint_wait,
+        "token_graph_max_age": settings.token_graph_max_age,
     }
 
     tornado_settings = {
         "debug": settings.debug,
+        "compress_response": settings.compress_responses,
     }
 
     application = Application(
         HANDLERS,
         my_settings=my_settings,
         sentry_client=sentry_client,
+        executor=get_executor(settings),
         **tornado_settings
     )
 
@@ -66,17 +84,23 @@ def start_server(args, sentry_client):
     # setup database
     logging.debug("configure database session")
     database_url = args.database_url or get_database_url(settings)
-    Session.configure(bind=get_db_engine(database_url))
+    Session.configure(bind=get_db_engine(database_url, **get_db_pool_settings(settings)))
 
     settings.start_config_thread(args.config, "api")
 
-    with closing(Session()) as session:
-        graph = Graph()
-        graph.update_from_db(session)
-
-    refresher = DbRefreshThread(settings, graph, settings.refresh_interval, sentry_client)
-    refresher.daemon = True
-    refresher.start()
+    graph = Graph()
+    graph.engine = GRAPH_ENGINES[settings.graph_engine]
+    graph.loader_threads = settings.graph_loader_threads
+    if settings.graph_build_in_child:
+        graph.builder = GraphBuilder(settings.graph_build_timeout, settings.plugin_dirs,
+                                     settings.plugin_module_paths, "grouper_api")
+    graph.details_cache_entries = settings.graph_details_cache_entries
+    graph.details_cache_max_nodes = settings.graph_details_cache_max_nodes
+    graph.change_history.max_entries = settings.graph_change_history_entries
+    # Serve from the last snapshot if there is one; the refresher catches up from there.
+    if not settings.graph_snapshot_path or not graph.load_snapshot(settings.graph_snapshot_path):
+        with closing(Session()) as session:
+            graph.update_from_db(session)
 
     application = get_application(graph, settings, sentry_client)
 
@@ -90,6 +114,10 @@ def start_server(args, sentry_client):
 
     stats.set_defaults()
 
+    # The graph is loaded before forking so that processes share it to begin with, but the
+    # refresh thread has to be started in each of them.
+    start_graph_refresher(settings, graph, sentry_client)
+
     try:
         tornado.ioloop.IOLoop.instance().start()
     except KeyboardInterrupt:
@@ -0,0 +1,79 @@
+"""A cache of encoded API responses.
+
+Responses of the read API depend only on the request and on the graph snapshot they were built
+from, so they are cached by request URI for the checkpoint of that snapshot.  Entries never need
+invalidating: the whole cache is dropped as soon as a response for a newer checkpoint is stored.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+from grouper import stats
+
+
+class ResponseCache(object):
+    def __init__(self, max_bytes=0):
+        """Create a cache that holds nothing if max_bytes is 0.
+
+        Args:
+            max_bytes: the most bytes of response bodies to keep
+        """
+        self.max_bytes = max_bytes
+        self.checkpoint = None
+        self.size = 0
+        self._entries = OrderedDict()  # key -> body, oldest use first.
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, checkpoint, key):
+        """Returns the cached body for key at checkpoint, or None."""
+        if not self.max_bytes:
+            return None
+        with self._lock:
+            body = None
+            if checkpoint == self.checkpoint:
+                body = self._entries.pop(key, None)
+                if body is not None:
+                    self._entries[key] = body
+        stats.log_rate("response_cache_hits" if body is not None else "response_cache_misses", 1)
+        return body
+
+    def accepts(self, checkpoint, size):
+        """Returns whether a body of size bytes for checkpoint would be cached, so that callers
+        can skip preparing bodies only worth it if cached."""
+        if not self.max_bytes or size > self.max_bytes:
+            return False
+        with self._lock:
+            return self.checkpoint is None or checkpoint >= self.checkpoint
+
+    def put(self, checkpoint, key, body):
+        """Cache body as the response for key at checkpoint.
+
+        Responses for checkpoints older than the newest one seen are not cached.
+        """
+        if not self.max_bytes or len(body) > self.max_bytes:
+            return
+
+        evicted = 0
+        with self._lock:
+            if self.checkpoint is None or checkpoint > self.checkpoint:
+                evicted = len(self._entries)
+                self._entries.clear()
+                self.size = 0
+                self.checkpoint = checkpoint
+            elif checkpoint < self.checkpoint:
+                return
+
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted_body = self._entries.popitem(last=False)
+                self.size -= len(evicted_body)
+                evicted += 1
+        if evicted:
+            stats.log_rate("response_cache_evictions", evicted)
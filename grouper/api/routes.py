@@ -1,5 +1,9 @@
 from grouper.api.handlers import (
+        Changes,
         Groups,
+        MultiGroups,
+        MultiPermissions,
+        MultiTokenValidate,
         MultiUsers,
         NotFound,
         Permissions,
@@ -29,6 +33,11 @@ HANDLERS = [
     (r"/service_accounts/{}".format(NAME_VALIDATION), ServiceAccounts),
 
     (r"/multi/users", MultiUsers),
+    (r"/multi/groups", MultiGroups),
+    (r"/multi/permissions", MultiPermissions),
+    (r"/multi/token/validate", MultiTokenValidate),
+
+    (r"/changes", Changes),
 
     (r"/debug/health", HealthCheck),
 
@@ -3,8 +3,24 @@ from ..settings import Settings, settings as base_settings
 
 settings = Settings.from_settings(base_settings, {
     "address": None,
+    "compress_responses": True,
     "debug": False,
+    "db_executor_max_queue": 1000,
+    "db_executor_threads": 8,
+    "graph_build_in_child": False,
+    "graph_build_timeout": 600,
+    "graph_change_history_entries": 0,
+    "graph_details_cache_entries": 10000,
+    "graph_details_cache_max_nodes": 5000000,
+    "graph_engine": "networkx",
+    "graph_loader_threads": 1,
+    "graph_snapshot_path": None,
+    "incremental_refresh": False,
+    "max_checkpoint_wait": 60,
     "num_processes": 1,
     "port": 8990,
     "refresh_interval": 60,
+    "response_cache_max_bytes": 67108864,
+    "share_graph_per_host": False,
+    "token_graph_max_age": 120,
 })
@@ -1,13 +1,39 @@
+import sys
+
+from tornado.concurrent import Future
 from tornado.log import access_log
 import tornado.web
 
+from grouper.executor import ExecutorFull
+
 
 class Application(tornado.web.Application):
     def __init__(self, *args, **kwargs):
         self.my_settings = kwargs.pop("my_settings", {})
         self.sentry_client = kwargs.pop("sentry_client", None)
+        # A BoundedExecutor for blocking work, or None to run it right on the IOLoop.
+        self.executor = kwargs.pop("executor", None)
         super(Application, self).__init__(*args, **kwargs)
 
+    def run_in_executor(self, fn, *args, **kwargs):
+        """Returns a Future of fn(*args, **kwargs), run on the executor if there is one.
+
+        Handlers yield it from coroutines to do blocking work, such as queries, without holding
+        up other requests.  If too much work is already waiting, the request fails with a 503.
+        """
+        if self.executor is None:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception:
+                future.set_exc_info(sys.exc_info())
+            return future
+
+        try:
+            return self.executor.submit(fn, *args, **kwargs)
+        except ExecutorFull as e:
+            raise tornado.web.HTTPError(503, str(e))
+
     def log_request(self, handler):
         if handler.get_status() < 400:
             log_method = access_log.info
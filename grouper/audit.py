@@ -4,7 +4,9 @@ from grouper.models.audit import Audit
 
 
 class UserNotAuditor(Exception):
-    pass
+    def __init__(self, message, violations=None):
+        super(UserNotAuditor, self).__init__(message)
+        self.violations = violations or []
 
 
 def user_is_auditor(username):
@@ -18,12 +20,20 @@ def user_is_auditor(username):
     Returns:
         bool: True/False.
     """
-    graph = Graph()
-    user_md = graph.get_user_details(username)
-    for perm in user_md["permissions"]:
-        if perm["permission"] == PERMISSION_AUDITOR:
-            return True
-    return False
+    return Graph().is_auditor(username)
+
+
+def get_auditor_violations(group):
+    """Return the owners/np-owners/managers in a group (and below) who are not auditors
+
+    Args:
+        group (models.Group): The group at the top of the subtree to check.
+
+    Returns:
+        list of graph.AuditorViolation: One for every user with a controlling role in a group of
+            the subtree who lacks the audit permission, sorted by group and user name.
+    """
+    return Graph().get_auditor_violations(group.name)
 
 
 def assert_controllers_are_auditors(group):
@@ -34,37 +44,22 @@ def assert_controllers_are_auditors(group):
     have audit permissions.
 
     Raises:
-        UserNotAuditor: If a user is found that violates the audit training policy, then this
-            exception is raised.
+        UserNotAuditor: If any users are found that violate the audit training policy, then this
+            exception is raised, describing all of them and listing them in its violations.
 
     Returns:
         bool: True if the tree is completely controlled by auditors, else it will raise as above.
     """
-    graph = Graph()
-    checked, queue = set(), [group.name]
-    while queue:
-        cur_group = queue.pop()
-        if cur_group in checked:
-            continue
-        details = graph.get_group_details(cur_group)
-        for chk_user, info in details["users"].iteritems():
-            if chk_user in checked:
-                continue
-            # Only examine direct members of this group, because then the role is accurate.
-            if info["distance"] == 1:
-                if info["rolename"] == "member":
-                    continue
-                if user_is_auditor(chk_user):
-                    checked.add(chk_user)
-                else:
-                    raise UserNotAuditor(
-                        "User {} has role '{}' in the group {} but lacks the auditing "
-                        "permission ('{}').".format(
-                            chk_user, info["rolename"], cur_group, PERMISSION_AUDITOR))
-        # Now put subgroups into the queue to examine.
-        for chk_group, info in details["subgroups"].iteritems():
-            if info["distance"] == 1:
-                queue.append(chk_group)
+    violations = get_auditor_violations(group)
+    if violations:
+        raise UserNotAuditor(
+            " ".join(
+                "User {} has role '{}' in the group {} but lacks the auditing "
+                "permission ('{}').".format(
+                    violation.username, violation.rolename, violation.groupname,
+                    PERMISSION_AUDITOR)
+                for violation in violations),
+            violations)
 
     # If we didn't raise, we're valid.
     return True
@@ -93,9 +88,7 @@ def assert_can_join(group, user_or_group, role="member"):
         return True
 
     # Else, we have to check if the group is audited. If not, anybody can join.
-    graph = Graph()
-    group_md = graph.get_group_details(group.name)
-    if not group_md["audited"]:
+    if not Graph().is_audited(group.name):
         return True
 
     # Audited group. Easy case, let's see if we're checking a user. If so, the user must be
@@ -109,11 +102,7 @@ def assert_can_join(group, user_or_group, role="member"):
                 user_or_group.name, PERMISSION_AUDITOR))
 
     # No, this is a group-joining-group case. In this situation we must walk the entire group
-    # subtree and ensure that all owners/np-owners/managers are considered auditors. This data
-    # is contained in the group metadetails, which contains all eventual members.
-    #
-    # We have to fetch each group's details individually though to figure out what someone's role
-    # is in that particular group.
+    # subtree and ensure that all owners/np-owners/managers are considered auditors.
     return assert_controllers_are_auditors(user_or_group)
 
 
@@ -17,6 +17,8 @@ from grouper.email_util import (
 from grouper.graph import Graph
 from grouper.group import get_audited_groups
 from grouper.models.base.session import Session
+from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.group import Group
 from grouper.models.group_edge import APPROVER_ROLE_INDICES, GroupEdge
 from grouper.models.user import User
@@ -61,6 +63,9 @@ class BackgroundProcessor(object):
         an email notification.  This function finds all expired edges, logs the
         expiration to the audit log, and sends a notification message.  It's meant
         to be run from the background processing thread.
+
+        Graphs refreshed incrementally only reload the groups in the change log, so each
+        expiration is logged there for the group the member is leaving.
         """
         now = datetime.utcnow()
 
@@ -79,6 +84,7 @@ class BackgroundProcessor(object):
         for edge in edges:
             notify_edge_expiration(self.settings, session, edge)
             edge.active = False
+            GraphChange.record(session, groups=[edge.group.groupname])
             session.commit()
 
     def expire_nonauditors(self, session):
@@ -121,6 +127,14 @@ class BackgroundProcessor(object):
                 notify_nonauditor_flagged(self.settings, session, edge)
         session.commit()
 
+    def prune_graph_changes(self, session):
+        # type: (Session) -> None
+        """Drop graph change log entries too old to be useful for an incremental refresh."""
+        counter = Counter.get(session, name="updates")
+        if counter is None:
+            return
+        GraphChange.prune(session, counter.count - self.settings.graph_changes_to_keep)
+
     def run(self):
         # type: () -> None
         initial_url = get_database_url(self.settings)
@@ -141,6 +155,9 @@ class BackgroundProcessor(object):
                     self.logger.info("Pruning old traces....")
                     prune_old_traces(session)
 
+                    self.logger.info("Pruning old graph changes....")
+                    self.prune_graph_changes(session)
+
                     session.commit()
 
                 stats.log_gauge("successful-background-update", 1)
@@ -12,7 +12,7 @@ from grouper.plugin import initialize_plugins
 from grouper.plugin.exceptions import PluginsDirectoryDoesNotExist
 from grouper.settings import default_settings_path
 from grouper.setup import setup_logging
-from grouper.util import get_database_url
+from grouper.util import get_database_url, get_db_pool_settings
 
 if TYPE_CHECKING:
     from typing import List  # noqa
@@ -49,7 +49,8 @@ def start_processor(args, sentry_client):
 
     # setup database
     logging.debug("configure database session")
-    Session.configure(bind=get_db_engine(get_database_url(settings)))
+    db_engine = get_db_engine(get_database_url(settings), **get_db_pool_settings(settings))
+    Session.configure(bind=db_engine)
 
     settings.start_config_thread(args.config, "background")
 
@@ -2,5 +2,6 @@ from ..settings import Settings, settings as base_settings
 
 
 settings = Settings.from_settings(base_settings, {
+    "graph_changes_to_keep": 10000,
     "sleep_interval": 60,
 })
@@ -78,5 +78,9 @@ RESERVED_NAMES = [
 # Maximum length a name can be. This applies to user names and permission arguments.
 MAX_NAME_LENGTH = 128
 
+# Rows fetched from the database at a time by queries that load whole tables, like the ones that
+# build the graph.
+BULK_QUERY_BATCH_SIZE = 1000
+
 # Grouper used UserMetadata data_keys
 USER_METADATA_SHELL_KEY = "shell"
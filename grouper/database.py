@@ -4,11 +4,37 @@ import os
 from threading import Thread
 from time import sleep
 
+from tornado.process import task_id
+
 from grouper import stats
+from grouper.graph import GraphSnapshot, InvalidGraphSnapshot
 from grouper.models.base.session import Session
 from grouper.util import get_database_url
 
 
+def start_graph_refresher(settings, graph, sentry_client):
+    """Start a daemon thread that keeps the graph up to date.
+
+    Every process normally polls the database on its own.  With share_graph_per_host set (and a
+    graph_snapshot_path), only the first process of a forked server does, writing each new graph
+    to the snapshot file, and the other processes on the host load it from there.
+
+    That saves the database load and the CPU time of building the graph in every process.  With
+    the compact graph engine, followers also use its adjacency arrays straight from the mapped
+    snapshot file, so one copy of them is shared by the whole host.
+
+    TODO: everything else in a snapshot (node names, metadata, closures, grants) is still unpickled
+    into each follower's own heap, so most of the graph's memory is still per process.
+    """
+    if settings.share_graph_per_host and settings.graph_snapshot_path and task_id():
+        refresher = SnapshotRefreshThread(settings, graph, settings.refresh_interval)
+    else:
+        refresher = DbRefreshThread(settings, graph, settings.refresh_interval, sentry_client)
+    refresher.daemon = True
+    refresher.start()
+    return refresher
+
+
 class DbRefreshThread(Thread):
     """Background thread for refreshing the in-memory cache of the graph."""
     def __init__(self, settings, graph, refresh_interval, sentry_client, *args, **kwargs):
@@ -34,7 +60,10 @@ class DbRefreshThread(Thread):
                 if get_database_url(self.settings) != initial_url:
                     self.crash()
                 with closing(Session()) as session:
-                    self.graph.update_from_db(session)
+                    self.graph.update_from_db(
+                        session, incremental=self.settings.incremental_refresh)
+                if self.settings.graph_snapshot_path:
+                    self.write_snapshot(self.settings.graph_snapshot_path)
 
                 stats.log_gauge("successful-db-update", 1)
                 stats.log_gauge("failed-db-update", 0)
@@ -45,3 +74,43 @@ class DbRefreshThread(Thread):
                 self.crash()
 
             sleep(self.refresh_interval)
+
+    def write_snapshot(self, path):
+        try:
+            self.graph.write_snapshot(path)
+        except (OSError, IOError, InvalidGraphSnapshot) as e:
+            # Followers keep serving the last snapshot they read; this process is still current.
+            self.logger.warning("Can't write graph snapshot %s: %s", path, e)
+            stats.log_rate("graph_snapshot_write_failures", 1)
+
+
+class SnapshotRefreshThread(Thread):
+    """Background thread for following the graph snapshot written by another process."""
+    def __init__(self, settings, graph, refresh_interval, *args, **kwargs):
+        self.settings = settings
+        self.graph = graph
+        self.refresh_interval = refresh_interval
+        self.logger = logging.getLogger(__name__)
+        Thread.__init__(self, *args, **kwargs)
+
+    def run(self):
+        path = self.settings.graph_snapshot_path
+        while True:
+            self.logger.debug("Updating Graph from snapshot.")
+            try:
+                checkpoint = GraphSnapshot.read_checkpoint(path)
+                if checkpoint > self.graph.checkpoint:
+                    self.graph.load_snapshot(path)
+                if self.graph.checkpoint >= checkpoint:
+                    # The writer sets the file's time to when it last found it current.
+                    self.graph.refreshed_at = max(
+                        self.graph.refreshed_at, os.path.getmtime(path))
+                stats.log_gauge("successful-snapshot-update", 1)
+                stats.log_gauge("failed-snapshot-update", 0)
+            except (InvalidGraphSnapshot, OSError) as e:
+                # The writer may not have written one yet; keep serving what we have.
+                self.logger.warning("Can't read graph snapshot %s: %s", path, e)
+                stats.log_gauge("successful-snapshot-update", 0)
+                stats.log_gauge("failed-snapshot-update", 1)
+
+            sleep(self.refresh_interval)
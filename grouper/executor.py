@@ -0,0 +1,83 @@
+"""Running blocking work, such as database queries, off the tornado IOLoop.
+
+A server process handles all of its requests on one IOLoop thread, so a handler that waits on
+the database holds up every other request in that process meanwhile.  Handlers instead hand such
+work to the BoundedExecutor of their Application and yield the Future it returns, and the IOLoop
+serves other requests until the work is done.
+"""
+
+from multiprocessing.pool import ThreadPool
+import sys
+from threading import Lock
+import time
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from grouper import stats
+
+
+class ExecutorFull(Exception):
+    """Raised when too much work is already waiting for a thread."""
+
+
+class BoundedExecutor(object):
+    def __init__(self, max_workers, max_queue=0, name="db_executor"):
+        """Create an executor running up to max_workers jobs at once.
+
+        Args:
+            max_workers: the number of threads
+            max_queue: the most jobs that may wait for a thread before submit raises
+                ExecutorFull, or 0 for no limit
+            name: the prefix of the stats reported: <name>_queue_depth, the number of jobs
+                waiting as each is submitted, and <name>_wait_ms and <name>_run_ms, how long
+                each job waited for a thread and ran
+        """
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.name = name
+        self.queued = 0
+        self._lock = Lock()
+        self._pool = None  # Started on first use, because servers fork after creating it.
+
+    def submit(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on one of the threads.
+
+        Must be called on the thread of the IOLoop the result is wanted on.
+
+        Returns:
+            a Future resolved on the current IOLoop with what fn returns or raises
+
+        Raises:
+            ExecutorFull: if max_queue jobs are already waiting
+        """
+        with self._lock:
+            if self.max_queue and self.queued >= self.max_queue:
+                stats.log_rate("{}_rejected".format(self.name), 1)
+                raise ExecutorFull("{} jobs are already waiting".format(self.queued))
+            self.queued += 1
+            queued = self.queued
+            if self._pool is None:
+                self._pool = ThreadPool(self.max_workers)
+        stats.log_gauge("{}_queue_depth".format(self.name), queued)
+
+        io_loop = IOLoop.current()
+        future = Future()
+        submitted = time.time()
+
+        def run():
+            with self._lock:
+                self.queued -= 1
+            start = time.time()
+            stats.log_rate("{}_wait_ms".format(self.name), int((start - submitted) * 1000))
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                io_loop.add_callback(future.set_exc_info, sys.exc_info())
+            else:
+                io_loop.add_callback(future.set_result, result)
+            finally:
+                stats.log_rate("{}_run_ms".format(self.name), int((time.time() - start) * 1000))
+
+        self._pool.apply_async(run)
+        return future
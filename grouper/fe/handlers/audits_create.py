@@ -46,9 +46,7 @@ class AuditsCreate(GrouperHandler):
 
         # Step 2, find all audited groups and schedule audits for each.
         audited_groups = []
-        for groupname in self.graph.groups:
-            if not self.graph.get_group_details(groupname)["audited"]:
-                continue
+        for groupname in self.graph.audited_groups:
             group = Group.get(self.session, name=groupname)
             audit = Audit(
                 group_id=group.id,
@@ -3,7 +3,7 @@ from sqlalchemy.exc import IntegrityError
 from grouper.fe.forms import GroupEditForm
 from grouper.fe.util import GrouperHandler
 from grouper.models.audit_log import AuditLog
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.group import Group
 from grouper.role_user import is_role_user
 from grouper.user_group import user_can_manage_group
@@ -45,13 +45,14 @@ class GroupEdit(GrouperHandler):
                 alerts=self.get_form_alerts(form.errors)
             )
 
+        old_groupname = group.groupname
         group.groupname = form.data["groupname"]
         group.email_address = form.data["email_address"]
         group.description = form.data["description"]
         group.canjoin = form.data["canjoin"]
         group.auto_expire = form.data["auto_expire"]
         group.require_clickthru_tojoin = form.data["require_clickthru_tojoin"]
-        Counter.incr(self.session, "updates")
+        GraphChange.record(self.session, groups=[old_groupname, group.groupname])
 
         try:
             self.session.commit()
@@ -3,6 +3,7 @@ from sqlalchemy.exc import IntegrityError
 from grouper.fe.forms import PermissionCreateForm
 from grouper.fe.util import GrouperHandler, test_reserved_names
 from grouper.models.audit_log import AuditLog
+from grouper.models.graph_change import GraphChange
 from grouper.models.permission import Permission
 from grouper.user_permissions import user_creatable_permissions
 from grouper.util import matches_glob
@@ -66,6 +67,7 @@ class PermissionsCreate(GrouperHandler):
                 alerts=self.get_form_alerts(form.errors),
             )
 
+        GraphChange.record(self.session, permissions=[permission.name])
         self.session.commit()
 
         AuditLog.log(self.session, self.current_user.id, 'create_permission',
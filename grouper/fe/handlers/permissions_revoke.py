@@ -1,6 +1,6 @@
 from grouper.fe.util import GrouperHandler
 from grouper.models.audit_log import AuditLog
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.permission_map import PermissionMap
 from grouper.user_group import user_is_owner_of_group
 from grouper.user_permissions import user_grantable_permissions
@@ -49,7 +49,7 @@ class PermissionsRevoke(GrouperHandler):
         group = mapping.group
 
         mapping.delete(self.session)
-        Counter.incr(self.session, "updates")
+        GraphChange.record(self.session, groups=[group.groupname])
         self.session.commit()
 
         AuditLog.log(self.session, self.current_user.id, 'revoke_permission',
@@ -1,7 +1,7 @@
 from grouper.constants import USER_ADMIN
 from grouper.fe.util import GrouperHandler
 from grouper.models.audit_log import AuditLog
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.group import Group
 from grouper.models.service_account import ServiceAccount
 from grouper.models.service_account_permission_map import ServiceAccountPermissionMap
@@ -35,7 +35,7 @@ class ServiceAccountPermissionRevoke(GrouperHandler):
         argument = mapping.argument
 
         mapping.delete(self.session)
-        Counter.incr(self.session, "updates")
+        GraphChange.record(self.session, users=[service_account.user.username])
         self.session.commit()
 
         AuditLog.log(self.session, self.current_user.id, "revoke_permission",
@@ -32,7 +32,8 @@ def get_group_view_template_vars(session, actor, group, graph):
     ret["members"] = group.my_members()
     ret["groups"] = group.my_groups()
     ret["service_accounts"] = get_service_accounts(session, group)
-    ret["permissions"] = group_md.get('permissions', [])
+    # Copied since mapping_id is added below and the graph's details are shared.
+    ret["permissions"] = [dict(permission) for permission in group_md.get('permissions', [])]
 
     ret["permission_requests_pending"] = []
     for req in get_pending_request_by_group(session, group):
@@ -1,10 +1,12 @@
 from sqlalchemy import or_
+from tornado import gen
 
 from grouper.fe.util import GrouperHandler
 from grouper.models.user import User
 
 
 class UsersView(GrouperHandler):
+    @gen.coroutine
     def get(self):
         # TODO: use cached users instead.
         offset = int(self.get_argument("offset", 0))
@@ -14,6 +16,15 @@ class UsersView(GrouperHandler):
         if limit > 9000:
             limit = 9000
 
+        users, total = yield self.application.run_in_executor(
+            self.get_users, offset, limit, enabled, service)
+
+        self.render(
+            "users.html", users=users, offset=offset, limit=limit, total=total,
+            enabled=enabled, service=service,
+        )
+
+    def get_users(self, offset, limit, enabled, service):
         if service:
             users = self.session.query(User).filter(
                 User.enabled == enabled,
@@ -29,9 +40,4 @@ class UsersView(GrouperHandler):
                 User.is_service_account == False,
             ).order_by(User.username)
         total = users.count()
-        users = users.offset(offset).limit(limit).all()
-
-        self.render(
-            "users.html", users=users, offset=offset, limit=limit, total=total,
-            enabled=enabled, service=service,
-        )
+        return users.offset(offset).limit(limit).all(), total
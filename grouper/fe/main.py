@@ -9,26 +9,36 @@ import tornado.ioloop
 
 from grouper import stats
 from grouper.app import Application
-from grouper.database import DbRefreshThread
+from grouper.database import start_graph_refresher
 from grouper.error_reporting import get_sentry_client, setup_signal_handlers
+from grouper.executor import BoundedExecutor
 import grouper.fe
 from grouper.fe.routes import HANDLERS
 from grouper.fe.settings import settings
 from grouper.fe.template_util import get_template_env
 from grouper.graph import Graph
+from grouper.graph_builder import GraphBuilder
+from grouper.graph_engine import GRAPH_ENGINES
 from grouper.models.base.session import get_db_engine, Session
 from grouper.plugin import get_plugin_proxy, initialize_plugins
 from grouper.plugin.exceptions import PluginsDirectoryDoesNotExist
 from grouper.setup import build_arg_parser, setup_logging
-from grouper.util import get_database_url
+from grouper.util import get_database_url, get_db_pool_settings
 
 if TYPE_CHECKING:
     import argparse  # noqa: F401
-    from typing import List  # noqa: F401
+    from typing import List, Optional  # noqa: F401
     from grouper.error_reporting import SentryProxy  # noqa: F401
     from grouper.fe.settings import Settings  # noqa: F401
 
 
+def get_executor(settings):
+    # type: (Settings) -> Optional[BoundedExecutor]
+    if not settings.db_executor_threads:
+        return None
+    return BoundedExecutor(settings.db_executor_threads, settings.db_executor_max_queue)
+
+
 def get_application(settings, sentry_client, deployment_name):
     # type: (Settings, SentryProxy, str) -> Application
     tornado_settings = {
@@ -46,6 +56,7 @@ def get_application(settings, sentry_client, deployment_name):
         HANDLERS,
         my_settings=my_settings,
         sentry_client=sentry_client,
+        executor=get_executor(settings),
         **tornado_settings
     )
 
@@ -70,7 +81,7 @@ def start_server(args, sentry_client):
     # setup database
     logging.debug("configure database session")
     database_url = args.database_url or get_database_url(settings)
-    Session.configure(bind=get_db_engine(database_url))
+    Session.configure(bind=get_db_engine(database_url, **get_db_pool_settings(settings)))
 
     application = get_application(settings, sentry_client, args.deployment_name)
 
@@ -98,13 +109,20 @@ def start_server(args, sentry_client):
 
     settings.start_config_thread(args.config, "fe")
 
-    with closing(Session()) as session:
-        graph = Graph()
-        graph.update_from_db(session)
-
-    refresher = DbRefreshThread(settings, graph, settings.refresh_interval, sentry_client)
-    refresher.daemon = True
-    refresher.start()
+    graph = Graph()
+    graph.engine = GRAPH_ENGINES[settings.graph_engine]
+    graph.loader_threads = settings.graph_loader_threads
+    if settings.graph_build_in_child:
+        graph.builder = GraphBuilder(settings.graph_build_timeout, settings.plugin_dirs,
+                                     settings.plugin_module_paths, "grouper_fe")
+    graph.details_cache_entries = settings.graph_details_cache_entries
+    graph.details_cache_max_nodes = settings.graph_details_cache_max_nodes
+    # Serve from the last snapshot if there is one; the refresher catches up from there.
+    if not settings.graph_snapshot_path or not graph.load_snapshot(settings.graph_snapshot_path):
+        with closing(Session()) as session:
+            graph.update_from_db(session)
+
+    start_graph_refresher(settings, graph, sentry_client)
 
     try:
         tornado.ioloop.IOLoop.instance().start()
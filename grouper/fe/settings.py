@@ -19,12 +19,23 @@ settings = FeSettings.from_settings(base_settings, {
     "cdnjs_prefix": "//cdnjs.cloudflare.com",
     "date_format": "%Y-%m-%d %I:%M %p",
     "debug": False,
+    "db_executor_max_queue": 1000,
+    "db_executor_threads": 8,
+    "graph_build_in_child": False,
+    "graph_build_timeout": 600,
+    "graph_details_cache_entries": 10000,
+    "graph_details_cache_max_nodes": 5000000,
+    "graph_engine": "networkx",
+    "graph_loader_threads": 1,
+    "graph_snapshot_path": None,
     "how_to_get_help": None,
+    "incremental_refresh": False,
     "num_processes": 1,
     "permission_request_dropdown_help": None,
     "permission_request_text_help": None,
     "port": 8989,
     "refresh_interval": 60,
+    "share_graph_per_host": False,
     "service_account_email_domain": "svc.localhost",
     "shell": [["/bin/false", "Shell support in Grouper has not been setup by the administrator"]],
     "site_docs": None,
@@ -11,6 +11,7 @@ from uuid import uuid4
 
 from plop.collector import Collector
 import sqlalchemy.exc
+from tornado import gen
 import tornado.web
 from tornado.web import RequestHandler
 from typing import Dict, List  # noqa: F401
@@ -22,7 +23,7 @@ from grouper.graph import Graph
 from grouper.models.base.session import get_db_engine, Session
 from grouper.models.user import User
 from grouper.user_permissions import user_permissions
-from grouper.util import get_database_url
+from grouper.util import get_database_url, get_db_pool_settings
 
 
 class Alert(object):
@@ -135,7 +136,8 @@ class GrouperHandler(RequestHandler):
         except sqlalchemy.exc.OperationalError:
             # Failed to connect to database or create user, try to reconfigure the db. This invokes
             # the fetcher to try to see if our URL string has changed.
-            Session.configure(bind=get_db_engine(get_database_url(settings)))
+            db_engine = get_db_engine(get_database_url(settings), **get_db_pool_settings(settings))
+            Session.configure(bind=db_engine)
             raise DatabaseFailure()
 
         # service accounts are, by definition, not interactive users
@@ -144,7 +146,10 @@ class GrouperHandler(RequestHandler):
 
         return user
 
+    @gen.coroutine
     def prepare(self):
+        # Look the user up (and maybe create it) off the IOLoop; current_user then returns it.
+        self.current_user = yield self.application.run_in_executor(self.get_current_user)
         if not self.current_user or not self.current_user.enabled:
             self.forbidden()
             self.finish()
@@ -1,14 +1,30 @@
+from array import array
 from collections import defaultdict, namedtuple
+from contextlib import closing
+import cPickle as pickle
+import ctypes
 from datetime import datetime
+from functools import partial
 import logging
+import mmap
+from multiprocessing.pool import ThreadPool
+import os
+import stat
 from threading import RLock
+import time
 
-from networkx import DiGraph, single_source_shortest_path
 from sqlalchemy import or_
 from sqlalchemy.orm import aliased
-from sqlalchemy.sql import label, literal
-
+from sqlalchemy.sql import false, label, literal, true
+
+from grouper import stats
+from grouper.constants import BULK_QUERY_BATCH_SIZE, PERMISSION_AUDITOR
+from grouper.graph_cache import DetailsCache
+from grouper.graph_diff import ChangeHistory, diff_snapshots
+from grouper.graph_engine import NetworkXEngine
+from grouper.models.base.session import Session
 from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.group import Group
 from grouper.models.group_edge import GROUP_EDGE_ROLES, GroupEdge
 from grouper.models.group_service_accounts import GroupServiceAccount
@@ -19,9 +35,9 @@ from grouper.models.service_account import ServiceAccount
 from grouper.models.user import User
 from grouper.models.user_metadata import UserMetadata
 from grouper.models.user_password import UserPassword
+from grouper.models.user_token import UserToken
 from grouper.plugin import get_plugin_proxy
 from grouper.public_key import get_all_public_key_tags
-from grouper.role_user import is_role_user
 from grouper.service_account import all_service_account_permissions
 from grouper.util import singleton
 
@@ -31,6 +47,28 @@ MEMBER_TYPE_MAP = {
 }
 EPOCH = datetime(1970, 1, 1)
 
+# What can be asked for in the fields argument of get_user_details and get_group_details: keys
+# of the details, plus "paths" for the path of each group, member and permission in them.
+USER_DETAILS_FIELDS = frozenset(["groups", "permissions", "paths"])
+GROUP_DETAILS_FIELDS = frozenset(
+    ["users", "subgroups", "groups", "permissions", "audited", "service_accounts", "paths"])
+
+# Past this many changed users and groups, an incremental refresh is no cheaper than a rebuild.
+MAX_INCREMENTAL_CHANGES = 1000
+
+# Snapshot files start with SNAPSHOT_MAGIC, then a pickled header, the engine's arrays if it has
+# any, and the pickled data.  Bump SNAPSHOT_VERSION whenever the layout of what a GraphSnapshot
+# holds changes, so that files written by older code are ignored rather than misread.
+SNAPSHOT_MAGIC = "GROUPER-GRAPH\n"
+SNAPSHOT_VERSION = 5
+# Each array starts at a multiple of this many bytes into the snapshot.
+SNAPSHOT_ARRAY_ALIGNMENT = 8
+# How arrays of each array.array typecode are read from a mapped snapshot file.
+SNAPSHOT_ARRAY_CTYPES = {"b": ctypes.c_byte, "i": ctypes.c_int}
+
+# Stands in for an engine in pickled snapshot data; its arrays are stored apart.
+_SplitEngine = namedtuple("_SplitEngine", ["engine", "state"])
+
 
 @singleton
 def Graph():  # noqa
@@ -46,6 +84,30 @@ GroupTuple = namedtuple(
     "GroupTuple",
     ["id", "groupname", "name", "description", "canjoin", "enabled", "service_account", "type"])
 
+# The groups a user is in and the permissions it gets from them, precomputed for every user when
+# the graph is loaded.  np_owner_groups are direct memberships with the "np-owner" role, which
+# confer neither permissions nor membership in the groups above; groups are all the others.
+UserClosure = namedtuple("UserClosure", ["np_owner_groups", "groups", "permissions"])
+# A group in a UserClosure; path runs from the user to the group.
+ClosureGroup = namedtuple("ClosureGroup", ["name", "path", "distance", "role"])
+# A permission in a UserClosure; permission is the MappedPermission granted to the last group
+# on path.
+ClosurePermission = namedtuple("ClosurePermission", ["permission", "path", "distance"])
+
+# Who holds a permission, precomputed for every permission when the graph is loaded.
+# direct_groups maps each group granted it (or an alias of it) to its MappedPermissions, groups
+# holds those groups and every group below them, and service_accounts maps each service account
+# granted it to its ServiceAccountPermissions.
+PermissionGrants = namedtuple("PermissionGrants", ["direct_groups", "groups", "service_accounts"])
+
+# A user who controls a group (is a direct owner, np-owner, or manager of it) without having the
+# auditor permission.
+AuditorViolation = namedtuple("AuditorViolation", ["username", "rolename", "groupname"])
+
+# What validating a user's token needs to know about it; enabled is False once the token, or in
+# get_user_token the user, has been disabled.
+UserTokenTuple = namedtuple("UserTokenTuple", ["name", "hashed_secret", "enabled"])
+
 
 # Raise these exceptions when asking about users or groups that are not cached.
 class NoSuchUser(Exception):
@@ -56,36 +118,677 @@ class NoSuchGroup(Exception):
     pass
 
 
-class GroupGraph(object):
-    def __init__(self):
-        self.logger = logging.getLogger(__name__)
-        self._graph = None
-        self._rgraph = None
-        self.lock = RLock()  # Graph structure.
-        self.update_lock = RLock()  # Limit to 1 updating thread at a time.
-        self.users = set()  # Enabled user names.
-        self.groups = set()  # Group names.
-        self.permissions = set()  # Permission names.
-        self.checkpoint = 0
-        self.checkpoint_time = 0
-        self.user_metadata = {}  # username -> {metadata:[{}] public_keys:[{}]}.
-        self.group_metadata = {}
-        self.group_service_accounts = {}
-        self.permission_metadata = {}  # TODO: rename.  This is about permission grants.
-        self.service_account_permissions = {}
-        self.permission_tuples = set()  # Mock Permission instances.
-        self.group_tuples = {}  # groupname -> Mock Group instance.
-        self.disabled_group_tuples = {}  # groupname -> Mock Group instance.
+class InvalidGraphSnapshot(Exception):
+    """A snapshot file is missing, damaged, or was written in another format."""
+    pass
+
+
+def _in_names(column, names):
+    """Filter for column being in names, or no filter at all if names is None."""
+    if names is None:
+        return true()
+    if not names:
+        return false()
+    return column.in_(names)
+
+
+def _array_to_string(values):
+    """Returns the typecode and contents of an array.array, or of an array read by load."""
+    if isinstance(values, array):
+        return values.typecode, values.tostring()
+    typecodes = {ctype: typecode for typecode, ctype in SNAPSHOT_ARRAY_CTYPES.iteritems()}
+    return typecodes[values._type_], buffer(values)[:]
+
+
+class GraphSnapshot(object):
+    """Everything the graph caches as of one checkpoint.
+
+    A snapshot is never modified once built: GroupGraph.update_from_db builds a new one and
+    publishes it by swapping a single reference.  Readers that need several consistent lookups
+    should grab GroupGraph.snapshot once and query it, without any locking.
+    """
+
+    def __init__(self, checkpoint=0, checkpoint_time=0, data=None):
+        data = data or {}
+        self._data = data  # Kept to write the snapshot out again.
+        self.checkpoint = checkpoint
+        self.checkpoint_time = checkpoint_time
+        self.graph = data.get("graph")  # Graph structure, in an engine from grouper.graph_engine.
+        self.users = data.get("users", set())  # Enabled user names.
+        self.groups = data.get("groups", set())  # Group names.
+        self.permissions = data.get("permissions", set())  # Permission names.
+        # username -> {metadata:[{}] public_keys:[{}]}.
+        self.user_metadata = data.get("user_metadata", {})
+        self.group_metadata = data.get("group_metadata", {})
+        self.group_service_accounts = data.get("group_service_accounts", {})
+        # TODO: rename.  This is about permission grants.
+        self.permission_metadata = data.get("permission_metadata", {})
+        self.service_account_permissions = data.get("service_account_permissions", {})
+        # Mock Permission instances.
+        self.permission_tuples = data.get("permission_tuples", set())
+        # groupname -> Mock Group instance.
+        self.group_tuples = data.get("group_tuples", {})
+        self.disabled_group_tuples = data.get("disabled_group_tuples", {})
+        self.user_closures = data.get("user_closures", {})  # username -> UserClosure.
+        # username -> {token name: UserTokenTuple}.
+        self.user_tokens = data.get("user_tokens", {})
+        # permission name -> PermissionGrants.
+        self.permission_grants = data.get("permission_grants", {})
+        # Names of groups with an audited permission, and of those and all groups below them.
+        self.directly_audited_groups = data.get("directly_audited_groups", frozenset())
+        self.audited_groups = data.get("audited_groups", frozenset())
+        self.auditors = data.get("auditors", frozenset())  # Names of users with PERMISSION_AUDITOR.
+        # Results of get_group_details and get_user_details; set by GroupGraph when publishing.
+        self.details_cache = DetailsCache()
+
+    def dump(self, snapshot_file):
+        """Write the snapshot to an open file, in the format read by load_from.
+
+        An engine's arrays are written raw ahead of the rest of the data, so that load can use
+        them from the mapped file instead of each process keeping its own copy.
+        """
+        data = self._data
+        arrays = []
+        split_arrays = getattr(data.get("graph"), "split_arrays", None)
+        if split_arrays is not None:
+            state, arrays = split_arrays()
+            data = dict(data, graph=_SplitEngine(type(data["graph"]), state))
+        arrays = [_array_to_string(values) for values in arrays]
+
+        header = pickle.dumps({
+            "version": SNAPSHOT_VERSION,
+            "checkpoint": self.checkpoint,
+            "checkpoint_time": self.checkpoint_time,
+            "arrays": [(typecode, len(raw)) for typecode, raw in arrays],
+        }, pickle.HIGHEST_PROTOCOL)
+        snapshot_file.write(SNAPSHOT_MAGIC)
+        snapshot_file.write(header)
+        position = len(SNAPSHOT_MAGIC) + len(header)
+        for _, raw in arrays:
+            padding = -position % SNAPSHOT_ARRAY_ALIGNMENT
+            snapshot_file.write("\0" * padding)
+            snapshot_file.write(raw)
+            position += padding + len(raw)
+        pickle.dump(data, snapshot_file, pickle.HIGHEST_PROTOCOL)
+
+    def write(self, path):
+        """Write the snapshot to path, atomically replacing any file already there.
+
+        Snapshots hold password hashes and token secrets, so only our user may read the file.
+        """
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as snapshot_file:
+                self.dump(snapshot_file)
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+    @staticmethod
+    def _open(path):
+        """Open the snapshot file at path for reading.
+
+        Unpickling a file can run any code it says to, so a file is refused unless our user owns
+        it and nobody else may write to it.
+        """
+        try:
+            snapshot_file = open(path, "rb")
+        except IOError as e:
+            raise InvalidGraphSnapshot(str(e))
+        file_stat = os.fstat(snapshot_file.fileno())
+        if file_stat.st_uid != os.getuid() or file_stat.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            snapshot_file.close()
+            raise InvalidGraphSnapshot("Not owned by us, or writable by others")
+        return snapshot_file
+
+    @staticmethod
+    def _read_header(snapshot_file):
+        if snapshot_file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise InvalidGraphSnapshot("Not a graph snapshot")
+        try:
+            header = pickle.load(snapshot_file)
+        except Exception as e:
+            raise InvalidGraphSnapshot("Unreadable header: {}".format(e))
+        if not isinstance(header, dict) or header.get("version") != SNAPSHOT_VERSION:
+            raise InvalidGraphSnapshot("Unsupported header {!r}".format(header))
+        if any(key not in header for key in ("checkpoint", "checkpoint_time", "arrays")):
+            raise InvalidGraphSnapshot("Incomplete header {!r}".format(header))
+        return header
+
+    @staticmethod
+    def _read_array(snapshot_file, start, typecode, size):
+        """Read an array written by dump: a view of the file if it's mapped, else a copy."""
+        position = snapshot_file.tell() + (start - snapshot_file.tell()) % SNAPSHOT_ARRAY_ALIGNMENT
+        if isinstance(snapshot_file, mmap.mmap):
+            ctype = SNAPSHOT_ARRAY_CTYPES[typecode]
+            values = (ctype * (size // ctypes.sizeof(ctype))).from_buffer(snapshot_file, position)
+            snapshot_file.seek(position + size)
+            return values
+
+        snapshot_file.read(position - snapshot_file.tell())
+        raw = snapshot_file.read(size)
+        if len(raw) != size:
+            raise ValueError("Truncated array")
+        values = array(typecode)
+        values.fromstring(raw)
+        return values
+
+    @classmethod
+    def read_checkpoint(cls, path):
+        """Returns the checkpoint of the snapshot at path without loading it."""
+        with cls._open(path) as snapshot_file:
+            return cls._read_header(snapshot_file)["checkpoint"]
+
+    @classmethod
+    def load_from(cls, snapshot_file):
+        """Read a snapshot written by dump.  Raises InvalidGraphSnapshot if it can't be used.
+
+        snapshot_file must support tell().  If it's an mmap.mmap opened for ACCESS_COPY, the
+        engine's arrays are used from it in place, and keep it open for as long as they're used.
+        """
+        start = snapshot_file.tell()
+        header = cls._read_header(snapshot_file)
+        try:
+            arrays = [cls._read_array(snapshot_file, start, typecode, size)
+                      for typecode, size in header["arrays"]]
+        except (KeyError, TypeError, ValueError) as e:
+            raise InvalidGraphSnapshot("Unreadable arrays: {}".format(e))
+        try:
+            data = pickle.load(snapshot_file)
+        except Exception as e:
+            raise InvalidGraphSnapshot("Unreadable data: {}".format(e))
+        graph = data.get("graph")
+        if isinstance(graph, _SplitEngine):
+            data["graph"] = graph.engine.from_split_arrays(graph.state, arrays)
+        return cls(header["checkpoint"], header["checkpoint_time"], data)
+
+    @classmethod
+    def load(cls, path):
+        """Load a snapshot written by write.  Raises InvalidGraphSnapshot if it can't be used."""
+        with cls._open(path) as snapshot_file:
+            try:
+                # Unpickle straight from the mapped file rather than reading it into a string.
+                # The mapping is copy-on-write only because ctypes won't view a read-only buffer;
+                # nothing writes to it, so its pages stay shared with every other process that
+                # maps the file.
+                snapshot_map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_COPY)
+            except (EnvironmentError, ValueError) as e:
+                raise InvalidGraphSnapshot(str(e))
+
+        # Not closed here: the engine's arrays may still be using it.  It's unmapped once nothing
+        # refers to it any more.
+        return cls.load_from(snapshot_map)
 
     @property
     def nodes(self):
-        with self.lock:
-            return self._graph.nodes()
+        return self.graph.nodes()
 
     @property
     def edges(self):
-        with self.lock:
-            return self._graph.edges()
+        return self.graph.edges()
+
+    def get_permissions(self, audited=False):
+        """ Get the list of permissions as PermissionTuple instances sorted by name. """
+        permissions = sorted(self.permission_tuples, key=lambda p: p.name)
+        if audited:
+            permissions = filter(lambda p: p.audited, permissions)
+        return permissions
+
+    def get_permission_details(self, name, expose_aliases=True):
+        """ Get a permission and what groups and service accounts it's assigned to. """
+        return self._get_permission_details_many([name], expose_aliases)[name]
+
+    def get_permission_details_many(self, names, expose_aliases=True):
+        """ Get the details of each of the given permissions as a dict of name: details, leaving
+        out missing permissions.  Each group granted any of them is walked once, however many of
+        the permissions it's granted. """
+        return self._get_permission_details_many(
+            [name for name in names if name in self.permissions], expose_aliases)
+
+    def _get_permission_details_many(self, names, expose_aliases):
+        out = {}
+        granted = {}  # groupname -> names of the permissions granted to it.
+        for name in names:
+            data = out[name] = {
+                "groups": {},
+                "service_accounts": {},
+            }
+
+            grants = self.permission_grants.get(name)
+            if grants is None:
+                continue
+
+            # Groups granted the permission directly and all the groups below them.
+            for groupname in grants.groups:
+                granted.setdefault(groupname, []).append(name)
+
+            for account, permissions in grants.service_accounts.iteritems():
+                data["service_accounts"][account] = {
+                    "permissions": [
+                        {
+                            "permission": permission.permission,
+                            "argument": permission.argument,
+                            "granted_on": (permission.granted_on - EPOCH).total_seconds(),
+                        } for permission in permissions
+                    ],
+                }
+
+        for groupname, permission_names in granted.iteritems():
+            walks = {}
+            for name in permission_names:
+                out[name]["groups"][groupname] = self._get_cached_group_details(
+                    groupname, None, name, expose_aliases, walks)
+
+        return out
+
+    def get_direct_grants(self, name):
+        """ Get the MappedPermissions granting a permission directly to groups, leaving out
+        aliases, sorted by groupname and argument. """
+        grants = self.permission_grants.get(name)
+        if grants is None:
+            return []
+        return sorted(
+            (permission
+             for permissions in grants.direct_groups.itervalues()
+             for permission in permissions
+             if not permission.alias),
+            key=lambda p: (p.groupname, p.argument))
+
+    def get_disabled_groups(self):
+        """ Get the list of disabled groups as GroupTuple instances sorted by groupname. """
+        return sorted(self.disabled_group_tuples.values(), key=lambda g: g.groupname)
+
+    def get_groups(self, audited=False, directly_audited=False):
+        """ Get the list of groups as GroupTuple instances sorted by groupname. """
+        groups = sorted(self.group_tuples.values(), key=lambda g: g.groupname)
+        if directly_audited:
+            return [group for group in groups if group.groupname in self.directly_audited_groups]
+        if audited:
+            return [group for group in groups if group.groupname in self.audited_groups]
+        return groups
+
+    def is_audited(self, groupname):
+        """ Whether a group or one of the groups above it has an audited permission.  Raise
+        NoSuchGroup for missing groups. """
+        if groupname not in self.groups:
+            raise NoSuchGroup("Group %s is either missing or disabled." % groupname)
+        return groupname in self.audited_groups
+
+    def is_auditor(self, username):
+        """ Whether a user has the auditor permission.  Raise NoSuchUser for missing users. """
+        if username not in self.user_metadata:
+            raise NoSuchUser(username)
+        return username in self.auditors
+
+    def get_user_token(self, username, name):
+        """ Get a UserTokenTuple for a user's token, which isn't enabled if the user is disabled,
+        or None if there's no such token. """
+        token = self.user_tokens.get(username, {}).get(name)
+        if token is not None and token.enabled:
+            user_metadata = self.user_metadata.get(username)
+            if user_metadata is None or not user_metadata["enabled"]:
+                token = token._replace(enabled=False)
+        return token
+
+    def get_auditor_violations(self, groupname):
+        """ Get an AuditorViolation for every user who controls the group or a group below it
+        without being an auditor, sorted by groupname and username.  Raise NoSuchGroup for
+        missing groups. """
+        return [AuditorViolation(username, rolename, name)
+                for name, username, rolename in self.get_controllers(groupname)
+                if username not in self.auditors]
+
+    def get_controllers(self, groupname):
+        """ Get (groupname, username, rolename) for every direct owner, np-owner, and manager of
+        the group and of every group below it, sorted.  Raise NoSuchGroup for missing groups.
+        The result may be shared with other callers, so don't modify it. """
+        key = ("controllers", groupname)
+        controllers = self.details_cache.get(key)
+        if controllers is None:
+            controllers, subgroups = self._get_controllers(groupname)
+            # Any change to a member or role of one of these groups logs the group itself, so
+            # the subgroups (and not the controllers) are what the result depends on.
+            self.details_cache.put(key, controllers, subgroups)
+        return controllers
+
+    def _get_controllers(self, groupname):
+        start = ("Group", groupname)
+        if not self.graph.has_node(start):
+            raise NoSuchGroup("Group %s is either missing or disabled." % groupname)
+
+        controllers = []
+        seen, queue = {start}, [start]
+        while queue:
+            group = queue.pop()
+            for member, role in self.graph.members(group):
+                if member[0] == "Group":
+                    if member not in seen:
+                        seen.add(member)
+                        queue.append(member)
+                elif role != GROUP_EDGE_ROLES.index("member"):
+                    controllers.append((group[1], member[1], GROUP_EDGE_ROLES[role]))
+
+        return tuple(sorted(controllers)), frozenset(seen)
+
+    def get_group_details(self, groupname, cutoff=None, show_permission=None, expose_aliases=True,
+                          fields=None):
+        """ Get users and permissions that belong to a group. Raise NoSuchGroup
+        for missing groups.  The result may be shared with other callers, so don't modify it.
+        If fields is a frozenset of GROUP_DETAILS_FIELDS, only those are computed, and the
+        graph is only walked in the directions they need. """
+        return self._get_cached_group_details(
+            groupname, cutoff, show_permission, expose_aliases, {}, fields)
+
+    def get_group_details_many(self, groupnames, cutoff=None, expose_aliases=True, fields=None):
+        """ Get the users and permissions of each of the given groups as a dict of groupname:
+        details, leaving out missing groups. """
+        out = {}
+        for groupname in groupnames:
+            try:
+                out[groupname] = self.get_group_details(
+                    groupname, cutoff, expose_aliases=expose_aliases, fields=fields)
+            except NoSuchGroup:
+                continue
+        return out
+
+    def _get_cached_group_details(self, groupname, cutoff, show_permission, expose_aliases,
+                                  walks, fields=None):
+        # walks is (groupname, direction) -> paths at this cutoff, so that callers needing
+        # several views of the same group walk the graph from it only once.
+        key = ("group", groupname, cutoff, show_permission, expose_aliases, fields)
+        data = self.details_cache.get(key)
+        if data is None:
+            data = self._get_group_details(
+                groupname, cutoff, show_permission, expose_aliases, walks, fields)
+            # Whatever was walked, whether or not it was asked for, can change the result.
+            dependencies = set([("Group", groupname)])
+            for direction in ("members", "parents"):
+                dependencies.update(walks.get((groupname, direction), ()))
+            self.details_cache.put(key, data, frozenset(dependencies))
+        return data
+
+    def _walk_group(self, walks, group, direction, cutoff):
+        key = (group[1], direction)
+        if key not in walks:
+            if direction == "members":
+                walks[key] = self.graph.shortest_paths(group, cutoff)
+            else:
+                walks[key] = self.graph.reverse_shortest_paths(group, cutoff)
+        return walks[key]
+
+    def _get_group_details(self, groupname, cutoff, show_permission, expose_aliases, walks,
+                           fields):
+        group = ("Group", groupname)
+        if not self.graph.has_node(group):
+            raise NoSuchGroup("Group %s is either missing or disabled." % groupname)
+
+        def wanted(*names):
+            return fields is None or not fields.isdisjoint(names)
+
+        # This is calculated based on all the permissions that apply to this group. Since this
+        # is a graph walk, we calculate it here when we're getting this data.
+        group_audited = False
+        data = {}
+        if wanted("users"):
+            data["users"] = {}
+        if wanted("subgroups"):
+            data["subgroups"] = {}
+        if wanted("groups"):
+            data["groups"] = {}
+        if wanted("permissions"):
+            data["permissions"] = []
+        if wanted("service_accounts") and groupname in self.group_service_accounts:
+            data["service_accounts"] = self.group_service_accounts[groupname]
+        with_paths = wanted("paths")
+
+        # Walk down only for the members and up only for the parents and their permissions.
+        paths = rpaths = {}
+        if wanted("users", "subgroups"):
+            paths = self._walk_group(walks, group, "members", cutoff)
+        if wanted("groups", "permissions", "audited"):
+            rpaths = self._walk_group(walks, group, "parents", cutoff)
+
+        for member, path in paths.iteritems():
+            if member == group:
+                continue
+            member_type, member_name = member
+            members = data.get(MEMBER_TYPE_MAP[member_type])
+            if members is None:
+                continue
+            role = self.graph.role(group, path[1])
+            members[member_name] = {
+                "name": member_name,
+                "distance": len(path) - 1,
+                "role": role,
+                "rolename": GROUP_EDGE_ROLES[role],
+            }
+            if with_paths:
+                members[member_name]["path"] = [elem[1] for elem in path]
+
+        grants = []  # (groupname, path) of the groups whose permissions apply.
+        for parent, path in rpaths.iteritems():
+            if parent == group:
+                continue
+            parent_type, parent_name = parent
+            if "groups" in data:
+                role = self.graph.role(parent, path[-2])
+                data["groups"][parent_name] = {
+                    "name": parent_name,
+                    "distance": len(path) - 1,
+                    "role": role,
+                    "rolename": GROUP_EDGE_ROLES[role],
+                }
+                if with_paths:
+                    data["groups"][parent_name]["path"] = [elem[1] for elem in path]
+            grants.append((parent_name, path))
+
+        # Permissions of the parents, in the order walked, then of the group itself.
+        grants.append((groupname, [group]))
+        for grantee, path in grants:
+            for permission in self.permission_metadata.get(grantee, []):
+                if show_permission is not None and permission.permission != show_permission:
+                    continue
+                if permission.audited:
+                    group_audited = True
+                if "permissions" not in data:
+                    continue
+
+                perm_data = {
+                    "permission": permission.permission,
+                    "argument": permission.argument,
+                    "granted_on": (permission.granted_on - EPOCH).total_seconds(),
+                    "distance": len(path) - 1,
+                }
+                if with_paths:
+                    perm_data["path"] = [elem[1] for elem in path]
+
+                if expose_aliases:
+                    perm_data["alias"] = permission.alias
+
+                data["permissions"].append(perm_data)
+
+        if wanted("audited"):
+            data["audited"] = group_audited
+        return data
+
+    def get_user_details(self, username, cutoff=None, expose_aliases=True, fields=None):
+        """ Get a user's groups and permissions.  Raise NoSuchUser for missing users.  The
+        result may be shared with other callers, so don't modify it.  If fields is a frozenset
+        of USER_DETAILS_FIELDS, only those are filled in. """
+        key = ("user", username, cutoff, expose_aliases, fields)
+        user_details = self.details_cache.get(key)
+        if user_details is None:
+            user_details = self._get_user_details(username, cutoff, expose_aliases, fields)
+            # Permissions come from the user's groups, whether or not the groups are asked for.
+            closure = self.user_closures.get(username)
+            groups = closure.np_owner_groups + closure.groups if closure else []
+            dependencies = frozenset(
+                [("User", username)] +
+                [("Group", group.name) for group in groups])
+            self.details_cache.put(key, user_details, dependencies)
+        return user_details
+
+    def get_user_details_many(self, usernames, cutoff=None, expose_aliases=True, fields=None):
+        """ Get the groups and permissions of each of the given users as a dict of username:
+        details, leaving out missing users.  The groups of every user were found in one walk of
+        the graph when it was loaded, so this only has to look them up. """
+        out = {}
+        for username in usernames:
+            try:
+                out[username] = self.get_user_details(username, cutoff, expose_aliases, fields)
+            except NoSuchUser:
+                continue
+        return out
+
+    def _get_user_details(self, username, cutoff, expose_aliases, fields):
+        # Groups further than this from the user are left out.  Direct groups are always
+        # included, and a cutoff below 1 reaches their parents, as a networkx cutoff of -1 does.
+        if cutoff is None:
+            max_distance = None
+        elif cutoff >= 1:
+            max_distance = cutoff
+        else:
+            max_distance = 2
+
+        user_details = {}
+        if fields is None or "groups" in fields:
+            user_details["groups"] = {}
+        if fields is None or "permissions" in fields:
+            user_details["permissions"] = []
+        with_paths = fields is None or "paths" in fields
+        groups = user_details.get("groups")
+        permissions = user_details.get("permissions")
+
+        if username not in self.user_metadata:
+            raise NoSuchUser(username)
+
+        # For disabled users or users introduced between SQL queries, just
+        # return empty details.
+        if username not in self.user_closures:
+            return user_details
+
+        # If the user is a service account, its permissions are only those of the service
+        # account and we don't do any graph walking.
+        if "service_account" in self.user_metadata[username]:
+            if permissions is not None and username in self.service_account_permissions:
+                for permission in self.service_account_permissions[username]:
+                    permissions.append({
+                        "permission": permission.permission,
+                        "argument": permission.argument,
+                        "granted_on": (permission.granted_on - EPOCH).total_seconds(),
+                    })
+            return user_details
+
+        closure = self.user_closures[username]
+
+        # An np-owner membership is overridden by an inherited path to the same group.
+        for group in closure.np_owner_groups + closure.groups:
+            if groups is None:
+                break
+            if max_distance is not None and group.distance > max_distance:
+                continue
+            groups[group.name] = {
+                "name": group.name,
+                "distance": group.distance,
+                "role": group.role,
+                "rolename": GROUP_EDGE_ROLES[group.role],
+            }
+            if with_paths:
+                groups[group.name]["path"] = list(group.path)
+
+        for grant in closure.permissions:
+            if permissions is None:
+                break
+            if max_distance is not None and grant.distance > max_distance:
+                continue
+            permission = grant.permission
+            perm_data = {
+                "permission": permission.permission,
+                "argument": permission.argument,
+                "granted_on": (permission.granted_on - EPOCH).total_seconds(),
+                "distance": grant.distance,
+            }
+            if with_paths:
+                perm_data["path"] = list(grant.path)
+
+            if expose_aliases:
+                perm_data["alias"] = permission.alias
+
+            permissions.append(perm_data)
+
+        return user_details
+
+
+class _TimedLock(object):
+    """An RLock that reports how long each acquisition waited, in milliseconds."""
+
+    def __init__(self, stat_name):
+        self._lock = RLock()
+        self._stat_name = stat_name
+
+    def __enter__(self):
+        start = time.time()
+        self._lock.acquire()
+        stats.log_rate(self._stat_name, int((time.time() - start) * 1000))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._lock.release()
+
+
+def _from_snapshot(name):
+    """A read-only GroupGraph attribute that reads from the current snapshot."""
+    return property(lambda self: getattr(self.snapshot, name))
+
+
+class GroupGraph(object):
+    checkpoint = _from_snapshot("checkpoint")
+    checkpoint_time = _from_snapshot("checkpoint_time")
+    nodes = _from_snapshot("nodes")
+    edges = _from_snapshot("edges")
+    users = _from_snapshot("users")
+    groups = _from_snapshot("groups")
+    permissions = _from_snapshot("permissions")
+    user_metadata = _from_snapshot("user_metadata")
+    group_metadata = _from_snapshot("group_metadata")
+    group_service_accounts = _from_snapshot("group_service_accounts")
+    permission_metadata = _from_snapshot("permission_metadata")
+    service_account_permissions = _from_snapshot("service_account_permissions")
+    permission_tuples = _from_snapshot("permission_tuples")
+    group_tuples = _from_snapshot("group_tuples")
+    disabled_group_tuples = _from_snapshot("disabled_group_tuples")
+    user_closures = _from_snapshot("user_closures")
+    user_tokens = _from_snapshot("user_tokens")
+    permission_grants = _from_snapshot("permission_grants")
+    directly_audited_groups = _from_snapshot("directly_audited_groups")
+    audited_groups = _from_snapshot("audited_groups")
+    auditors = _from_snapshot("auditors")
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.engine = NetworkXEngine  # Engine class to use for the next load.
+        self.loader_threads = 1  # How many loader queries to run at once.
+        # A grouper.graph_builder.GraphBuilder to build new snapshots in, or None to build them in
+        # this process.
+        self.builder = None
+        self.details_cache_entries = 0  # Most get_*_details results to cache; 0 disables.
+        self.details_cache_max_nodes = 0  # Most nodes those results may depend on in total.
+        self.update_lock = _TimedLock("graph_update_lock_wait_ms")  # 1 updating thread at a time.
+        self.snapshot = GraphSnapshot()  # Replaced as a whole, never modified.
+        # When the snapshot was last known to match the database, as returned by time.time().
+        self.refreshed_at = 0
+        self.change_history = ChangeHistory()  # What changed at recent publishes, if enabled.
+        self._publish_listeners = []
+
+    def add_publish_listener(self, listener):
+        """Call listener(snapshot) whenever a new snapshot starts being served.
+
+        Listeners are called from whichever thread refreshes the graph, so they should only hand
+        the news over to the thread that needs it.
+        """
+        self._publish_listeners.append(listener)
 
     @classmethod
     def from_db(cls, session):
@@ -93,55 +796,481 @@ class GroupGraph(object):
         inst.update_from_db(session)
         return inst
 
-    def update_from_db(self, session):
+    def load_snapshot(self, path):
+        """Start serving from the snapshot file at path, if it's usable.
+
+        The snapshot is only used if it's newer than what we have and was built with our engine;
+        update_from_db then catches up from its checkpoint as usual.
+
+        Returns:
+            whether the snapshot was loaded
+        """
+        with self.update_lock:
+            try:
+                snapshot = GraphSnapshot.load(path)
+            except InvalidGraphSnapshot as e:
+                self.logger.warning("Not using graph snapshot %s: %s", path, e)
+                return False
+
+            if snapshot.checkpoint <= self.checkpoint:
+                self.logger.info("Not using graph snapshot %s: not newer than ours.", path)
+                return False
+            if not isinstance(snapshot.graph, self.engine):
+                self.logger.info("Not using graph snapshot %s: built with another engine.", path)
+                return False
+
+            self.logger.info("Loaded graph snapshot %s at checkpoint %d.",
+                             path, snapshot.checkpoint)
+            self._publish(snapshot)
+            return True
+
+    def write_snapshot(self, path):
+        """Write the current snapshot to path unless the file there is already as new.
+
+        The file's modification time is set to refreshed_at, so that processes following it know
+        how current it is even when it doesn't change.
+        """
+        snapshot = self.snapshot
+        if snapshot.graph is None:
+            return
+        try:
+            file_checkpoint = GraphSnapshot.read_checkpoint(path)
+        except InvalidGraphSnapshot:
+            file_checkpoint = None
+        if file_checkpoint is not None and file_checkpoint > snapshot.checkpoint:
+            return
+        if file_checkpoint != snapshot.checkpoint:
+            snapshot.write(path)
+        os.utime(path, (self.refreshed_at, self.refreshed_at))
+
+    def update_from_db(self, session, incremental=False):
+        """Refresh the graph if the "updates" checkpoint has moved.
+
+        With incremental set, only the users and groups recorded in the graph change log since
+        our checkpoint are reloaded; we fall back to a full rebuild if that log has a gap.
+
+        The new snapshot is labelled with the checkpoint read before loading, so anything that
+        changes while loaders run on their own connections is reloaded on the next refresh.
+        """
         # Only allow one thread at a time to construct a fresh graph.
         with self.update_lock:
+            refreshed_at = time.time()
             checkpoint, checkpoint_time = self._get_checkpoint(session)
             if checkpoint == self.checkpoint:
                 self.logger.debug("Checkpoint hasn't changed. Not Updating.")
+                self.refreshed_at = refreshed_at
                 return
+
+            changes = None
+            if incremental and self.snapshot.graph is not None:
+                changes = GraphChange.get_changes(session, self.checkpoint, checkpoint)
+                if changes is not None and sum(map(len, changes)) > MAX_INCREMENTAL_CHANGES:
+                    changes = None
+
+            snapshot = None
+            if self.builder is not None:
+                snapshot = self.builder.build(
+                    self, session.get_bind().url, checkpoint, checkpoint_time, changes)
+            if snapshot is None:
+                snapshot = self.build_snapshot(session, checkpoint, checkpoint_time, changes)
+
+            self._publish(snapshot, changes)
+            self.refreshed_at = refreshed_at
+
+    def build_snapshot(self, session, checkpoint, checkpoint_time, changes=None):
+        """Returns a new GraphSnapshot labelled with checkpoint, without publishing it.
+
+        Args:
+            session(Session): database session
+            checkpoint, checkpoint_time: what to label the snapshot with
+            changes: None to load everything, or the (usernames, groupnames) changed since the
+                current snapshot to reload only those on top of it
+        """
+        return GraphSnapshot(checkpoint, checkpoint_time, self._load(session, changes))
+
+    def _publish(self, snapshot, changes=None):
+        """Make snapshot the one served, carrying over what it can of the old one's cache."""
+        old_snapshot = self.snapshot
+        if changes is None or old_snapshot.graph is None:
+            snapshot.details_cache = DetailsCache(
+                self.details_cache_entries, self.details_cache_max_nodes)
+        else:
+            snapshot.details_cache = old_snapshot.details_cache.carry_over(
+                self._changed_nodes(old_snapshot, snapshot, changes))
+
+        # Record the changes before publishing, so no reader sees the snapshot without them.
+        if self.change_history.max_entries and old_snapshot.graph is not None:
+            self.change_history.add(diff_snapshots(old_snapshot, snapshot))
+
+        # Readers holding the old snapshot keep using it; new readers get this one.
+        self.snapshot = snapshot
+        for listener in self._publish_listeners:
+            listener(snapshot)
+
+    @staticmethod
+    def _changed_nodes(old_snapshot, new_snapshot, changes):
+        """Returns the nodes whose details may differ between two snapshots.
+
+        That's the changed users and groups, the service accounts of changed groups, and their
+        neighbors on either side, since an edge that appeared or went away changes the details of
+        both ends.
+        """
+        usernames, groupnames = changes
+        changed = {("User", name) for name in usernames}
+        changed.update(("Group", name) for name in groupnames)
+        for snapshot in (old_snapshot, new_snapshot):
+            for groupname in groupnames:
+                changed.update(
+                    ("User", name) for name in snapshot.group_service_accounts.get(groupname, []))
+
+        nodes = set(changed)
+        for snapshot in (old_snapshot, new_snapshot):
+            for node in changed:
+                if snapshot.graph.has_node(node):
+                    nodes.update(member for member, _ in snapshot.graph.members(node))
+                    nodes.update(parent for parent, _ in snapshot.graph.parents(node))
+        return nodes
+
+    def _load(self, session, changes):
+        """Load the data for a new snapshot, from scratch or by applying changes."""
+        if changes is None:
             self.logger.debug("Checkpoint changed; updating!")
+            return self._load_from_db(session)
+
+        usernames, groupnames = changes
+        self.logger.debug(
+            "Checkpoint changed; reloading %d users and %d groups.",
+            len(usernames), len(groupnames))
+        return self._load_changes_from_db(session, usernames, groupnames)
+
+    def _run_loaders(self, session, loaders):
+        """Run loaders and return a dict of their results by name.
+
+        Args:
+            session(Session): database session
+            loaders(dict): name -> function taking a session
+
+        With loader_threads above 1, independent loaders run concurrently, each on a session of
+        its own (and so on its own pooled connection), and the refresh takes about as long as the
+        slowest of them.  Each loader's time is reported as graph_loader_ms_<name>.
+        """
+        def run(name, loader, loader_session):
+            start = time.time()
+            result = loader(loader_session)
+            duration_ms = int((time.time() - start) * 1000)
+            stats.log_rate("graph_loader_ms_{}".format(name), duration_ms)
+            self.logger.debug("Graph loader %s took %dms.", name, duration_ms)
+            return name, result
+
+        if self.loader_threads <= 1 or len(loaders) <= 1:
+            return dict(run(name, loader, session) for name, loader in loaders.iteritems())
+
+        bind = session.get_bind()
+
+        def run_in_own_session(item):
+            with closing(Session(bind=bind)) as loader_session:
+                return run(item[0], item[1], loader_session)
+
+        pool = ThreadPool(min(self.loader_threads, len(loaders)))
+        try:
+            return dict(pool.map(run_in_own_session, loaders.items()))
+        finally:
+            pool.close()
+
+    def _load_from_db(self, session):
+        """Load everything the graph caches from scratch."""
+        data = self._run_loaders(session, {
+            "nodes": self._get_nodes_from_db,
+            "edges": self._get_edges_from_db,
+            "user_metadata": self._get_user_metadata,
+            "user_tokens": self._get_user_tokens,
+            "permission_metadata": self._get_permission_metadata,
+            "service_account_permissions": all_service_account_permissions,
+            "group_service_accounts": self._get_group_service_accounts,
+            "permission_tuples": self._get_permission_tuples,
+            "group_tuples": self._get_group_tuples,
+            "disabled_group_tuples": partial(self._get_group_tuples, enabled=False),
+        })
+        # Group metadata lists each group's grants from permission_metadata, so it comes after.
+        data.update(self._run_loaders(session, {
+            "group_metadata": partial(
+                self._get_group_metadata, permission_metadata=data["permission_metadata"]),
+        }))
+
+        data["graph"] = self.engine(data.pop("nodes"), data.pop("edges"))
+        return self._with_derived_data(data)
+
+    def _load_changes_from_db(self, session, usernames, groupnames):
+        """Reload only the given users and groups on top of copies of the current data.
+
+        A changed group drops every edge it's on (as parent or member), its grants and its
+        metadata, and all of that is reloaded from the database.  A changed user is handled the
+        same way for its memberships, metadata and service account grants.  Permission tuples
+        aren't tied to any user or group, and are one cheap query, so they're always reloaded.
+
+        Only the queries and the closures of the users affected are incremental: the engine,
+        grants and audit data are still rebuilt from the whole node and edge lists, which takes
+        time in proportion to the size of the graph.
+        """
+        snapshot = self.snapshot
+
+        # Service account metadata names the owning group, so a group change (e.g. a rename) may
+        # change the accounts it owns.
+        usernames = set(usernames)
+        for groupname in groupnames:
+            usernames.update(snapshot.group_service_accounts.get(groupname, []))
+
+        new_data = self._run_loaders(session, {
+            "nodes": partial(
+                self._get_nodes_from_db, usernames=usernames, groupnames=groupnames),
+            "edges": partial(
+                self._get_edges_from_db, usernames=usernames, groupnames=groupnames),
+            "user_metadata": partial(self._get_user_metadata, usernames=usernames),
+            "user_tokens": partial(self._get_user_tokens, usernames=usernames),
+            "permission_metadata": partial(
+                self._get_permission_metadata, groupnames=groupnames),
+            "service_account_permissions": partial(
+                all_service_account_permissions, usernames=usernames),
+            "group_service_accounts": partial(
+                self._get_group_service_accounts, groupnames=groupnames),
+            "permission_tuples": self._get_permission_tuples,
+            "group_tuples": partial(self._get_group_tuples, groupnames=groupnames),
+            "disabled_group_tuples": partial(
+                self._get_group_tuples, enabled=False, groupnames=groupnames),
+        })
+
+        changed = {("User", name) for name in usernames} | {("Group", name) for name in groupnames}
+        nodes = [node for node in snapshot.graph.nodes() if node not in changed]
+        nodes.extend(new_data["nodes"])
+        edges = [edge for edge in snapshot.graph.edges_with_roles()
+                 if edge[0] not in changed and edge[1] not in changed]
+        edges.extend(new_data["edges"])
+        graph = self.engine(nodes, edges)
+
+        def reload(data, names, new_data):
+            data = data.copy()
+            for name in names:
+                data.pop(name, None)
+            data.update(new_data)
+            return data
+
+        permission_metadata = reload(
+            snapshot.permission_metadata, groupnames, new_data["permission_metadata"])
+
+        # Only users at or below what changed can be in other groups or have other permissions
+        # than before, so everyone else's closure carries over.
+        closure_users = (self._users_below(snapshot.graph, changed) |
+                         self._users_below(graph, changed))
+        user_closures = {name: closure for name, closure in snapshot.user_closures.iteritems()
+                         if name not in closure_users}
+        user_closures.update(
+            self._get_user_closures(graph, permission_metadata, usernames=closure_users))
+
+        new_data.update(self._run_loaders(session, {
+            "group_metadata": partial(
+                self._get_group_metadata, permission_metadata=permission_metadata,
+                groupnames=groupnames),
+        }))
+
+        return self._with_derived_data({
+            "graph": graph,
+            "user_closures": user_closures,
+            "user_metadata": reload(
+                snapshot.user_metadata, usernames, new_data["user_metadata"]),
+            "user_tokens": reload(snapshot.user_tokens, usernames, new_data["user_tokens"]),
+            "permission_metadata": permission_metadata,
+            "service_account_permissions": reload(
+                snapshot.service_account_permissions, usernames,
+                new_data["service_account_permissions"]),
+            "group_metadata": reload(
+                snapshot.group_metadata, groupnames, new_data["group_metadata"]),
+            "group_service_accounts": reload(
+                snapshot.group_service_accounts, groupnames,
+                new_data["group_service_accounts"]),
+            "permission_tuples": new_data["permission_tuples"],
+            "group_tuples": reload(
+                snapshot.group_tuples, groupnames, new_data["group_tuples"]),
+            "disabled_group_tuples": reload(
+                snapshot.disabled_group_tuples, groupnames, new_data["disabled_group_tuples"]),
+        })
+
+    @staticmethod
+    def _users_below(graph, nodes):
+        """Returns the names of the users in graph that are any of nodes or members of them."""
+        seen = {node for node in nodes if graph.has_node(node)}
+        queue = list(seen)
+        while queue:
+            for member, _ in graph.members(queue.pop()):
+                if member not in seen:
+                    seen.add(member)
+                    queue.append(member)
+        return {name for node_type, name in seen if node_type == "User"}
+
+    @staticmethod
+    def _with_derived_data(data):
+        """Fill in the parts of the graph data that are computed from what was loaded.
+
+        User closures are only computed if data doesn't have them already; an incremental refresh
+        brings its own, recomputed just for the users affected.  Everything else here, like the
+        engine built by the caller, takes time in proportion to the whole graph on every refresh.
+        """
+        graph = data["graph"]
+
+        data["users"] = set()
+        data["groups"] = set()
+        for (node_type, node_name) in graph.nodes():
+            if node_type == "User":
+                data["users"].add(node_name)
+            elif node_type == "Group":
+                data["groups"].add(node_name)
+
+        data["permissions"] = {perm.permission
+                               for perm_list in data["permission_metadata"].values()
+                               for perm in perm_list}
+        if "user_closures" not in data:
+            data["user_closures"] = GroupGraph._get_user_closures(
+                graph, data["permission_metadata"])
+        data["permission_grants"] = GroupGraph._get_permission_grants(
+            graph, data["permission_metadata"], data["service_account_permissions"])
+        data["directly_audited_groups"], data["audited_groups"] = GroupGraph._get_audited_groups(
+            graph, data["permission_metadata"])
+        data["auditors"] = GroupGraph._get_auditors(
+            data["user_metadata"], data["user_closures"], data["service_account_permissions"])
+        return data
+
+    @staticmethod
+    def _get_audited_groups(graph, permission_metadata):
+        '''
+        Returns a 2-tuple of frozensets of the names of groups that have an audited permission
+        and of all groups that are audited, which are those and every group below them.
+        '''
+        directly_audited = frozenset(
+            groupname for groupname, permissions in permission_metadata.iteritems()
+            if graph.has_node(("Group", groupname)) and any(p.audited for p in permissions))
+
+        audited = set()
+        queue = [("Group", groupname) for groupname in directly_audited]
+        while queue:
+            group = queue.pop()
+            if group[1] in audited:
+                continue
+            audited.add(group[1])
+            for member, _ in graph.members(group):
+                if member[0] == "Group":
+                    queue.append(member)
+        return directly_audited, frozenset(audited)
+
+    @staticmethod
+    def _get_auditors(user_metadata, user_closures, service_account_permissions):
+        '''
+        Returns a frozenset of the names of users that have PERMISSION_AUDITOR, by the same rules
+        as get_user_details.
+        '''
+        auditors = set()
+        for username, closure in user_closures.iteritems():
+            if "service_account" in user_metadata.get(username, {}):
+                permissions = service_account_permissions.get(username, [])
+            else:
+                permissions = (grant.permission for grant in closure.permissions)
+            if any(permission.permission == PERMISSION_AUDITOR for permission in permissions):
+                auditors.add(username)
+        return frozenset(auditors)
+
+    @staticmethod
+    def _get_permission_grants(graph, permission_metadata, service_account_permissions):
+        '''
+        Returns a dict of permission name: PermissionGrants for every permission granted to a
+        group or service account.
+        '''
+        direct_groups = {}  # name -> groupname -> [MappedPermission]
+        for groupname, permissions in permission_metadata.iteritems():
+            for permission in permissions:
+                direct_groups.setdefault(permission.permission, {}).setdefault(
+                    groupname, []).append(permission)
 
-            new_graph = DiGraph()
-            new_graph.add_nodes_from(self._get_nodes_from_db(session))
-            new_graph.add_edges_from(self._get_edges_from_db(session))
-            rgraph = new_graph.reverse()
+        service_accounts = {}  # name -> account -> [ServiceAccountPermission]
+        for account, permissions in service_account_permissions.iteritems():
+            for permission in permissions:
+                service_accounts.setdefault(permission.permission, {}).setdefault(
+                    account, []).append(permission)
 
-            users = set()
+        # The groups at or below each group, shared between all the permissions granted to it.
+        group_subtrees = {}
+
+        out = {}
+        for name in set(direct_groups) | set(service_accounts):
             groups = set()
-            for (node_type, node_name) in new_graph.nodes():
-                if node_type == "User":
-                    users.add(node_name)
-                elif node_type == "Group":
-                    groups.add(node_name)
-
-            user_metadata = self._get_user_metadata(session)
-            permission_metadata = self._get_permission_metadata(session)
-            service_account_permissions = all_service_account_permissions(session)
-            group_metadata = self._get_group_metadata(session, permission_metadata)
-            group_service_accounts = self._get_group_service_accounts(session)
-            permission_tuples = self._get_permission_tuples(session)
-            group_tuples = self._get_group_tuples(session)
-            disabled_group_tuples = self._get_group_tuples(session, enabled=False)
-
-            with self.lock:
-                self._graph = new_graph
-                self._rgraph = rgraph
-                self.checkpoint = checkpoint
-                self.checkpoint_time = checkpoint_time
-                self.users = users
-                self.groups = groups
-                self.permissions = {perm.permission
-                                    for perm_list in permission_metadata.values()
-                                    for perm in perm_list}
-                self.user_metadata = user_metadata
-                self.group_metadata = group_metadata
-                self.group_service_accounts = group_service_accounts
-                self.permission_metadata = permission_metadata
-                self.service_account_permissions = service_account_permissions
-                self.permission_tuples = permission_tuples
-                self.group_tuples = group_tuples
-                self.disabled_group_tuples = disabled_group_tuples
+            for groupname in direct_groups.get(name, {}):
+                if groupname not in group_subtrees:
+                    group = ("Group", groupname)
+                    subtree = {groupname}
+                    if graph.has_node(group):
+                        subtree.update(member_name for member_type, member_name
+                                       in graph.shortest_paths(group)
+                                       if member_type == "Group")
+                    group_subtrees[groupname] = frozenset(subtree)
+                groups.update(group_subtrees[groupname])
+            out[name] = PermissionGrants(
+                direct_groups.get(name, {}), frozenset(groups), service_accounts.get(name, {}))
+        return out
+
+    @staticmethod
+    def _get_user_closures(graph, permission_metadata, usernames=None):
+        '''
+        Returns a dict of username: UserClosure for every user in the graph, or only for those of
+        usernames that are in it.
+        '''
+        # The ancestors of each group as (name, path of names up from the group, role of the
+        # last step on the path or None for the group itself), shared between all the members
+        # of the group.
+        group_ancestors = {}
+
+        if usernames is None:
+            users = graph.nodes()
+        else:
+            users = [("User", name) for name in usernames if graph.has_node(("User", name))]
+
+        out = {}
+        for user in users:
+            user_type, username = user
+            if user_type != "User":
+                continue
+
+            # User permissions are inherited from all groups for which their role is not
+            # "np-owner".  User groups are all groups in which a user is a member by
+            # inheritance, except for ancestors of groups where their role is "np-owner", unless
+            # the user is a member of such an ancestor via a non-"np-owner" role in another
+            # group.
+            np_owner_groups = []
+            best = {}  # ancestor name -> (shortest path up from a direct group, role)
+            for group, role in graph.parents(user):
+                if GROUP_EDGE_ROLES[role] == "np-owner":
+                    np_owner_groups.append(
+                        ClosureGroup(group[1], (username, group[1]), 1, role))
+                    continue
+                ancestors = group_ancestors.get(group)
+                if ancestors is None:
+                    ancestors = group_ancestors[group] = [
+                        (parent[1],
+                         tuple([elem[1] for elem in path]),
+                         graph.role(parent, path[-2]) if len(path) > 1 else None)
+                        for parent, path in graph.reverse_shortest_paths(group).iteritems()
+                    ]
+                for name, path, parent_role in ancestors:
+                    if name not in best or len(path) < len(best[name][0]):
+                        best[name] = (path, role if parent_role is None else parent_role)
+
+            groups = []
+            permissions = []
+            for name, (path, role) in best.iteritems():
+                path = (username,) + path
+                distance = len(path) - 1
+                groups.append(ClosureGroup(name, path, distance, role))
+                for permission in permission_metadata.get(name, []):
+                    permissions.append(ClosurePermission(permission, path, distance))
+
+            out[username] = UserClosure(np_owner_groups, groups, permissions)
+        return out
 
     @staticmethod
     def _get_checkpoint(session):
@@ -151,9 +1280,9 @@ class GroupGraph(object):
         return counter.count, int(counter.last_modified.strftime("%s"))
 
     @staticmethod
-    def _get_user_metadata(session):
+    def _get_user_metadata(session, usernames=None):
         '''
-        Returns a dict of username: { dict of metadata }.
+        Returns a dict of username: { dict of metadata }, optionally limited to the given users.
         '''
 
         def user_indexify(data):
@@ -162,11 +1291,27 @@ class GroupGraph(object):
                 ret[item.user_id].append(item)
             return ret
 
-        users = session.query(User)
-
-        passwords = user_indexify(session.query(UserPassword).all())
-        public_keys = user_indexify(session.query(PublicKey).all())
-        user_metadata = user_indexify(session.query(UserMetadata).all())
+        users = session.query(User).filter(_in_names(User.username, usernames)).all()
+        user_ids = None if usernames is None else [user.id for user in users]
+
+        passwords = user_indexify(session.query(UserPassword).filter(
+            _in_names(UserPassword.user_id, user_ids)).yield_per(BULK_QUERY_BATCH_SIZE))
+        public_keys = user_indexify(session.query(PublicKey).filter(
+            _in_names(PublicKey.user_id, user_ids)).yield_per(BULK_QUERY_BATCH_SIZE))
+        user_metadata = user_indexify(session.query(UserMetadata).filter(
+            _in_names(UserMetadata.user_id, user_ids)).yield_per(BULK_QUERY_BATCH_SIZE))
+        service_accounts = user_indexify(session.query(
+            ServiceAccount.user_id,
+            ServiceAccount.description,
+            ServiceAccount.machine_set,
+            label("owner", Group.groupname),
+        ).outerjoin(
+            GroupServiceAccount, GroupServiceAccount.service_account_id == ServiceAccount.id,
+        ).outerjoin(
+            Group, Group.id == GroupServiceAccount.group_id,
+        ).filter(
+            _in_names(ServiceAccount.user_id, user_ids),
+        ).yield_per(BULK_QUERY_BATCH_SIZE))
         public_key_tags = get_all_public_key_tags(session)
 
         out = {}
@@ -201,51 +1346,81 @@ class GroupGraph(object):
                 ],
             }
             if user.is_service_account:
-                account = user.service_account
+                account = service_accounts[user.id][0]
                 out[user.username]["service_account"] = {
                     "description": account.description,
                     "machine_set": account.machine_set,
                 }
                 if account.owner:
-                    out[user.username]["service_account"]["owner"] = account.owner.group.name
+                    out[user.username]["service_account"]["owner"] = account.owner
+        return out
+
+    @staticmethod
+    def _get_user_tokens(session, usernames=None):
+        """Returns a dict of username: {token name: UserTokenTuple}, optionally limited to the
+        given users."""
+        query = session.query(
+            User.username, UserToken.name, UserToken.hashed_secret, UserToken.disabled_at,
+        ).filter(
+            User.id == UserToken.user_id,
+            _in_names(User.username, usernames),
+        ).yield_per(BULK_QUERY_BATCH_SIZE)
+
+        out = {}
+        for username, name, hashed_secret, disabled_at in query:
+            out.setdefault(username, {})[name] = UserTokenTuple(
+                name, hashed_secret, disabled_at is None)
         return out
 
     # This describes how permissions are assigned to groups, NOT the intrinsic
     # metadata for a permission.
     @staticmethod
-    def _get_permission_metadata(session):
+    def _get_permission_metadata(session, groupnames=None):
         '''
-        Returns a dict of groupname: { list of permissions }.
+        Returns a dict of groupname: { list of permissions }, optionally limited to the given
+        groups.
         '''
         out = defaultdict(list)  # groupid -> [ ... ]
 
-        permissions = session.query(Permission, PermissionMap).filter(
+        permissions = session.query(
+            Permission.name,
+            Permission._audited,
+            PermissionMap.argument,
+            PermissionMap.granted_on,
+            Group.groupname,
+        ).filter(
             Permission.id == PermissionMap.permission_id,
             PermissionMap.group_id == Group.id,
             Group.enabled == True,
+            _in_names(Group.groupname, groupnames),
+        )
+
+        permissions = list(permissions.yield_per(BULK_QUERY_BATCH_SIZE))
+        aliases_by_permission = get_plugin_proxy().get_aliases_for_mapped_permissions(
+            session,
+            [(name, argument) for name, _, argument, _, _ in permissions],
+            all_grants=groupnames is None,
         )
 
-        for (permission, permission_map) in permissions:
-            out[permission_map.group.name].append(MappedPermission(
-                permission=permission.name,
-                audited=permission.audited,
-                argument=permission_map.argument,
-                groupname=permission_map.group.name,
-                granted_on=permission_map.granted_on,
+        for (permission, audited, argument, granted_on, groupname) in permissions:
+            out[groupname].append(MappedPermission(
+                permission=permission,
+                audited=audited,
+                argument=argument,
+                groupname=groupname,
+                granted_on=granted_on,
                 alias=False,
             ))
 
-            aliases = get_plugin_proxy().get_aliases_for_mapped_permission(
-                session, permission.name, permission_map.argument
-            )
+            aliases = aliases_by_permission[(permission, argument)]
 
             for (name, arg) in aliases:
-                out[permission_map.group.name].append(MappedPermission(
+                out[groupname].append(MappedPermission(
                     permission=name,
-                    audited=permission.audited,
+                    audited=audited,
                     argument=arg,
-                    groupname=permission_map.group.name,
-                    granted_on=permission_map.granted_on,
+                    groupname=groupname,
+                    granted_on=granted_on,
                     alias=True,
                 ))
 
@@ -272,12 +1447,13 @@ class GroupGraph(object):
         return out
 
     @staticmethod
-    def _get_group_metadata(session, permission_metadata):
+    def _get_group_metadata(session, permission_metadata, groupnames=None):
         '''
-        Returns a dict of groupname: { dict of metadata }.
+        Returns a dict of groupname: { dict of metadata }, optionally limited to the given groups.
         '''
         groups = session.query(Group).filter(
-            Group.enabled == True
+            Group.enabled == True,
+            _in_names(Group.groupname, groupnames),
         )
 
         out = {}
@@ -287,7 +1463,7 @@ class GroupGraph(object):
                     {
                         "permission": permission.permission,
                         "argument": permission.argument,
-                    } for permission in permission_metadata[group.id]
+                    } for permission in permission_metadata.get(group.groupname, [])
                 ],
                 "contacts": {
                     "email": group.email_address,
@@ -297,32 +1473,38 @@ class GroupGraph(object):
         return out
 
     @staticmethod
-    def _get_group_service_accounts(session):
+    def _get_group_service_accounts(session, groupnames=None):
         '''
-        Returns a dict of groupname: { list of service account names }.
+        Returns a dict of groupname: { list of service account names }, optionally limited to
+        the given groups.
         '''
         out = defaultdict(list)
-        tuples = session.query(Group, ServiceAccount).filter(
+        tuples = session.query(Group.groupname, User.username).filter(
             GroupServiceAccount.group_id == Group.id,
             GroupServiceAccount.service_account_id == ServiceAccount.id,
-        )
-        for group, account in tuples:
-            out[group.groupname].append(account.user.username)
+            ServiceAccount.user_id == User.id,
+            _in_names(Group.groupname, groupnames),
+        ).yield_per(BULK_QUERY_BATCH_SIZE)
+        for groupname, username in tuples:
+            out[groupname].append(username)
         return out
 
     @staticmethod
-    def _get_group_tuples(session, enabled=True):
+    def _get_group_tuples(session, enabled=True, groupnames=None):
         '''
-        Returns a dict of groupname: GroupTuple.
+        Returns a dict of groupname: GroupTuple, optionally limited to the given groups.
         '''
         out = {}
+        # A group is part of a service account (see is_role_user) if a role user has its name.
         groups = (
-            session.query(Group)
+            session.query(Group, User.role_user)
+            .outerjoin(User, User.username == Group.groupname)
             .order_by(Group.groupname)
         ).filter(
-            Group.enabled == enabled
-        )
-        for group in groups:
+            Group.enabled == enabled,
+            _in_names(Group.groupname, groupnames),
+        ).yield_per(BULK_QUERY_BATCH_SIZE)
+        for group, role_user in groups:
             out[group.groupname] = GroupTuple(
                 id=group.id,
                 groupname=group.groupname,
@@ -330,27 +1512,31 @@ class GroupGraph(object):
                 description=group.description,
                 canjoin=group.canjoin,
                 enabled=group.enabled,
-                service_account=is_role_user(session, group=group),
+                service_account=bool(role_user),
                 type="Group"
             )
         return out
 
     @staticmethod
-    def _get_nodes_from_db(session):
+    def _get_nodes_from_db(session, usernames=None, groupnames=None):
         return session.query(
             label("type", literal("User")),
             label("name", User.username)
         ).filter(
-            User.enabled == True
+            User.enabled == True,
+            _in_names(User.username, usernames),
         ).union(session.query(
             label("type", literal("Group")),
             label("name", Group.groupname)
         ).filter(
-            Group.enabled == True
+            Group.enabled == True,
+            _in_names(Group.groupname, groupnames),
         )).all()
 
     @staticmethod
-    def _get_edges_from_db(session):
+    def _get_edges_from_db(session, usernames=None, groupnames=None):
+        """Returns all edges, or only those touching the given users and groups if either is
+        passed."""
 
         parent = aliased(Group)
         group_member = aliased(Group)
@@ -359,6 +1545,20 @@ class GroupGraph(object):
 
         now = datetime.utcnow()
 
+        if usernames is None and groupnames is None:
+            group_edge_filter = user_edge_filter = true()
+        else:
+            usernames = usernames or set()
+            groupnames = groupnames or set()
+            group_edge_filter = or_(
+                _in_names(parent.groupname, groupnames),
+                _in_names(group_member.groupname, groupnames),
+            )
+            user_edge_filter = or_(
+                _in_names(parent.groupname, groupnames),
+                _in_names(user_member.username, usernames),
+            )
+
         query = session.query(
             label("groupname", parent.groupname),
             label("type", literal("Group")),
@@ -374,7 +1574,8 @@ class GroupGraph(object):
                 GroupEdge.expiration > now,
                 GroupEdge.expiration == None
             ),
-            GroupEdge.member_type == 1
+            GroupEdge.member_type == 1,
+            group_edge_filter,
         ).union(session.query(
             label("groupname", parent.groupname),
             label("type", literal("User")),
@@ -390,282 +1591,62 @@ class GroupGraph(object):
                 GroupEdge.expiration > now,
                 GroupEdge.expiration == None
             ),
-            GroupEdge.member_type == 0
+            GroupEdge.member_type == 0,
+            user_edge_filter,
         ))
 
         for record in query.all():
             edges.append((
                 ("Group", record.groupname),
                 (record.type, record.name),
-                {"role": record.role},
+                record.role,
             ))
 
         return edges
 
     def get_permissions(self, audited=False):
-        """ Get the list of permissions as PermissionTuple instances sorted by name. """
-        with self.lock:
-            permissions = sorted(self.permission_tuples, key=lambda p: p.name)
-        if audited:
-            permissions = filter(lambda p: p.audited, permissions)
-        return permissions
+        return self.snapshot.get_permissions(audited)
 
     def get_permission_details(self, name, expose_aliases=True):
-        """ Get a permission and what groups and service accounts it's assigned to. """
+        return self.snapshot.get_permission_details(name, expose_aliases)
 
-        with self.lock:
-            data = {
-                "groups": {},
-                "service_accounts": {},
-            }
-
-            # Get all mapped versions of the permission. This is only direct relationships.
-            direct_groups = set()
-            for groupname, permissions in self.permission_metadata.iteritems():
-                for permission in permissions:
-                    if permission.permission == name:
-                        data["groups"][groupname] = self.get_group_details(
-                            groupname, show_permission=name, expose_aliases=expose_aliases)
-                        direct_groups.add(groupname)
-
-            # Now find all members of these groups going down the tree.
-            checked_groups = set()
-            for groupname in direct_groups:
-                group = ("Group", groupname)
-                paths = single_source_shortest_path(self._graph, group, None)
-                for member, path in paths.iteritems():
-                    if member == group:
-                        continue
-                    member_type, member_name = member
-                    if member_type != 'Group':
-                        continue
-                    if member_name in checked_groups:
-                        continue
-                    checked_groups.add(member_name)
-                    data["groups"][member_name] = self.get_group_details(
-                        member_name, show_permission=name, expose_aliases=expose_aliases)
-
-            # Finally, add all service accounts.
-            for account, permissions in self.service_account_permissions.iteritems():
-                for permission in permissions:
-                    if permission.permission == name:
-                        details = {
-                            "permission": permission.permission,
-                            "argument": permission.argument,
-                            "granted_on": (permission.granted_on - EPOCH).total_seconds(),
-                        }
-                        if account in data["service_accounts"]:
-                            data["service_accounts"][account]["permissions"].append(details)
-                        else:
-                            data["service_accounts"][account] = {"permissions": [details]}
+    def get_permission_details_many(self, names, expose_aliases=True):
+        return self.snapshot.get_permission_details_many(names, expose_aliases)
 
-            return data
+    def get_direct_grants(self, name):
+        return self.snapshot.get_direct_grants(name)
 
     def get_disabled_groups(self):
-        """ Get the list of disabled groups as GroupTuple instances sorted by groupname. """
-        with self.lock:
-            return sorted(self.disabled_group_tuples.values(), key=lambda g: g.groupname)
+        return self.snapshot.get_disabled_groups()
 
     def get_groups(self, audited=False, directly_audited=False):
-        """ Get the list of groups as GroupTuple instances sorted by groupname. """
-        if directly_audited:
-            audited = True
-        with self.lock:
-            groups = sorted(self.group_tuples.values(), key=lambda g: g.groupname)
-            if audited:
-                def is_directly_audited(group):
-                    for mp in self.permission_metadata[group.groupname]:
-                        if mp.audited:
-                            return True
-                    return False
-                directly_audited_groups = filter(is_directly_audited, groups)
-                if directly_audited:
-                    return directly_audited_groups
-                queue = [("Group", group.groupname) for group in directly_audited_groups]
-                audited_group_nodes = set()
-                while len(queue):
-                    g = queue.pop()
-                    if g not in audited_group_nodes:
-                        audited_group_nodes.add(g)
-                        for nhbr in self._graph.neighbors(g):  # Members of g.
-                            if nhbr[0] == 'Group':
-                                queue.append(nhbr)
-                groups = sorted([self.group_tuples[group[1]] for group in audited_group_nodes],
-                                key=lambda g: g.groupname)
-        return groups
+        return self.snapshot.get_groups(audited, directly_audited)
 
-    def get_group_details(self, groupname, cutoff=None, show_permission=None, expose_aliases=True):
-        """ Get users and permissions that belong to a group. Raise NoSuchGroup
-        for missing groups. """
-
-        with self.lock:
-            # This is calculated based on all the permissions that apply to this group. Since this
-            # is a graph walk, we calculate it here when we're getting this data.
-            group_audited = False
-            data = {
-                "users": {},
-                "groups": {},
-                "subgroups": {},
-                "permissions": [],
-                "audited": group_audited,
-            }
-            if groupname in self.group_service_accounts:
-                data["service_accounts"] = self.group_service_accounts[groupname]
+    def is_audited(self, groupname):
+        return self.snapshot.is_audited(groupname)
 
-            group = ("Group", groupname)
-            if not self._graph.has_node(group):
-                raise NoSuchGroup("Group %s is either missing or disabled." % groupname)
-            paths = single_source_shortest_path(self._graph, group, cutoff)
-            rpaths = single_source_shortest_path(self._rgraph, group, cutoff)
+    def is_auditor(self, username):
+        return self.snapshot.is_auditor(username)
 
-            for member, path in paths.iteritems():
-                if member == group:
-                    continue
-                member_type, member_name = member
-                role = self._graph[group][path[1]]["role"]
-                data[MEMBER_TYPE_MAP[member_type]][member_name] = {
-                    "name": member_name,
-                    "path": [elem[1] for elem in path],
-                    "distance": len(path) - 1,
-                    "role": role,
-                    "rolename": GROUP_EDGE_ROLES[role],
-                }
+    def get_user_token(self, username, name):
+        return self.snapshot.get_user_token(username, name)
 
-            for parent, path in rpaths.iteritems():
-                if parent == group:
-                    continue
-                parent_type, parent_name = parent
-                role = self._rgraph[path[-2]][parent]["role"]
-                data["groups"][parent_name] = {
-                    "name": parent_name,
-                    "path": [elem[1] for elem in path],
-                    "distance": len(path) - 1,
-                    "role": role,
-                    "rolename": GROUP_EDGE_ROLES[role],
-                }
-                for permission in self.permission_metadata.get(parent_name, []):
-                    if show_permission is not None and permission.permission != show_permission:
-                        continue
-                    if permission.audited:
-                        group_audited = True
+    def get_auditor_violations(self, groupname):
+        return self.snapshot.get_auditor_violations(groupname)
 
-                    perm_data = {
-                        "permission": permission.permission,
-                        "argument": permission.argument,
-                        "granted_on": (permission.granted_on - EPOCH).total_seconds(),
-                        "distance": len(path) - 1,
-                        "path": [elem[1] for elem in path],
-                    }
+    def get_controllers(self, groupname):
+        return self.snapshot.get_controllers(groupname)
 
-                    if expose_aliases:
-                        perm_data["alias"] = permission.alias
+    def get_group_details(self, groupname, cutoff=None, show_permission=None, expose_aliases=True,
+                          fields=None):
+        return self.snapshot.get_group_details(
+            groupname, cutoff, show_permission, expose_aliases, fields)
 
-                    data["permissions"].append(perm_data)
+    def get_group_details_many(self, groupnames, cutoff=None, expose_aliases=True, fields=None):
+        return self.snapshot.get_group_details_many(groupnames, cutoff, expose_aliases, fields)
 
-            for permission in self.permission_metadata.get(groupname, []):
-                if show_permission is not None and permission.permission != show_permission:
-                    continue
-                if permission.audited:
-                    group_audited = True
+    def get_user_details(self, username, cutoff=None, expose_aliases=True, fields=None):
+        return self.snapshot.get_user_details(username, cutoff, expose_aliases, fields)
 
-                perm_data = {
-                    "permission": permission.permission,
-                    "argument": permission.argument,
-                    "granted_on": (permission.granted_on - EPOCH).total_seconds(),
-                    "distance": 0,
-                    "path": [groupname],
-                }
-
-                if expose_aliases:
-                    perm_data["alias"] = permission.alias
-
-                data["permissions"].append(perm_data)
-
-            data["audited"] = group_audited
-            return data
-
-    def get_user_details(self, username, cutoff=None, expose_aliases=True):
-        """ Get a user's groups and permissions.  Raise NoSuchUser for missing users."""
-        max_dist = cutoff - 1 if (cutoff is not None) else None
-
-        groups = {}
-        permissions = []
-        user_details = {
-            "groups": groups,
-            "permissions": permissions,
-        }
-
-        with self.lock:
-            if username not in self.user_metadata:
-                raise NoSuchUser(username)
-
-            user = ("User", username)
-
-            # For disabled users or users introduced between SQL queries, just
-            # return empty details.
-            if not self._rgraph.has_node(user):
-                return user_details
-
-            # If the user is a service account, its permissions are only those of the service
-            # account and we don't do any graph walking.
-            if "service_account" in self.user_metadata[username]:
-                if username in self.service_account_permissions:
-                    for permission in self.service_account_permissions[username]:
-                        permissions.append({
-                            "permission": permission.permission,
-                            "argument": permission.argument,
-                            "granted_on": (permission.granted_on - EPOCH).total_seconds(),
-                        })
-                return user_details
-
-            # User permissions are inherited from all groups for which their
-            # role is not "np-owner".  User groups are all groups in which a
-            # user is a member by inheritance, except for ancestors of groups
-            # where their role is "np-owner", unless the user is a member of
-            # such an ancestor via a non-"np-owner" role in another group.
-            rpaths = {}
-            for group in self._rgraph.neighbors(user):
-                role = self._rgraph[user][group]["role"]
-                if GROUP_EDGE_ROLES[role] == "np-owner":
-                    group_name = group[1]
-                    groups[group_name] = {
-                        "name": group_name,
-                        "path": [username, group_name],
-                        "distance": 1,
-                        "role": role,
-                        "rolename": GROUP_EDGE_ROLES[role],
-                    }
-                    continue
-                new_rpaths = single_source_shortest_path(self._rgraph, group, max_dist)
-                for parent, path in new_rpaths.iteritems():
-                    if parent not in rpaths or 1 + len(path) < len(rpaths[parent]):
-                        rpaths[parent] = [user] + path
-
-            for parent, path in rpaths.iteritems():
-                if parent == user:
-                    continue
-                parent_type, parent_name = parent
-                role = self._rgraph[path[-2]][parent]["role"]
-                groups[parent_name] = {
-                    "name": parent_name,
-                    "path": [elem[1] for elem in path],
-                    "distance": len(path) - 1,
-                    "role": role,
-                    "rolename": GROUP_EDGE_ROLES[role],
-                }
-
-                for permission in self.permission_metadata[parent_name]:
-                    perm_data = {
-                        "permission": permission.permission,
-                        "argument": permission.argument,
-                        "granted_on": (permission.granted_on - EPOCH).total_seconds(),
-                        "path": [elem[1] for elem in path],
-                        "distance": len(path) - 1,
-                    }
-
-                    if expose_aliases:
-                        perm_data["alias"] = permission.alias
-
-                    permissions.append(perm_data)
-
-            return user_details
+    def get_user_details_many(self, usernames, cutoff=None, expose_aliases=True, fields=None):
+        return self.snapshot.get_user_details_many(usernames, cutoff, expose_aliases, fields)
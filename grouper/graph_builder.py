@@ -0,0 +1,215 @@
+"""Building graph snapshots in a separate Python process.
+
+Building the graph is CPU-bound Python that holds the GIL for as long as it runs.  A GraphBuilder
+hands that work to a builder process, so request handling in the server only pays for unpickling
+the result.
+
+The builder is a freshly started interpreter (python -m grouper.graph_builder), not a fork: a
+server forked after it started its threads would leave the child holding whatever locks those
+threads held at that moment, such as logging's or a connection pool's, and it could hang on them.
+The builder keeps the last graph it built, so it can apply incremental changes on top of it.
+
+Each response is a length-prefixed payload, so the server can read the whole of it against one
+deadline before unpickling anything: a builder that stalls partway through a response is stopped
+like one that never starts it.
+"""
+
+from contextlib import closing
+import cPickle as pickle
+from cStringIO import StringIO
+import logging
+import os
+import select
+import struct
+import subprocess
+import sys
+import time
+
+from grouper import stats
+from grouper.graph import GraphSnapshot, GroupGraph
+from grouper.graph_engine import GRAPH_ENGINES
+from grouper.models.base.session import get_db_engine, Session
+from grouper.plugin import initialize_plugins
+
+# Each response starts with its payload's length, as an unsigned 64-bit big-endian integer.
+LENGTH_FORMAT = "!Q"
+READ_SIZE = 1 << 20
+
+
+class GraphBuilder(object):
+    def __init__(self, timeout, plugin_dirs=None, plugin_module_paths=None,
+                 service_name="grouper-graph-builder"):
+        """Create a builder whose process is started on first use.
+
+        Args:
+            timeout: the most seconds to wait for a build before stopping the process; the next
+                build starts a new one
+            plugin_dirs, plugin_module_paths, service_name: the plugins for the process to load,
+                as for grouper.plugin.initialize_plugins
+        """
+        self.timeout = timeout
+        self.plugin_dirs = plugin_dirs or []
+        self.plugin_module_paths = plugin_module_paths or []
+        self.service_name = service_name
+        self.logger = logging.getLogger(__name__)
+        self._process = None
+
+    def _start(self):
+        env = dict(os.environ)
+        # Run the same code as this process, wherever it was imported from.
+        env["PYTHONPATH"] = os.pathsep.join(path for path in sys.path if path)
+        self._process = subprocess.Popen(
+            [sys.executable, "-m", "grouper.graph_builder"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=-1,
+            close_fds=True,
+            env=env,
+        )
+
+    def stop(self):
+        """Stop the builder process, if it's running."""
+        if self._process is None:
+            return
+        try:
+            self._process.kill()
+        except OSError:
+            pass  # Already gone.
+        self._process.wait()
+        self._process = None
+
+    def _read(self, size, deadline):
+        """Read size bytes from the builder, or return None if they haven't all come by deadline."""
+        # Read the pipe directly: select can't see data already sitting in a file object's buffer.
+        fd = self._process.stdout.fileno()
+        chunks = []
+        while size > 0:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            readable, _, _ = select.select([fd], [], [], remaining)
+            if not readable:
+                return None
+            chunk = os.read(fd, min(size, READ_SIZE))
+            if not chunk:
+                raise EOFError("Graph builder exited")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return "".join(chunks)
+
+    def build(self, graph, db_url, checkpoint, checkpoint_time, changes):
+        """Build a snapshot for graph like GroupGraph.build_snapshot, in the builder process.
+
+        Returns:
+            the GraphSnapshot, or None if the build failed or took longer than timeout, in which
+            case the caller should build it itself
+        """
+        engine_names = {engine: name for name, engine in GRAPH_ENGINES.iteritems()}
+        request = {
+            "db_url": str(db_url),
+            "engine": engine_names[graph.engine],
+            "loader_threads": graph.loader_threads,
+            "plugins": (self.plugin_dirs, self.plugin_module_paths, self.service_name),
+            "base_checkpoint": graph.checkpoint,
+            "checkpoint": checkpoint,
+            "checkpoint_time": checkpoint_time,
+            "changes": changes,
+        }
+
+        try:
+            if self._process is None:
+                self._start()
+            pickle.dump(request, self._process.stdin, pickle.HIGHEST_PROTOCOL)
+            self._process.stdin.flush()
+
+            deadline = time.time() + self.timeout
+            length = self._read(struct.calcsize(LENGTH_FORMAT), deadline)
+            payload = None
+            if length is not None:
+                payload = self._read(struct.unpack(LENGTH_FORMAT, length)[0], deadline)
+            if payload is None:
+                stats.log_rate("graph_builder_timeouts", 1)
+                self.logger.error(
+                    "Graph builder took more than %ss; stopping it.", self.timeout)
+                self.stop()
+                return None
+
+            start = time.time()
+            payload = StringIO(payload)
+            if not pickle.load(payload):
+                return None  # The builder logged why.
+            snapshot = GraphSnapshot.load_from(payload)
+            stats.log_rate("graph_child_load_ms", int((time.time() - start) * 1000))
+            return snapshot
+        except Exception:
+            self.logger.exception("Graph builder failed; stopping it.")
+            self.stop()
+            return None
+
+
+def _respond(responses, snapshot):
+    """Send the snapshot, or None if the build failed, as one length-prefixed payload."""
+    payload = StringIO()
+    pickle.dump(snapshot is not None, payload, pickle.HIGHEST_PROTOCOL)
+    if snapshot is not None:
+        snapshot.dump(payload)
+    payload = payload.getvalue()
+    responses.write(struct.pack(LENGTH_FORMAT, len(payload)))
+    responses.write(payload)
+    responses.flush()
+
+
+def serve(requests, responses):
+    """Answer build requests from GraphBuilder until requests is closed.
+
+    Each response's payload is True and the pickled snapshot, or False if the build failed.
+    """
+    graph = GroupGraph()
+    db_url, db_engine = None, None
+    plugins = None
+
+    while True:
+        try:
+            request = pickle.load(requests)
+        except EOFError:
+            return
+
+        try:
+            if request["plugins"] != plugins:
+                plugins = request["plugins"]
+                initialize_plugins(*plugins)
+            if request["db_url"] != db_url:
+                db_url = request["db_url"]
+                db_engine = get_db_engine(db_url)
+
+            graph.engine = GRAPH_ENGINES[request["engine"]]
+            graph.loader_threads = request["loader_threads"]
+            changes = request["changes"]
+            # Changes only apply to the graph they were computed against.
+            if (graph.snapshot.graph is None or
+                    graph.checkpoint != request["base_checkpoint"] or
+                    not isinstance(graph.snapshot.graph, graph.engine)):
+                changes = None
+
+            with closing(Session(bind=db_engine)) as session:
+                graph.snapshot = graph.build_snapshot(
+                    session, request["checkpoint"], request["checkpoint_time"], changes)
+        except Exception:
+            logging.exception("Failed to build the graph.")
+            graph = GroupGraph()
+            _respond(responses, None)
+            continue
+
+        _respond(responses, graph.snapshot)
+
+
+def main():
+    # Responses go to the real stdout; anything else printed goes to stderr with the logs.
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    logging.basicConfig(format="%(asctime)-15s\t%(levelname)s\t%(message)s  [%(name)s]")
+    serve(sys.stdin, responses)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""A cache of the details GroupGraph computes by walking the graph.
+
+Results are cached per GraphSnapshot, so they can never be served for a checkpoint other than the
+one they were computed at, except when an incremental refresh shows that nothing they depend on
+has changed and carries them over to the next snapshot.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+from grouper import stats
+
+
+class DetailsCache(object):
+    def __init__(self, max_entries=0, max_weight=0):
+        """Create a cache that holds nothing if max_entries is 0.
+
+        Args:
+            max_entries: the most results to keep
+            max_weight: the most total weight to keep, as a stand-in for memory; each result
+                weighs as much as the number of users and groups it depends on
+        """
+        self.max_entries = max_entries
+        self.max_weight = max_weight
+        self.weight = 0
+        self._entries = OrderedDict()  # key -> (value, dependencies, weight), oldest use first.
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Returns the cached value for key, or None."""
+        if not self.max_entries:
+            return None
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+        stats.log_rate("graph_cache_hits" if entry else "graph_cache_misses", 1)
+        return entry[0] if entry else None
+
+    def put(self, key, value, dependencies):
+        """Cache value under key.
+
+        Args:
+            key: hashable key
+            value: the value, which callers must not modify
+            dependencies: frozenset of the graph nodes value was computed from
+        """
+        if not self.max_entries:
+            return
+        weight = len(dependencies)
+        if self.max_weight and weight > self.max_weight:
+            return
+
+        evicted = 0
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.weight -= old[2]
+            self._entries[key] = (value, dependencies, weight)
+            self.weight += weight
+            while (len(self._entries) > self.max_entries or
+                    (self.max_weight and self.weight > self.max_weight)):
+                _, (_, _, evicted_weight) = self._entries.popitem(last=False)
+                self.weight -= evicted_weight
+                evicted += 1
+        if evicted:
+            stats.log_rate("graph_cache_evictions", evicted)
+
+    def carry_over(self, changed_nodes):
+        """Returns a new cache with the entries that don't depend on any of changed_nodes."""
+        new_cache = DetailsCache(self.max_entries, self.max_weight)
+        with self._lock:
+            entries = self._entries.items()
+        for key, entry in entries:
+            if entry[1].isdisjoint(changed_nodes):
+                new_cache._entries[key] = entry
+                new_cache.weight += entry[2]
+        stats.log_rate("graph_cache_carried_over", len(new_cache))
+        stats.log_rate("graph_cache_dropped", len(entries) - len(new_cache))
+        return new_cache
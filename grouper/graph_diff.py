@@ -0,0 +1,136 @@
+"""What changed between graph snapshots, so clients can ask for it instead of mirroring everything.
+
+Each time GroupGraph publishes a new snapshot, it can compare it to the one it replaces and keep
+the names of the users, groups, permissions and service accounts whose details may differ between
+the two.  A ChangeHistory holds the most recent of these, which is enough to tell a client what
+changed since any checkpoint it was served within that window.
+
+Diffing compares every user, group and permission of the two snapshots, so it costs time in
+proportion to the whole graph on each publish, even after an incremental refresh.
+"""
+
+from collections import namedtuple
+from threading import Lock
+
+# Names of what changed after checkpoint `since` up to and including checkpoint `until`.
+SnapshotDiff = namedtuple(
+    "SnapshotDiff", ["since", "until", "users", "groups", "permissions", "service_accounts"])
+
+
+def _changed_keys(old, new):
+    """Returns the keys whose values differ between two dicts, including added and removed."""
+    changed = set()
+    for key in set(old) | set(new):
+        old_value = old.get(key)
+        new_value = new.get(key)
+        if old_value is not new_value and old_value != new_value:
+            changed.add(key)
+    return changed
+
+
+def _group_members(graph):
+    """Returns a dict of group name: set of (member, role) for a graph engine."""
+    members = {}
+    for parent, member, role in graph.edges_with_roles():
+        members.setdefault(parent[1], set()).add((member, role))
+    return members
+
+
+def _reachable(graph, nodes, neighbors):
+    """Returns the nodes of a graph engine reachable from any of nodes (including them) by
+    following neighbors, which is its members or parents method."""
+    seen = {node for node in nodes if graph.has_node(node)}
+    queue = list(seen)
+    while queue:
+        node = queue.pop()
+        for neighbor, _ in neighbors(node):
+            if neighbor not in seen:
+                seen.add(neighbor)
+                queue.append(neighbor)
+    return seen
+
+
+def diff_snapshots(old, new):
+    """Returns a SnapshotDiff of what may have changed from GraphSnapshot old to new.
+
+    A user changes with its metadata, its groups or its permissions.  A group changes with its own
+    metadata, grants or members, and with anything above or below it, since those show up in its
+    details.  A permission changes with who it's granted to and with the details of any of those
+    groups.
+    """
+    users = (_changed_keys(old.user_metadata, new.user_metadata) |
+             _changed_keys(old.user_closures, new.user_closures) |
+             _changed_keys(old.service_account_permissions, new.service_account_permissions))
+
+    changed_groups = (_changed_keys(old.group_tuples, new.group_tuples) |
+                      _changed_keys(old.disabled_group_tuples, new.disabled_group_tuples) |
+                      _changed_keys(old.group_metadata, new.group_metadata) |
+                      _changed_keys(old.permission_metadata, new.permission_metadata) |
+                      _changed_keys(old.group_service_accounts, new.group_service_accounts) |
+                      _changed_keys(_group_members(old.graph), _group_members(new.graph)))
+    groups = set(changed_groups)
+    for snapshot in (old, new):
+        nodes = [("Group", name) for name in changed_groups]
+        for neighbors in (snapshot.graph.members, snapshot.graph.parents):
+            groups.update(name for node_type, name in _reachable(snapshot.graph, nodes, neighbors)
+                          if node_type == "Group")
+
+    permissions = (_changed_keys(old.permission_grants, new.permission_grants) |
+                   _changed_keys({p.name: p for p in old.permission_tuples},
+                                 {p.name: p for p in new.permission_tuples}))
+    for snapshot in (old, new):
+        permissions.update(name for name, grants in snapshot.permission_grants.iteritems()
+                           if not grants.groups.isdisjoint(groups))
+
+    service_accounts = set()
+    for snapshot in (old, new):
+        service_accounts.update(
+            name for name in users
+            if name in snapshot.user_metadata and (
+                "service_account" in snapshot.user_metadata[name] or
+                snapshot.user_metadata[name]["role_user"]))
+
+    return SnapshotDiff(old.checkpoint, new.checkpoint, users - service_accounts, groups,
+                        permissions, service_accounts)
+
+
+class ChangeHistory(object):
+    def __init__(self, max_entries=0):
+        """Create a history that keeps nothing if max_entries is 0.
+
+        Args:
+            max_entries: the most SnapshotDiffs to keep
+        """
+        self.max_entries = max_entries
+        self._diffs = []  # Oldest first, each one starting where the one before it ends.
+        self._lock = Lock()
+
+    def add(self, diff):
+        """Record a SnapshotDiff that follows the ones already recorded."""
+        if not self.max_entries:
+            return
+        with self._lock:
+            if self._diffs and self._diffs[-1].until != diff.since:
+                # A gap we can't account for, so nothing before it can be answered for.
+                self._diffs = []
+            self._diffs.append(diff)
+            del self._diffs[:-self.max_entries]
+
+    def since(self, checkpoint):
+        """Returns a SnapshotDiff of everything changed after checkpoint, or None if that's
+        further back than the history goes."""
+        with self._lock:
+            diffs = list(self._diffs)
+        if not diffs or checkpoint < diffs[0].since:
+            return None
+
+        users, groups, permissions, service_accounts = set(), set(), set(), set()
+        for diff in diffs:
+            # A checkpoint inside a diff's range (served by another server) gets all of it.
+            if diff.until > checkpoint:
+                users |= diff.users
+                groups |= diff.groups
+                permissions |= diff.permissions
+                service_accounts |= diff.service_accounts
+        return SnapshotDiff(checkpoint, max(checkpoint, diffs[-1].until), users, groups,
+                            permissions, service_accounts)
@@ -0,0 +1,220 @@
+"""Storage for the structure of the user/group graph.
+
+GroupGraph keeps the nodes and edges of the graph in an engine and only talks to it through the
+methods below, so engines can be swapped without callers noticing.  Nodes are ("User", name) or
+("Group", name) tuples and every edge goes from a group to one of its members and carries the
+index of the member's role in GROUP_EDGE_ROLES.
+
+NetworkXEngine keeps a networkx DiGraph and its reverse, which is simple but costs a dict per
+node and per edge in each direction.  CompactEngine interns nodes to integer ids and stores both
+directions as CSR arrays, which is far smaller and faster to traverse for large graphs.
+"""
+
+from array import array
+from bisect import bisect_left
+
+from networkx import DiGraph, single_source_shortest_path
+
+
+class NetworkXEngine(object):
+    def __init__(self, nodes, edges):
+        """Build the engine.
+
+        Args:
+            nodes: iterable of nodes
+            edges: iterable of (group node, member node, role) tuples; nodes missing from
+                `nodes` are added
+        """
+        self._graph = DiGraph()
+        self._graph.add_nodes_from(tuple(node) for node in nodes)
+        self._graph.add_edges_from(
+            (tuple(parent), tuple(member), {"role": role}) for parent, member, role in edges)
+        self._rgraph = self._graph.reverse()
+
+    def nodes(self):
+        return self._graph.nodes()
+
+    def edges(self):
+        return self._graph.edges()
+
+    def edges_with_roles(self):
+        return [(parent, member, data["role"])
+                for parent, member, data in self._graph.edges_iter(data=True)]
+
+    def has_node(self, node):
+        return self._graph.has_node(node)
+
+    def members(self, node):
+        """Returns a list of (member, role) for the direct members of a group."""
+        return [(member, data["role"]) for member, data in self._graph[node].iteritems()]
+
+    def parents(self, node):
+        """Returns a list of (group, role) for the groups a node is a direct member of."""
+        return [(parent, data["role"]) for parent, data in self._rgraph[node].iteritems()]
+
+    def role(self, parent, member):
+        return self._graph[parent][member]["role"]
+
+    def shortest_paths(self, node, cutoff=None):
+        """Returns a dict of member: shortest path from node down to that member."""
+        return single_source_shortest_path(self._graph, node, cutoff)
+
+    def reverse_shortest_paths(self, node, cutoff=None):
+        """Returns a dict of ancestor: shortest path from node up to that ancestor."""
+        return single_source_shortest_path(self._rgraph, node, cutoff)
+
+
+class CompactEngine(object):
+    # The CSR arrays.  GraphSnapshot writes these out apart from the rest of the engine, so that
+    # processes loading a snapshot file can use them straight from the mapped file.
+    _ARRAYS = ("_member_offsets", "_member_ids", "_member_roles",
+               "_parent_offsets", "_parent_ids", "_parent_roles")
+
+    def __init__(self, nodes, edges):
+        """Build the engine.  Arguments are the same as for NetworkXEngine."""
+        self._nodes = []  # id -> node
+        self._ids = {}  # node -> id
+
+        for node in nodes:
+            self._intern(node)
+        edge_ids = [(self._intern(parent), self._intern(member), role)
+                    for parent, member, role in edges]
+
+        # Members of node i are _member_ids[_member_offsets[i]:_member_offsets[i + 1]], sorted
+        # by id, with their roles at the same positions in _member_roles.  _parent_* is the same
+        # for the groups each node is a member of.
+        self._member_offsets, self._member_ids, self._member_roles = self._build_csr(
+            len(self._nodes), edge_ids)
+        self._parent_offsets, self._parent_ids, self._parent_roles = self._build_csr(
+            len(self._nodes), [(member, parent, role) for parent, member, role in edge_ids])
+
+    def split_arrays(self):
+        """Returns the engine's state without its CSR arrays, and a list of those arrays."""
+        state = dict(self.__dict__)
+        arrays = [state.pop(name) for name in self._ARRAYS]
+        return state, arrays
+
+    @classmethod
+    def from_split_arrays(cls, state, arrays):
+        """Rebuild an engine from what split_arrays returned.
+
+        The arrays may be any sequences of ints the same length as the ones returned, such as
+        ctypes arrays over a mapped file.
+        """
+        engine = cls.__new__(cls)
+        engine.__dict__.update(state)
+        engine.__dict__.update(zip(cls._ARRAYS, arrays))
+        return engine
+
+    def _intern(self, node):
+        node = tuple(node)
+        node_id = self._ids.get(node)
+        if node_id is None:
+            node_id = len(self._nodes)
+            self._ids[node] = node_id
+            self._nodes.append(node)
+        return node_id
+
+    @staticmethod
+    def _build_csr(num_nodes, edges):
+        # Later duplicates of an edge win, as they do when adding edges to networkx.
+        adjacency = {}
+        for source, target, role in edges:
+            adjacency[(source, target)] = role
+
+        offsets = array("i", [0] * (num_nodes + 1))
+        for source, _ in adjacency:
+            offsets[source + 1] += 1
+        for i in xrange(num_nodes):
+            offsets[i + 1] += offsets[i]
+
+        targets = array("i")
+        roles = array("b")
+        for (source, target), role in sorted(adjacency.iteritems()):
+            targets.append(target)
+            roles.append(role)
+        return offsets, targets, roles
+
+    def nodes(self):
+        return list(self._nodes)
+
+    def edges(self):
+        return [(parent, member) for parent, member, _ in self.edges_with_roles()]
+
+    def edges_with_roles(self):
+        out = []
+        offsets, targets, roles = self._member_offsets, self._member_ids, self._member_roles
+        for parent_id, parent in enumerate(self._nodes):
+            for i in xrange(offsets[parent_id], offsets[parent_id + 1]):
+                out.append((parent, self._nodes[targets[i]], roles[i]))
+        return out
+
+    def has_node(self, node):
+        return node in self._ids
+
+    def _neighbors(self, node, offsets, targets, roles):
+        node_id = self._ids[node]
+        return [(self._nodes[targets[i]], roles[i])
+                for i in xrange(offsets[node_id], offsets[node_id + 1])]
+
+    def members(self, node):
+        """Returns a list of (member, role) for the direct members of a group."""
+        return self._neighbors(node, self._member_offsets, self._member_ids, self._member_roles)
+
+    def parents(self, node):
+        """Returns a list of (group, role) for the groups a node is a direct member of."""
+        return self._neighbors(node, self._parent_offsets, self._parent_ids, self._parent_roles)
+
+    def role(self, parent, member):
+        parent_id = self._ids[parent]
+        member_id = self._ids[member]
+        start = self._member_offsets[parent_id]
+        end = self._member_offsets[parent_id + 1]
+        i = bisect_left(self._member_ids, member_id, start, end)
+        if i == end or self._member_ids[i] != member_id:
+            raise KeyError(member)
+        return self._member_roles[i]
+
+    def _shortest_paths(self, node, cutoff, offsets, targets):
+        # Same traversal, and same handling of cutoff, as networkx's single_source_shortest_path.
+        source = self._ids[node]
+        predecessors = {source: None}
+        if cutoff != 0:
+            level = 0
+            this_level = [source]
+            while this_level:
+                next_level = []
+                for node_id in this_level:
+                    for i in xrange(offsets[node_id], offsets[node_id + 1]):
+                        target = targets[i]
+                        if target not in predecessors:
+                            predecessors[target] = node_id
+                            next_level.append(target)
+                this_level = next_level
+                level += 1
+                if cutoff is not None and cutoff <= level:
+                    break
+
+        paths = {}
+        for node_id in predecessors:
+            path = []
+            while node_id is not None:
+                path.append(self._nodes[node_id])
+                node_id = predecessors[node_id]
+            path.reverse()
+            paths[path[-1]] = path
+        return paths
+
+    def shortest_paths(self, node, cutoff=None):
+        """Returns a dict of member: shortest path from node down to that member."""
+        return self._shortest_paths(node, cutoff, self._member_offsets, self._member_ids)
+
+    def reverse_shortest_paths(self, node, cutoff=None):
+        """Returns a dict of ancestor: shortest path from node up to that ancestor."""
+        return self._shortest_paths(node, cutoff, self._parent_offsets, self._parent_ids)
+
+
+GRAPH_ENGINES = {
+    "networkx": NetworkXEngine,
+    "compact": CompactEngine,
+}
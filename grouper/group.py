@@ -1,6 +1,6 @@
 from typing import TYPE_CHECKING
 
-from grouper.graph import Graph, NoSuchGroup
+from grouper.graph import Graph
 from grouper.models.group import Group
 
 if TYPE_CHECKING:
@@ -27,8 +27,8 @@ def get_audited_groups(session):
     # type: (Session) -> List[Group]
     """Returns all audited enabled groups.
 
-    At present, this is not cached at all and returns the full list of
-    groups from the database each time it's called.
+    Which groups are audited is read from the graph, so groups that aren't in it yet are left
+    out.
 
     Args:
         session (Session): Session to load data on.
@@ -36,17 +36,5 @@ def get_audited_groups(session):
     Returns:
         a list of all enabled and audited Group objects in the database
     """
-    audited_groups = []
-    graph = Graph()
-    for group in get_all_groups(session):
-        try:
-            group_md = graph.get_group_details(group.name)
-        except NoSuchGroup:
-            # Very new group with no metadata yet, or it has been disabled and
-            # excluded from in-memory cache.
-            continue
-
-        if group_md.get('audited', False):
-            audited_groups.append(group)
-
-    return audited_groups
+    audited_groups = Graph().audited_groups
+    return [group for group in get_all_groups(session) if group.name in audited_groups]
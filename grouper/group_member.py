@@ -2,7 +2,7 @@ from datetime import datetime
 
 from grouper.models.base.constants import OBJ_TYPES
 from grouper.models.comment import Comment
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.group_edge import GROUP_EDGE_ROLES, GroupEdge
 from grouper.models.request import Request
 from grouper.models.request_status_change import RequestStatusChange
@@ -120,6 +120,6 @@ def persist_group_member_changes(session, group, requester, member, status, reas
         edge.apply_changes(request.changes)
         session.flush()
 
-    Counter.incr(session, "updates")
+    GraphChange.record(session, groups=[group.groupname])
 
     return request
@@ -2,7 +2,7 @@ import logging
 
 from typing import TYPE_CHECKING
 
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.group_service_accounts import GroupServiceAccount
 from grouper.models.service_account import ServiceAccount
 from grouper.models.user import User
@@ -19,7 +19,7 @@ def add_service_account(session, group, service_account):
     logging.debug("Adding service account %s to %s", service_account.user.username,
         group.groupname)
     GroupServiceAccount(group_id=group.id, service_account=service_account).add(session)
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[service_account.user.username], groups=[group.groupname])
     session.commit()
 
 
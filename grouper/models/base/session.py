@@ -1,8 +1,15 @@
 import functools
 import logging
+from threading import Lock
+import time
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import DisconnectionError, TimeoutError
 from sqlalchemy.orm import Session as _Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from grouper import stats
 
 
 def flush_transaction(method):
@@ -24,8 +31,94 @@ def flush_transaction(method):
     return wrapper
 
 
-def get_db_engine(url):
-    return create_engine(url, pool_recycle=300)
+_timed_pool_classes = {}
+
+
+def _timed_pool_class(pool_class):
+    """Returns a subclass of pool_class that reports how long each checkout takes as
+    db_pool_checkout_ms, and checkouts that time out waiting for a connection as
+    db_pool_timeouts."""
+    if pool_class not in _timed_pool_classes:
+        class TimedPool(pool_class):
+            def _timed(self, checkout):
+                start = time.time()
+                try:
+                    return checkout()
+                except TimeoutError:
+                    stats.log_rate("db_pool_timeouts", 1)
+                    raise
+                finally:
+                    stats.log_rate("db_pool_checkout_ms", int((time.time() - start) * 1000))
+
+            def connect(self):
+                return self._timed(super(TimedPool, self).connect)
+
+            def unique_connection(self):
+                # What engines check connections out with.
+                return self._timed(super(TimedPool, self).unique_connection)
+
+        TimedPool.__name__ = "Timed{}".format(pool_class.__name__)
+        _timed_pool_classes[pool_class] = TimedPool
+    return _timed_pool_classes[pool_class]
+
+
+def _ping(dbapi_connection, connection_record, connection_proxy):
+    """Pool checkout listener that makes the pool replace connections that stopped working."""
+    try:
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        finally:
+            cursor.close()
+    except Exception:
+        stats.log_rate("db_pool_ping_failures", 1)
+        raise DisconnectionError()
+
+
+def get_db_engine(url, pool_size=None, max_overflow=None, pool_timeout=None, pre_ping=False):
+    """Create an engine for url that reports on its connection pool.
+
+    Besides the stats of _timed_pool_class, the number of connections checked out of the pool is
+    reported as the db_pool_checked_out gauge each time it changes.
+
+    Args:
+        url: the SqlAlchemy URL of the database
+        pool_size: the most connections kept open, or None for the SqlAlchemy default
+        max_overflow: the most connections opened beyond pool_size while all of those are in use,
+            or None for the SqlAlchemy default
+        pool_timeout: the seconds to wait for a connection before giving up, or None for the
+            SqlAlchemy default
+        pre_ping: whether to check that each connection still works as it's checked out, and
+            replace it if not, so a database restart doesn't fail the requests that follow it
+
+    The pool settings are ignored for databases whose connections aren't pooled, such as sqlite
+    files.
+    """
+    url = make_url(url)
+    pool_class = url.get_dialect().get_pool_class(url)
+
+    kwargs = {"pool_recycle": 300, "poolclass": _timed_pool_class(pool_class)}
+    if issubclass(pool_class, QueuePool):
+        for name, value in (("pool_size", pool_size), ("max_overflow", max_overflow),
+                            ("pool_timeout", pool_timeout)):
+            if value is not None:
+                kwargs[name] = value
+    engine = create_engine(url, **kwargs)
+
+    checked_out = [0]
+    lock = Lock()
+
+    def count(change):
+        with lock:
+            checked_out[0] += change
+            value = checked_out[0]
+        stats.log_gauge("db_pool_checked_out", value)
+
+    if pre_ping:
+        event.listen(engine, "checkout", _ping)
+    event.listen(engine, "checkout", lambda *args: count(1))
+    event.listen(engine, "checkin", lambda *args: count(-1))
+    return engine
 
 
 class Session(_Session):
@@ -0,0 +1,88 @@
+from sqlalchemy import Column, Index, Integer, String
+
+from grouper.constants import MAX_NAME_LENGTH
+from grouper.models.base.model_base import Model
+from grouper.models.counter import Counter
+
+
+class GraphChange(Model):
+    """
+    Records which users and groups were touched by a bump of the "updates" counter. Writers that
+    know exactly what they changed log it here next to the bump, which lets the graph reload just
+    those entities instead of rebuilding everything. A checkpoint with no rows (a bump from a
+    writer that doesn't log its changes) forces a full rebuild.
+    """
+
+    __tablename__ = "graph_changes"
+    __table_args__ = (
+        Index(
+            "graph_changes_checkpoint_idx",
+            "checkpoint",
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    checkpoint = Column(Integer, nullable=False)
+    entity_type = Column(String(length=16), nullable=False)  # "User", "Group" or "Permission"
+    entity_name = Column(String(length=MAX_NAME_LENGTH), nullable=False)
+
+    @classmethod
+    def record(cls, session, users=None, groups=None, permissions=None):
+        """
+        Bump the "updates" counter and log the users, groups and permissions it covers.
+
+        Args:
+            session(Session): database session
+            users(iterable of str): names of users whose cached data changed
+            groups(iterable of str): names of groups whose cached data (including memberships
+                where the group is the parent or the member) changed; when renaming, pass both
+                the old and the new name
+            permissions(iterable of str): names of permissions created or whose own data
+                changed; permissions are reloaded in full on every incremental refresh, so these
+                are only logged to account for the bump
+
+        Returns:
+            the updated Counter
+        """
+        counter = Counter.incr(session, "updates")
+        checkpoint = counter.count
+
+        for name in set(users or []):
+            cls(checkpoint=checkpoint, entity_type="User", entity_name=name).add(session)
+        for name in set(groups or []):
+            cls(checkpoint=checkpoint, entity_type="Group", entity_name=name).add(session)
+        for name in set(permissions or []):
+            cls(checkpoint=checkpoint, entity_type="Permission", entity_name=name).add(session)
+
+        session.flush()
+        return counter
+
+    @classmethod
+    def get_changes(cls, session, since, until):
+        """
+        Return the users and groups changed after checkpoint `since` up to and including
+        checkpoint `until`.
+
+        Returns:
+            a 2-tuple of (set of user names, set of group names), or None if some checkpoint in
+            the range wasn't logged and the changes can't be reconstructed.
+        """
+        if until <= since:
+            return None
+
+        rows = session.query(cls.checkpoint, cls.entity_type, cls.entity_name).filter(
+            cls.checkpoint > since,
+            cls.checkpoint <= until,
+        ).all()
+
+        if len({row.checkpoint for row in rows}) != until - since:
+            return None
+
+        users = {row.entity_name for row in rows if row.entity_type == "User"}
+        groups = {row.entity_name for row in rows if row.entity_type == "Group"}
+        return users, groups
+
+    @classmethod
+    def prune(cls, session, before):
+        """Delete log entries for checkpoints older than `before`."""
+        session.query(cls).filter(cls.checkpoint < before).delete(synchronize_session=False)
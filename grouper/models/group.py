@@ -17,7 +17,7 @@ from grouper.models.base.constants import OBJ_TYPES_IDX
 from grouper.models.base.model_base import Model
 from grouper.models.base.session import flush_transaction
 from grouper.models.comment import CommentObjectMixin
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.group_edge import APPROVER_ROLE_INDICES, GroupEdge, OWNER_ROLE_INDICES
 from grouper.models.permission import Permission
 from grouper.models.permission_map import PermissionMap
@@ -324,11 +324,11 @@ class Group(Model, CommentObjectMixin):
 
     def enable(self):
         self.enabled = True
-        Counter.incr(self.session, "updates")
+        GraphChange.record(self.session, groups=[self.groupname])
 
     def disable(self):
         self.enabled = False
-        Counter.incr(self.session, "updates")
+        GraphChange.record(self.session, groups=[self.groupname])
 
     @staticmethod
     def get(session, pk=None, name=None):
@@ -340,7 +340,7 @@ class Group(Model, CommentObjectMixin):
 
     def add(self, session):
         super(Group, self).add(session)
-        Counter.incr(session, "updates")
+        GraphChange.record(session, groups=[self.groupname])
         return self
 
     def __repr__(self):
@@ -8,7 +8,7 @@ from grouper.models.base.constants import OBJ_TYPES_IDX, REQUEST_STATUS_CHOICES
 from grouper.models.base.model_base import Model
 from grouper.models.base.session import flush_transaction
 from grouper.models.comment import Comment, CommentObjectMixin
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.group_edge import GroupEdge
 from grouper.models.json_encoded_type import JsonEncodedType
 from grouper.models.request_status_change import RequestStatusChange
@@ -104,4 +104,4 @@ class Request(Model, CommentObjectMixin):
             ).one()
             edge.apply_changes(self.changes)
 
-        Counter.incr(self.session, "updates")
+        GraphChange.record(self.session, groups=[self.requesting.groupname])
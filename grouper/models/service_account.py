@@ -3,7 +3,7 @@ from sqlalchemy.orm import backref, relationship
 
 from grouper.models.base.model_base import Model
 from grouper.models.base.session import Session  # noqa
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.user import User
 
 
@@ -55,5 +55,5 @@ class ServiceAccount(Model):
     def add(self, session):
         # type: (Session) -> ServiceAccount
         super(ServiceAccount, self).add(session)
-        Counter.incr(session, "updates")
+        GraphChange.record(session, users=[self.user.username])
         return self
@@ -14,6 +14,15 @@ def _make_secret():
     return os.urandom(20).encode("hex")
 
 
+def check_hashed_secret(secret, hashed_secret):
+    """Whether secret is the one hashed_secret was made from."""
+    # The length of hashed_secret is not secret
+    return hmac.compare_digest(
+            hashlib.sha256(secret).hexdigest(),
+            hashed_secret.encode('utf-8'),
+    )
+
+
 class UserToken(Model):
     """Simple bearer tokens used by third parties to verify user identity"""
 
@@ -67,11 +76,7 @@ class UserToken(Model):
         return secret
 
     def check_secret(self, secret):
-        # The length of self.hashed_secret is not secret
-        return self.enabled and hmac.compare_digest(
-                hashlib.sha256(secret).hexdigest(),
-                self.hashed_secret.encode('utf-8'),
-        )
+        return self.enabled and check_hashed_secret(secret, self.hashed_secret)
 
     @property
     def enabled(self):
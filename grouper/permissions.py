@@ -14,6 +14,7 @@ from grouper.models.audit_log import AuditLog
 from grouper.models.base.constants import OBJ_TYPES_IDX
 from grouper.models.comment import Comment
 from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.group import Group
 from grouper.models.permission import Permission
 from grouper.models.permission_map import PermissionMap
@@ -69,7 +70,7 @@ def grant_permission(session, group_id, permission_id, argument=''):
     mapping = PermissionMap(permission_id=permission_id, group_id=group_id, argument=argument)
     mapping.add(session)
 
-    Counter.incr(session, "updates")
+    GraphChange.record(session, groups=[Group.get(session, pk=group_id).groupname])
 
     session.commit()
 
@@ -95,7 +96,7 @@ def grant_permission_to_service_account(session, account, permission, argument='
         permission_id=permission.id, service_account_id=account.id, argument=argument)
     mapping.add(session)
 
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[account.user.username])
 
     session.commit()
 
@@ -12,6 +12,11 @@ if TYPE_CHECKING:
 
 
 class BasePlugin(object):
+    # Set to have the aliases returned by get_aliases_for_mapped_permission(s) remembered between
+    # graph rebuilds, rather than asked for again each time.  Only do so if they depend on nothing
+    # but the permission and argument.
+    cacheable_aliases = False
+
     def check_machine_set(self, name, machine_set):
         # type: (str, str) -> None
         """Check whether a service account machine set is valid.
@@ -48,6 +53,23 @@ class BasePlugin(object):
         """
         pass
 
+    def get_aliases_for_mapped_permissions(self, session, permissions):
+        # type: (Session, List[Tuple[str, str]]) -> Dict[Tuple[str, str], List[Tuple[str, str]]]
+        """Called when building the graph to get aliases of many mapped permissions at once.
+
+        Plugins that don't implement this are asked about each permission in turn with
+        get_aliases_for_mapped_permission.
+
+        Args:
+            session: database session
+            permissions: list of (permission, argument) tuples that permissions were granted with
+
+        Returns:
+            A dict of (permission, argument) to a list of the (permission, argument) tuples that
+            it is an alias for.  Permissions without aliases may be left out.
+        """
+        pass
+
     def get_owner_by_arg_by_perm(self, session):
         # type: (Session) -> Dict[str, Dict[str, List[Group]]]
         """Called when determining owners for permission+arg granting.
@@ -16,6 +16,8 @@ class PluginProxy(object):
     def __init__(self, plugins):
         # type: (List[BasePlugin]) -> None
         self._plugins = plugins
+        # Aliases remembered for plugins with cacheable_aliases set, by plugin.
+        self._aliases = {}  # type: Dict[BasePlugin, Dict[Tuple[str, str], List[Tuple[str, str]]]]
 
     def check_machine_set(self, name, machine_set):
         # type: (str, str) -> None
@@ -36,6 +38,65 @@ class PluginProxy(object):
             for alias in aliases:
                 yield alias
 
+    def get_aliases_for_mapped_permissions(
+            self,
+            session,  # type: Session
+            permissions,  # type: Iterable[Tuple[str, str]]
+            all_grants=False,  # type: bool
+            ):
+        # type: (...) -> Dict[Tuple[str, str], List[Tuple[str, str]]]
+        """Get the aliases of many mapped permissions from all plugins.
+
+        With all_grants set, permissions are all the grants there are, and aliases remembered for
+        anything else are forgotten.
+        """
+        permissions = sorted(set(permissions))
+        found = {permission: [] for permission in permissions}
+        for plugin in self._plugins:
+            if plugin.cacheable_aliases:
+                aliases_by_permission = self._get_cached_aliases(
+                    session, plugin, permissions, all_grants)
+            else:
+                aliases_by_permission = self._get_aliases(session, plugin, permissions)
+            for permission, aliases in found.iteritems():
+                aliases.extend(aliases_by_permission.get(permission) or [])
+        return found
+
+    @staticmethod
+    def _get_aliases(
+            session,  # type: Session
+            plugin,  # type: BasePlugin
+            permissions,  # type: List[Tuple[str, str]]
+            ):
+        # type: (...) -> Dict[Tuple[str, str], List[Tuple[str, str]]]
+        aliases_by_permission = plugin.get_aliases_for_mapped_permissions(session, permissions)
+        if aliases_by_permission is None:
+            aliases_by_permission = {
+                (name, argument): plugin.get_aliases_for_mapped_permission(session, name, argument)
+                for name, argument in permissions
+            }
+        return aliases_by_permission
+
+    def _get_cached_aliases(
+            self,
+            session,  # type: Session
+            plugin,  # type: BasePlugin
+            permissions,  # type: List[Tuple[str, str]]
+            all_grants,  # type: bool
+            ):
+        # type: (...) -> Dict[Tuple[str, str], List[Tuple[str, str]]]
+        cached = self._aliases.get(plugin, {})
+        missing = [permission for permission in permissions if permission not in cached]
+        if missing:
+            aliases_by_permission = self._get_aliases(session, plugin, missing)
+            for permission in missing:
+                cached[permission] = list(aliases_by_permission.get(permission) or [])
+        if all_grants:
+            # Start over from this rebuild's grants, so revoked ones don't stay around.
+            cached = {permission: cached[permission] for permission in permissions}
+        self._aliases[plugin] = cached
+        return cached
+
     def get_owner_by_arg_by_perm(self, session):
         # type: (Session) -> Iterable[Dict[str, Dict[str, List[Group]]]]
         for plugin in self._plugins:
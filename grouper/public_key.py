@@ -5,9 +5,11 @@ from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql import label
 import sshpubkeys
 
-from grouper.models.counter import Counter
+from grouper.constants import BULK_QUERY_BATCH_SIZE
+from grouper.models.graph_change import GraphChange
 from grouper.models.permission import Permission
 from grouper.models.public_key import PublicKey
+from grouper.models.public_key_tag import PublicKeyTag
 from grouper.models.public_key_tag_map import PublicKeyTagMap
 from grouper.models.tag_permission_map import TagPermissionMap
 from grouper.plugin import get_plugin_proxy
@@ -17,7 +19,6 @@ from grouper.user_permissions import user_permissions
 if TYPE_CHECKING:
     from typing import Dict, List  # noqa
     from grouper.models.base.session import Session  # noqa
-    from grouper.models.public_key_tag import PublicKeyTag  # noqa
 
 
 class DuplicateKey(Exception):
@@ -110,7 +111,7 @@ def add_public_key(session, user, public_key_str):
 
     try:
         db_pubkey.add(session)
-        Counter.incr(session, "updates")
+        GraphChange.record(session, users=[user.username])
     except IntegrityError:
         session.rollback()
         raise DuplicateKey()
@@ -140,7 +141,7 @@ def delete_public_key(session, user_id, key_id):
 
     pkey.delete(session)
 
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[pkey.user.username])
 
     session.commit()
 
@@ -174,7 +175,7 @@ def add_tag_to_public_key(session, public_key, tag):
     mapping = PublicKeyTagMap(tag_id=tag.id, key_id=public_key.id)
     try:
         mapping.add(session)
-        Counter.incr(session, "updates")
+        GraphChange.record(session, users=[public_key.user.username])
         session.commit()
     except IntegrityError:
         session.rollback()
@@ -199,7 +200,7 @@ def remove_tag_from_public_key(session, public_key, tag):
         raise TagNotOnKey()
 
     mapping.delete(session)
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[public_key.user.username])
     session.commit()
 
 
@@ -214,8 +215,11 @@ def get_all_public_key_tags(session):
         A dictionary that has all PublicKeyTags assigned to any public key
     """
     ret = defaultdict(list)  # type: Dict[int, List[PublicKeyTag]]
-    for mapping in session.query(PublicKeyTagMap).all():
-        ret[mapping.key.id].append(mapping.tag)
+    mappings = session.query(PublicKeyTagMap.key_id, PublicKeyTag).filter(
+        PublicKeyTag.id == PublicKeyTagMap.tag_id,
+    ).yield_per(BULK_QUERY_BATCH_SIZE)
+    for key_id, tag in mappings:
+        ret[key_id].append(tag)
     return ret
 
 
@@ -15,9 +15,10 @@ from typing import TYPE_CHECKING
 
 from sqlalchemy.exc import IntegrityError
 
+from grouper.constants import BULK_QUERY_BATCH_SIZE
 from grouper.group_service_account import add_service_account
 from grouper.models.audit_log import AuditLog
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.permission import Permission
 from grouper.models.service_account import ServiceAccount
 from grouper.models.service_account_permission_map import ServiceAccountPermissionMap
@@ -27,7 +28,7 @@ from grouper.plugin.exceptions import PluginRejectedMachineSet
 from grouper.user import disable_user, enable_user
 
 if TYPE_CHECKING:
-    from typing import Dict, List, Union  # noqa: F401
+    from typing import Dict, Iterable, List, Optional, Union  # noqa: F401
     from grouper.models.base.session import Session  # noqa: F401
     from grouper.models.group import Group  # noqa: F401
 
@@ -109,7 +110,7 @@ def edit_service_account(session, actor, service_account, description, machine_s
 
     service_account.description = description
     service_account.machine_set = machine_set
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[service_account.user.username])
 
     session.commit()
 
@@ -145,6 +146,7 @@ def disable_service_account(session, actor, service_account):
     """Disables a service account and deletes the association with a Group."""
     disable_user(session, service_account.user)
     owner_id = service_account.owner.group.id
+    owner_name = service_account.owner.group.groupname
     service_account.owner.delete(session)
     permissions = session.query(ServiceAccountPermissionMap).filter_by(
         service_account_id=service_account.id)
@@ -154,7 +156,7 @@ def disable_service_account(session, actor, service_account):
     AuditLog.log(session, actor.id, "disable_service_account", "Disabled service account.",
                  on_group_id=owner_id, on_user_id=service_account.user_id)
 
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[service_account.user.username], groups=[owner_name])
     session.commit()
 
 
@@ -167,7 +169,7 @@ def enable_service_account(session, actor, service_account, owner):
     AuditLog.log(session, actor.id, "enable_service_account", "Enabled service account.",
                  on_group_id=owner.id, on_user_id=service_account.user_id)
 
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[service_account.user.username], groups=[owner.groupname])
     session.commit()
 
 
@@ -192,21 +194,35 @@ def service_account_permissions(session, service_account):
     return out
 
 
-def all_service_account_permissions(session):
-    # type: (Session) -> Dict[str, List[ServiceAccountPermission]]
-    """Return a dict of service account names to their permissions."""
+def all_service_account_permissions(session, usernames=None):
+    # type: (Session, Optional[Iterable[str]]) -> Dict[str, List[ServiceAccountPermission]]
+    """Return a dict of service account names to their permissions.
+
+    If usernames is given, only the permissions of those service accounts are returned.
+    """
     out = defaultdict(list)  # type: Dict[str, List[ServiceAccountPermission]]
-    permissions = session.query(Permission, ServiceAccountPermissionMap).filter(
+    permissions = session.query(
+        User.username,
+        Permission.name,
+        ServiceAccountPermissionMap.argument,
+        ServiceAccountPermissionMap.granted_on,
+        ServiceAccountPermissionMap.id,
+    ).filter(
         Permission.id == ServiceAccountPermissionMap.permission_id,
         ServiceAccountPermissionMap.service_account_id == ServiceAccount.id,
         ServiceAccount.user_id == User.id,
         User.enabled == True,
     )
-    for permission in permissions:
-        out[permission[1].service_account.user.username].append(ServiceAccountPermission(
-            permission=permission[0].name,
-            argument=permission[1].argument,
-            granted_on=permission[1].granted_on,
-            mapping_id=permission[1].id,
+    if usernames is not None:
+        if not usernames:
+            return out
+        permissions = permissions.filter(User.username.in_(usernames))
+    for username, name, argument, granted_on, mapping_id in permissions.yield_per(
+            BULK_QUERY_BATCH_SIZE):
+        out[username].append(ServiceAccountPermission(
+            permission=name,
+            argument=argument,
+            granted_on=granted_on,
+            mapping_id=mapping_id,
         ))
     return out
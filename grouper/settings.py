@@ -94,6 +94,10 @@ settings = Settings({
     "auditors_group": None,
     "database": None,
     "database_source": None,
+    "db_pool_max_overflow": 10,
+    "db_pool_pre_ping": False,
+    "db_pool_size": 5,
+    "db_pool_timeout": 30,
     "expiration_notice_days": 7,
     "nonauditor_expiration_days": 5,
     "from_addr": "no-reply@grouper.local",
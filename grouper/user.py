@@ -7,7 +7,7 @@ from sqlalchemy.sql import label, literal
 from grouper.models.audit import Audit
 from grouper.models.audit_log import AuditLog
 from grouper.models.comment import Comment
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 from grouper.models.group import Group
 from grouper.models.group_edge import (APPROVER_ROLE_INDICES, GROUP_EDGE_ROLES, GroupEdge,
     OWNER_ROLE_INDICES)
@@ -102,7 +102,7 @@ def enable_user(session, user, requester, preserve_membership):
                 )
 
     user.enabled = True
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[user.username])
 
 
 def disable_user(session, user):
@@ -111,7 +111,7 @@ def disable_user(session, user):
     get_plugin_proxy().will_disable_user(session, user)
 
     user.enabled = False
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[user.username])
 
 
 def user_role_index(user, members):
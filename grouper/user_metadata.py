@@ -1,7 +1,8 @@
 import re
 
 from grouper.constants import PERMISSION_VALIDATION
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
+from grouper.models.user import User
 from grouper.models.user_metadata import UserMetadata
 
 
@@ -63,7 +64,7 @@ def set_user_metadata(session, user_id, data_key, data_value):
             user_md = UserMetadata(user_id=user_id, data_key=data_key, data_value=data_value)
             user_md.add(session)
 
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[User.get(session, pk=user_id).username])
     session.commit()
 
     return user_md
@@ -2,12 +2,12 @@ from typing import TYPE_CHECKING
 
 from sqlalchemy.exc import IntegrityError
 
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
+from grouper.models.user import User
 from grouper.models.user_password import UserPassword
 
 if TYPE_CHECKING:
     from typing import List  # noqa
-    from grouper.models.user import User  # noqa
     from grouper.models.base.session import Session  # noqa
 
 
@@ -31,7 +31,7 @@ def add_new_user_password(session, password_name, password, user_id):
     """
     p = UserPassword(name=password_name, user_id=user_id)
     p.set_password(password)
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[User.get(session, pk=user_id).username])
     p.add(session)
     try:
         session.commit()
@@ -52,7 +52,7 @@ def delete_user_password(session, password_name, user_id):
     if not p:
         raise PasswordDoesNotExist()
     p.delete(session)
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[User.get(session, pk=user_id).username])
     session.commit()
 
 
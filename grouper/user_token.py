@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
 
 
 def add_new_user_token(session, user_token):
@@ -19,7 +19,7 @@ def add_new_user_token(session, user_token):
         secret = user_token._set_secret()
 
     user_token.add(session)
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[user_token.user.username])
 
     return user_token, secret
 
@@ -32,4 +32,4 @@ def disable_user_token(session, user_token):
         user_token(grouper.models.user_token.UserToken): token to disable
     """
     user_token.disabled_at = datetime.utcnow()
-    Counter.incr(session, "updates")
+    GraphChange.record(session, users=[user_token.user.username])
@@ -65,6 +65,16 @@ def get_database_url(settings, retries=3, retry_wait_seconds=1):
                 time.sleep(retry_wait_seconds)
 
 
+def get_db_pool_settings(settings):
+    """Given settings, returns the keyword arguments of get_db_engine for its connection pool."""
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_pool_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pre_ping": settings.db_pool_pre_ping,
+    }
+
+
 # TODO(lfaraone): Consider moving this to a LRU cache to avoid memory leaks
 _regex_cache = {}  # type: Dict[str, Pattern]
 
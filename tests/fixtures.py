@@ -1,5 +1,7 @@
 import pytest
 
+from grouper.api.checkpoint_waiter import CheckpointWaiter
+from grouper.api.response_cache import ResponseCache
 from grouper.api.routes import HANDLERS as API_HANDLERS
 from grouper.app import Application
 from grouper.constants import AUDIT_MANAGER, AUDIT_VIEWER, GROUP_ADMIN, PERMISSION_AUDITOR, USER_ADMIN
@@ -217,9 +219,13 @@ def permissions(session, users):
 def api_app(session, standard_graph):
     my_settings = {
             "graph": standard_graph,
-            "db_session": lambda: session,
+            "db_session": Session,
+            "response_cache": ResponseCache(1024 * 1024),
+            "checkpoint_waiter": CheckpointWaiter(standard_graph),
+            "max_checkpoint_wait": 5,
+            "token_graph_max_age": 60,
             }
-    return Application(API_HANDLERS, my_settings=my_settings)
+    return Application(API_HANDLERS, my_settings=my_settings, compress_response=True)
 
 
 @pytest.fixture
@@ -1,21 +1,30 @@
 import crypt
 import cStringIO as StringIO
 import csv
+import gzip
 import json
+import time
 from urllib import urlencode
 
 import pytest
+from tornado import gen
 
 from constants import SSH_KEY_1
 from fixtures import api_app as app  # noqa
 from fixtures import standard_graph, graph, users, groups, service_accounts, session, permissions  # noqa
+from grouper.api import handlers
+from grouper.api.encoding import columnize
+from grouper.api.response_cache import ResponseCache
 from grouper.constants import USER_METADATA_SHELL_KEY
+from grouper.graph_diff import ChangeHistory
+from grouper.models.base.session import Session
 from grouper.models.counter import Counter
 from grouper.models.permission import Permission
 from grouper.models.service_account import ServiceAccount
 from grouper.models.user_token import UserToken
 from grouper.permissions import grant_permission_to_service_account
 from grouper.public_key import add_public_key
+from grouper.user import disable_user
 from grouper.user_metadata import get_user_metadata_by_key, set_user_metadata
 from grouper.user_password import add_new_user_password, delete_user_password, user_passwords
 from grouper.user_token import add_new_user_token, disable_user_token
@@ -96,6 +105,266 @@ def test_multi_users(users, http_client, base_url):
     assert sorted(body["data"].iterkeys()) == []
 
 
+@pytest.mark.gen_test
+def test_multi_users_stream(mocker, users, http_client, base_url):
+    mocker.patch("grouper.api.handlers.STREAM_BATCH_SIZE", 2)
+
+    resp = yield http_client.fetch(url(base_url, "/multi/users"))
+    expected = json.loads(resp.body)
+
+    resp = yield http_client.fetch(url(base_url, "/multi/users?stream=yes"))
+    body = json.loads(resp.body)
+    assert resp.code == 200
+    assert resp.headers["Content-Type"].startswith("application/json")
+    assert body == expected
+
+    query_args = urlencode({"username": ["gary@a.co", "doesnotexist@a.co"], "stream": "yes"},
+                           doseq=True)
+    resp = yield http_client.fetch(url(base_url, "/multi/users?{}".format(query_args)))
+    body = json.loads(resp.body)
+    assert body["status"] == "ok"
+    assert body["data"] == {"gary@a.co": expected["data"]["gary@a.co"]}
+
+    query_args = urlencode({"username": "doesnotexist@a.co", "stream": "yes"})
+    resp = yield http_client.fetch(url(base_url, "/multi/users?{}".format(query_args)))
+    assert json.loads(resp.body)["data"] == {}
+
+
+@pytest.mark.gen_test
+def test_multi_groups_and_permissions(mocker, groups, permissions, http_client, base_url):
+    mocker.patch("grouper.api.handlers.STREAM_BATCH_SIZE", 2)
+
+    for endpoint, names, single in (("groups", groups, "/groups/{}"),
+                                    ("permissions", permissions, "/permissions/{}")):
+        resp = yield http_client.fetch(url(base_url, "/multi/{}".format(endpoint)))
+        body = json.loads(resp.body)
+        assert body["status"] == "ok"
+        assert sorted(body["data"]) == sorted(names)
+
+        resp = yield http_client.fetch(url(base_url, "/multi/{}?stream=yes".format(endpoint)))
+        assert json.loads(resp.body) == body
+
+        # The same data as the single endpoint, ignoring nonexistent names.
+        name = sorted(names)[0]
+        query_args = urlencode({"name": [name, "doesnotexist"]}, doseq=True)
+        resp = yield http_client.fetch(url(base_url, "/multi/{}?{}".format(endpoint, query_args)))
+        data = json.loads(resp.body)["data"]
+        resp = yield http_client.fetch(url(base_url, single.format(name)))
+        assert data == {name: json.loads(resp.body)["data"]}
+
+
+@pytest.mark.gen_test
+def test_fields(users, http_client, base_url):
+    resp = yield http_client.fetch(url(base_url, "/users/gary@a.co"))
+    expected = json.loads(resp.body)["data"]
+
+    resp = yield http_client.fetch(url(base_url, "/users/gary@a.co?fields=permissions,public_keys"))
+    data = json.loads(resp.body)["data"]
+    assert sorted(data) == ["permissions", "user"]
+    assert "passwords" not in data["user"]
+    assert data["user"]["public_keys"] == expected["user"]["public_keys"]
+    assert all("path" not in permission for permission in data["permissions"])
+
+    resp = yield http_client.fetch(url(base_url, "/multi/users?username=gary@a.co&fields=groups"))
+    assert sorted(json.loads(resp.body)["data"]["gary@a.co"]) == ["groups", "user"]
+
+    resp = yield http_client.fetch(url(base_url, "/groups/team-sre?fields=users,paths"))
+    data = json.loads(resp.body)["data"]
+    assert sorted(data) == ["group", "users"]
+
+    resp = yield http_client.fetch(
+        url(base_url, "/users/gary@a.co?fields=permissions,bogus"), raise_error=False)
+    assert resp.code == 400
+    assert json.loads(resp.body)["status"] == "error"
+
+
+@pytest.mark.gen_test
+def test_etag(mocker, session, standard_graph, users, http_client, base_url):
+    api_url = url(base_url, "/users/gary@a.co")
+    resp = yield http_client.fetch(api_url)
+    body = json.loads(resp.body)
+    etag = resp.headers["Etag"]
+    assert etag == '"{}-{}"'.format(body["checkpoint"], body["checkpoint_time"])
+
+    # The same checkpoint is not modified, for this URL or any other.
+    resp = yield http_client.fetch(api_url, headers={"If-None-Match": etag}, raise_error=False)
+    assert resp.code == 304
+    resp = yield http_client.fetch(
+        url(base_url, "/groups"), headers={"If-None-Match": etag}, raise_error=False)
+    assert resp.code == 304
+
+    # Repeated requests are served from the response cache until the graph changes.
+    get_individual_user_info = mocker.patch(
+        "grouper.api.handlers.get_individual_user_info",
+        side_effect=handlers.get_individual_user_info)
+    resp = yield http_client.fetch(api_url)
+    assert json.loads(resp.body) == body
+    assert resp.headers["Content-Type"] == "application/json; charset=UTF-8"
+    assert not get_individual_user_info.called
+
+    Counter.incr(session, "updates")
+    session.commit()
+    standard_graph.update_from_db(session)
+    resp = yield http_client.fetch(api_url, headers={"If-None-Match": etag})
+    assert resp.code == 200
+    assert resp.headers["Etag"] != etag
+    assert json.loads(resp.body)["checkpoint"] == body["checkpoint"] + 1
+    assert get_individual_user_info.called
+
+    # Missing resources are neither tagged nor cached.
+    resp = yield http_client.fetch(url(base_url, "/users/doesnotexist@a.co"), raise_error=False)
+    assert resp.code == 404
+    assert "Etag" not in resp.headers
+
+
+@pytest.mark.gen_test
+def test_encodings(mocker, app, standard_graph, users, http_client, base_url):  # noqa
+    api_url = url(base_url, "/multi/users?username=gary@a.co")
+    resp = yield http_client.fetch(api_url)
+    expected = json.loads(resp.body)
+
+    # Gzipped for clients that accept it, the same when served again from the cache.
+    for _ in range(2):
+        resp = yield http_client.fetch(
+            api_url, headers={"Accept-Encoding": "gzip"}, decompress_response=False)
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.GzipFile(fileobj=StringIO.StringIO(resp.body)).read()) == expected
+    resp = yield http_client.fetch(api_url, decompress_response=False)
+    assert "Content-Encoding" not in resp.headers
+    assert json.loads(resp.body) == expected
+
+    # Responses that won't be cached are left for tornado to compress.
+    gzip_encode = mocker.spy(handlers, "gzip_encode")
+    app.my_settings["response_cache"].max_bytes = 0
+    resp = yield http_client.fetch(
+        api_url, headers={"Accept-Encoding": "gzip"}, decompress_response=False)
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.GzipFile(fileobj=StringIO.StringIO(resp.body)).read()) == expected
+    assert not gzip_encode.called
+
+    # The compact format turns lists of records into tables, streamed or not.
+    permissions = expected["data"]["gary@a.co"]["permissions"]
+    columns = sorted(permissions[0])
+    for stream in ("no", "yes"):
+        resp = yield http_client.fetch(api_url + "&format=compact&stream=" + stream)
+        body = json.loads(resp.body)
+        table = body["data"]["gary@a.co"]["permissions"]
+        assert table["columns"] == columns
+        assert table["rows"] == [[p[column] for column in columns] for p in permissions]
+
+
+def test_columnize():
+    assert columnize({"a": [{"x": 1, "y": [2]}, {"y": [3], "x": 4}]}) == {
+        "a": {"columns": ["x", "y"], "rows": [[1, [2]], [4, [3]]]}}
+    assert columnize([]) == []
+    assert columnize([{"x": 1}, {"y": 2}]) == [{"x": 1}, {"y": 2}]
+    assert columnize([{"x": 1}, 2]) == [{"x": 1}, 2]
+
+
+@pytest.mark.gen_test
+def test_min_checkpoint(session, standard_graph, users, http_client, base_url):
+    checkpoint = standard_graph.checkpoint
+
+    # Already reached, so answered at once.
+    resp = yield http_client.fetch(url(base_url, "/users/gary@a.co?min_checkpoint={}".format(
+        checkpoint)))
+    assert json.loads(resp.body)["checkpoint"] == checkpoint
+
+    # Waits for the graph to be refreshed.
+    start = time.time()
+    pending = http_client.fetch(url(base_url, "/users/gary@a.co?min_checkpoint={}".format(
+        checkpoint + 1)))
+    yield gen.sleep(0.2)
+    assert not pending.done()
+    Counter.incr(session, "updates")
+    session.commit()
+    standard_graph.update_from_db(session)
+    resp = yield pending
+    assert json.loads(resp.body)["checkpoint"] == checkpoint + 1
+    assert time.time() - start < 4
+
+    # Gives up after the requested wait, with the graph as it is.
+    start = time.time()
+    resp = yield http_client.fetch(url(base_url, "/groups?min_checkpoint={}&wait=0.3".format(
+        checkpoint + 10)))
+    assert json.loads(resp.body)["checkpoint"] == checkpoint + 1
+    assert 0.3 <= time.time() - start < 4
+
+    # A negative wait doesn't wait at all.
+    start = time.time()
+    resp = yield http_client.fetch(url(base_url, "/groups?min_checkpoint={}&wait=-1".format(
+        checkpoint + 10)))
+    assert json.loads(resp.body)["checkpoint"] == checkpoint + 1
+    assert time.time() - start < 0.3
+
+    # Arguments that aren't numbers are rejected.
+    for query in ("min_checkpoint=abc", "min_checkpoint=1&wait=abc", "wait=nan"):
+        resp = yield http_client.fetch(
+            url(base_url, "/groups?{}".format(query)), raise_error=False)
+        assert resp.code == 400
+        assert json.loads(resp.body)["status"] == "error"
+
+
+@pytest.mark.gen_test
+def test_changes(session, standard_graph, http_client, base_url, monkeypatch):  # noqa
+    monkeypatch.setattr(standard_graph, "change_history", ChangeHistory(max_entries=10))
+    checkpoint = standard_graph.checkpoint
+
+    resp = yield http_client.fetch(url(base_url, "/changes?since={}".format(checkpoint)))
+    body = json.loads(resp.body)
+    assert body["data"] == {"since": checkpoint, "users": [], "groups": [], "permissions": [],
+                            "service_accounts": []}
+
+    service_account = ServiceAccount.get(session, name="service@a.co")
+    permission = Permission.get(session, name="team-sre")
+    grant_permission_to_service_account(session, service_account, permission, "*")
+    standard_graph.update_from_db(session)
+
+    resp = yield http_client.fetch(url(base_url, "/changes?since={}".format(checkpoint)))
+    body = json.loads(resp.body)
+    assert body["checkpoint"] > checkpoint
+    assert body["data"]["users"] == []
+    assert body["data"]["groups"] == []
+    assert body["data"]["permissions"] == ["team-sre"]
+    assert body["data"]["service_accounts"] == ["service@a.co"]
+
+    # Clients that fell behind the history have to start over.
+    resp = yield http_client.fetch(
+        url(base_url, "/changes?since={}".format(checkpoint - 1)), raise_error=False)
+    assert resp.code == 410
+    assert json.loads(resp.body)["status"] == "error"
+
+    resp = yield http_client.fetch(url(base_url, "/changes?since=abc"), raise_error=False)
+    assert resp.code == 400
+    assert json.loads(resp.body)["status"] == "error"
+
+
+def test_response_cache():
+    cache = ResponseCache(max_bytes=10)
+    cache.put(5, "/a", "aaaa")
+    cache.put(5, "/b", "bbbb")
+    assert cache.get(5, "/a") == "aaaa"
+    assert cache.get(4, "/a") is None
+
+    # Least recently used responses are evicted to stay under max_bytes.
+    cache.put(5, "/c", "cccc")
+    assert cache.get(5, "/b") is None
+    assert cache.get(5, "/a") == "aaaa"
+
+    # Responses for older checkpoints aren't stored, and a newer one drops everything.
+    cache.put(4, "/d", "dd")
+    assert cache.get(4, "/d") is None
+    cache.put(6, "/d", "dd")
+    assert len(cache) == 1
+    assert cache.get(6, "/d") == "dd"
+    assert cache.accepts(6, 10)
+    assert not cache.accepts(6, 11)
+    assert not cache.accepts(5, 1)
+
+    assert ResponseCache(max_bytes=0).get(6, "/d") is None
+    assert not ResponseCache(max_bytes=0).accepts(6, 1)
+
+
 @pytest.mark.gen_test
 def test_service_accounts(session, standard_graph, users, http_client, base_url):
     graph = standard_graph
@@ -137,6 +406,71 @@ def test_service_accounts(session, standard_graph, users, http_client, base_url)
     assert permissions[0]["argument"] == "*"
 
 
+@pytest.mark.gen_test
+def test_usertokens_stale_graph(mocker, app, users, session, standard_graph, http_client,
+                                base_url):
+    tok, secret = add_new_user_token(session, UserToken(user=users["zorkian@a.co"], name="Foo"))
+    session.commit()
+    standard_graph.update_from_db(session)
+
+    def validate():
+        return http_client.fetch(url(base_url, "/token/validate"), method="POST",
+                                 body=urlencode({"token": "{}:{}".format(tok, secret)}))
+
+    # Disabled, but the graph doesn't know yet and is recent enough to trust.
+    disable_user_token(session, tok)
+    session.commit()
+    resp = yield validate()
+    assert json.loads(resp.body)["status"] == "ok"
+
+    # Once the graph is older than token_graph_max_age, valid tokens are checked in the database.
+    standard_graph.refreshed_at -= 61
+    resp = yield validate()
+    assert json.loads(resp.body)["errors"][0]["code"] == 3
+
+    mocker.patch.dict(app.my_settings, {"token_graph_max_age": 0})
+    standard_graph.refreshed_at += 61
+    resp = yield validate()
+    assert json.loads(resp.body)["errors"][0]["code"] == 3
+
+
+@pytest.mark.gen_test
+def test_usertokens_from_graph(mocker, users, session, standard_graph, http_client, base_url):
+    tok, secret = add_new_user_token(session, UserToken(user=users["zorkian@a.co"], name="Foo"))
+    other, other_secret = add_new_user_token(
+        session, UserToken(user=users["oliver@a.co"], name="Bar"))
+    session.commit()
+    standard_graph.update_from_db(session)
+
+    get_by_value = mocker.patch.object(UserToken, "get_by_value", return_value=None)
+
+    def validate(*tokens):
+        return http_client.fetch(url(base_url, "/multi/token/validate"), method="POST",
+                                 body=urlencode({"token": tokens}, doseq=True))
+
+    valid_token = "{}:{}".format(tok, secret)
+    resp = yield validate(valid_token, "{}:{}".format(other, secret), "invalid")
+    results = json.loads(resp.body)["data"]["tokens"]
+    assert results[0] == {"owner": "zorkian@a.co", "identity": "zorkian@a.co/Foo",
+                          "act_as_owner": True, "valid": True}
+    assert results[1] == {"valid": False, "error": {"code": 4, "message": "Token secret mismatch"}}
+    assert results[2]["error"]["code"] == 1
+    assert not get_by_value.called
+
+    # Disabling the token, or its user, takes effect when the graph is refreshed.
+    disable_user_token(session, other)
+    disable_user(session, users["zorkian@a.co"])
+    session.commit()
+    standard_graph.update_from_db(session)
+    resp = yield validate(valid_token, "{}:{}".format(other, other_secret))
+    assert [result["error"]["code"] for result in json.loads(resp.body)["data"]["tokens"]] == [3, 3]
+
+    # Tokens missing from the graph are looked up in the database.
+    resp = yield validate("zorkian@a.co/Missing:" + secret)
+    assert json.loads(resp.body)["data"]["tokens"][0]["error"]["code"] == 2
+    assert get_by_value.called
+
+
 @pytest.mark.gen_test
 def test_usertokens(users, session, http_client, base_url):
     user = users["zorkian@a.co"]
@@ -350,3 +684,21 @@ def test_public_keys(session, users, http_client, base_url):
     assert rows[0]['fingerprint'] == 'e9:ae:c5:8f:39:9b:3a:9c:6a:b8:33:6b:cb:6f:ba:35'
     assert rows[0]['fingerprint_sha256'] == 'MP9uWaujW96EWxbjDtPdPWheoMDu6BZ8FZj0+CBkVWU'
     assert rows[0]['comment'] == 'some-comment'
+
+
+@pytest.mark.gen_test
+def test_lazy_session(mocker, app, session, users, http_client, base_url):
+    add_public_key(session, users["cbguder@a.co"], SSH_KEY_1)
+    db_session = mocker.Mock(wraps=app.my_settings["db_session"])
+    mocker.patch.dict(app.my_settings, {"db_session": db_session})
+
+    # Requests answered from the graph never open a session.
+    yield http_client.fetch(url(base_url, "/users/cbguder@a.co"))
+    assert not db_session.called
+
+    # Those that use the database open one, which is closed when the request finishes.
+    closed = mocker.spy(Session.class_, "close")
+    resp = yield http_client.fetch(url(base_url, "/public-keys"))
+    assert "cbguder@a.co" in resp.body
+    assert db_session.call_count == 1
+    assert closed.call_count == 1
@@ -9,8 +9,8 @@ from tornado.httpclient import HTTPError
 from fixtures import standard_graph, graph, users, groups, service_accounts, session, permissions  # noqa
 from fixtures import fe_app as app  # noqa
 from grouper.audit import (
-    assert_can_join, assert_controllers_are_auditors, get_audits, user_is_auditor,
-    UserNotAuditor,
+    assert_can_join, assert_controllers_are_auditors, get_auditor_violations, get_audits,
+    user_is_auditor, UserNotAuditor,
 )
 from url_util import url
 from util import add_member, grant_permission
@@ -77,6 +77,30 @@ def test_assert_controllers_are_auditors(groups):  # noqa
         assert not assert_controllers_are_auditors(groups["team-infra"])
 
 
+def test_get_auditor_violations(standard_graph, groups):  # noqa
+    """ Test that every non-auditor controller in a subtree is reported at once. """
+
+    assert get_auditor_violations(groups["sad-team"]) == []
+
+    violations = [(v.username, v.rolename, v.groupname)
+                  for v in get_auditor_violations(groups["tech-ops"])]
+    assert violations == [
+        ("figurehead@a.co", "np-owner", "tech-ops"),
+        ("zay@a.co", "owner", "tech-ops"),
+    ]
+
+    # A user controlling several groups in the subtree is reported for each of them.
+    violations = [(v.username, v.groupname) for v in get_auditor_violations(groups["team-infra"])]
+    assert ("gary@a.co", "team-infra") in violations
+    assert ("gary@a.co", "team-sre") in violations
+    assert ("oliver@a.co", "security-team") in violations
+
+    with pytest.raises(UserNotAuditor) as e:
+        assert_controllers_are_auditors(groups["team-infra"])
+    assert len(e.value.violations) == len(violations)
+    assert "zay@a.co" in str(e.value) and "oliver@a.co" in str(e.value)
+
+
 @pytest.mark.gen_test
 def test_toggle_perm_audited(groups, permissions, http_client, base_url):
     perm_name = 'audited' # perm that is already audited
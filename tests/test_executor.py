@@ -0,0 +1,63 @@
+from threading import Event
+
+import pytest
+from tornado.web import HTTPError
+
+from grouper.app import Application
+from grouper.executor import BoundedExecutor, ExecutorFull
+
+
+def fail():
+    raise ValueError("failed")
+
+
+@pytest.mark.gen_test
+def test_bounded_executor(mocker):
+    stats = mocker.patch("grouper.executor.stats")
+    executor = BoundedExecutor(1, max_queue=1)
+
+    result = yield executor.submit(lambda x, y: x + y, 1, y=2)
+    assert result == 3
+    with pytest.raises(ValueError):
+        yield executor.submit(fail)
+    stats.log_rate.assert_any_call("db_executor_wait_ms", mocker.ANY)
+    stats.log_rate.assert_any_call("db_executor_run_ms", mocker.ANY)
+
+    # With the only thread busy, one job may wait and the next is turned away.
+    started, release = Event(), Event()
+
+    def block():
+        started.set()
+        release.wait()
+        return "blocked"
+
+    blocked = executor.submit(block)
+    started.wait()
+    waiting = executor.submit(lambda: "waited")
+    stats.log_gauge.assert_called_with("db_executor_queue_depth", 1)
+    with pytest.raises(ExecutorFull):
+        executor.submit(lambda: "rejected")
+
+    release.set()
+    assert (yield blocked) == "blocked"
+    assert (yield waiting) == "waited"
+    assert executor.queued == 0
+
+
+@pytest.mark.gen_test
+def test_application_run_in_executor():
+    # Without an executor, the work is done right away.
+    application = Application([])
+    future = application.run_in_executor(lambda: "done")
+    assert future.done()
+    assert (yield future) == "done"
+    with pytest.raises(ValueError):
+        yield application.run_in_executor(fail)
+
+    application = Application([], executor=BoundedExecutor(1, max_queue=1))
+    assert (yield application.run_in_executor(lambda: "done")) == "done"
+
+    application.executor.queued = 1
+    with pytest.raises(HTTPError) as e:
+        application.run_in_executor(lambda: "rejected")
+    assert e.value.status_code == 503
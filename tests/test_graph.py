@@ -0,0 +1,707 @@
+from cStringIO import StringIO
+import ctypes
+from datetime import datetime, timedelta
+import os
+import random
+import subprocess
+import sys
+import time
+
+import pytest
+from sqlalchemy import event
+
+from constants import SSH_KEY_1, SSH_KEY_2
+from fixtures import standard_graph, graph, users, groups, service_accounts, session, permissions  # noqa
+from grouper import stats
+from grouper.background.background_processor import BackgroundProcessor
+from grouper.database import DbRefreshThread, SnapshotRefreshThread
+from grouper.fe.settings import settings
+from grouper.graph import (
+    GraphSnapshot,
+    GroupGraph,
+    InvalidGraphSnapshot,
+    NoSuchGroup,
+    NoSuchUser,
+    SNAPSHOT_MAGIC,
+)
+from grouper.graph_builder import GraphBuilder
+from grouper.graph_cache import DetailsCache
+from grouper.graph_diff import ChangeHistory
+from grouper.graph_engine import CompactEngine, GRAPH_ENGINES
+from grouper.models.base.session import Session
+from grouper.models.counter import Counter
+from grouper.models.graph_change import GraphChange
+from grouper.models.group import Group
+from grouper.models.group_edge import GroupEdge
+from grouper.models.permission import Permission
+from grouper.models.public_key_tag import PublicKeyTag
+from grouper.models.user import User
+from grouper.models.user_token import UserToken
+from grouper.permissions import grant_permission_to_service_account
+from grouper.public_key import add_public_key, add_tag_to_public_key
+from grouper.service_account import create_service_account
+from grouper.user import disable_user
+from grouper.user_token import add_new_user_token
+from util import add_member, get_groups, grant_permission, revoke_member
+
+
+def graph_contents(graph):
+    """Everything a GroupGraph serves, in a form that can be compared."""
+    return {
+        "users": graph.users,
+        "groups": graph.groups,
+        "permissions": graph.permissions,
+        "user_metadata": graph.user_metadata,
+        "group_metadata": graph.group_metadata,
+        "group_service_accounts": dict(graph.group_service_accounts),
+        "group_tuples": graph.group_tuples,
+        "disabled_group_tuples": graph.disabled_group_tuples,
+        "user_tokens": graph.user_tokens,
+        "user_details": {
+            name: graph.get_user_details(name) for name in graph.user_metadata
+        },
+        "group_details": {
+            name: graph.get_group_details(name) for name in graph.groups
+        },
+    }
+
+
+def assert_matches_full_rebuild(session, graph):
+    fresh = GroupGraph()
+    fresh.update_from_db(session)
+    assert graph.checkpoint == fresh.checkpoint
+    assert graph_contents(graph) == graph_contents(fresh)
+
+
+def test_incremental_refresh(session, standard_graph, users, groups, permissions, mocker):  # noqa
+    graph = GroupGraph()
+    graph.update_from_db(session)
+    load_changes = mocker.spy(graph, "_load_changes_from_db")
+
+    add_member(groups["sad-team"], groups["tech-ops"])
+    revoke_member(groups["team-sre"], users["zay@a.co"])
+    grant_permission(groups["tech-ops"], permissions["sudo"], argument="everything")
+    add_public_key(session, users["oliver@a.co"], SSH_KEY_1)
+    add_new_user_token(session, UserToken(user=users["oliver@a.co"], name="Foo"))
+    disable_user(session, users["figurehead@a.co"])
+    groups["audited-team"].disable()
+    session.commit()
+
+    graph.update_from_db(session, incremental=True)
+    assert load_changes.call_count == 1
+    assert_matches_full_rebuild(session, graph)
+
+    old_name = groups["team-sre"].groupname
+    groups["team-sre"].groupname = "team-sre-renamed"
+    GraphChange.record(session, groups=[old_name, "team-sre-renamed"])
+    session.commit()
+
+    graph.update_from_db(session, incremental=True)
+    assert load_changes.call_count == 2
+    assert "team-sre" not in graph.groups
+    assert graph.user_metadata["service@a.co"]["service_account"]["owner"] == "team-sre-renamed"
+    assert_matches_full_rebuild(session, graph)
+
+
+def test_incremental_refresh_expired_edge(session, standard_graph, users, groups, mocker):  # noqa
+    add_member(groups["tech-ops"], users["oliver@a.co"],
+               expiration=datetime.utcnow() + timedelta(days=1))
+    session.commit()
+    graph = GroupGraph()
+    graph.update_from_db(session)
+    assert "tech-ops" in get_groups(graph, "oliver@a.co")
+
+    # The membership runs out, and the background processor notices.
+    edge = session.query(GroupEdge).filter_by(
+        group_id=groups["tech-ops"].id, member_pk=users["oliver@a.co"].id).one()
+    edge.expiration = datetime.utcnow() - timedelta(seconds=1)
+    session.commit()
+    BackgroundProcessor(settings, None).expire_edges(session)
+
+    load_changes = mocker.spy(graph, "_load_changes_from_db")
+    graph.update_from_db(session, incremental=True)
+    assert load_changes.call_count == 1
+    assert "tech-ops" not in get_groups(graph, "oliver@a.co")
+    assert_matches_full_rebuild(session, graph)
+
+
+def test_incremental_refresh_new_permission(session, standard_graph, mocker):  # noqa
+    graph = GroupGraph()
+    graph.update_from_db(session)
+
+    Permission(name="new.permission", description="").add(session)
+    GraphChange.record(session, permissions=["new.permission"])
+    session.commit()
+
+    load_changes = mocker.spy(graph, "_load_changes_from_db")
+    graph.update_from_db(session, incremental=True)
+    assert load_changes.call_count == 1
+    assert "new.permission" in [permission.name for permission in graph.get_permissions()]
+
+
+def test_group_metadata(session, standard_graph):  # noqa
+    graph = GroupGraph()
+    graph.update_from_db(session)
+    permissions = graph.group_metadata["team-sre"]["permissions"]
+    assert sorted(permissions) == sorted([
+        {"permission": "ssh", "argument": "*"},
+        {"permission": "team-sre", "argument": "*"},
+    ])
+
+
+def test_incremental_refresh_gap(session, standard_graph, users, groups, mocker):  # noqa
+    graph = GroupGraph()
+    graph.update_from_db(session)
+
+    # A bump that doesn't record its changes leaves a gap in the change log.
+    groups["tech-ops"].description = "changed without logging"
+    add_member(groups["sad-team"], users["zebu@a.co"])
+    Counter.incr(session, "updates")
+    session.commit()
+
+    load_changes = mocker.spy(graph, "_load_changes_from_db")
+    graph.update_from_db(session, incremental=True)
+    assert load_changes.call_count == 0
+    assert graph.group_tuples["tech-ops"].description == "changed without logging"
+    assert_matches_full_rebuild(session, graph)
+
+
+def test_change_history(session, standard_graph, users, groups):  # noqa
+    graph = GroupGraph()
+    graph.change_history = ChangeHistory(max_entries=2)
+    graph.update_from_db(session)
+    first = graph.checkpoint
+
+    add_member(groups["sad-team"], users["zebu@a.co"])
+    Counter.incr(session, "updates")
+    session.commit()
+    graph.update_from_db(session)
+    second = graph.checkpoint
+
+    diff = graph.change_history.since(first)
+    assert diff.users == {"zebu@a.co"}
+    assert diff.groups == {"sad-team"}
+    assert diff.permissions == {"owner"}
+    assert diff.service_accounts == set()
+
+    # Everything above and below a changed group changes with it.
+    add_member(groups["team-infra"], users["zebu@a.co"])
+    Counter.incr(session, "updates")
+    session.commit()
+    graph.update_from_db(session)
+
+    diff = graph.change_history.since(second)
+    assert diff.users == {"zebu@a.co"}
+    assert diff.groups == {"team-infra", "all-teams", "serving-team", "security-team",
+                           "team-sre", "tech-ops"}
+    assert diff.permissions == {"sudo", "ssh", "team-sre", "audited"}
+    assert diff.service_accounts == set()
+    assert graph.change_history.since(first).groups == diff.groups | {"sad-team"}
+    assert graph.change_history.since(graph.checkpoint) == (
+        graph.checkpoint, graph.checkpoint, set(), set(), set(), set())
+
+    # Only max_entries publishes are remembered.
+    Counter.incr(session, "updates")
+    session.commit()
+    graph.update_from_db(session)
+    assert graph.change_history.since(first) is None
+    assert graph.change_history.since(second).users == {"zebu@a.co"}
+
+
+def test_user_details_from_closure(standard_graph, mocker):  # noqa
+    graph = standard_graph
+
+    # User details are read from the precomputed closures without walking the graph.
+    for engine in GRAPH_ENGINES.values():
+        mocker.patch.object(engine, "reverse_shortest_paths", side_effect=AssertionError)
+
+    details = graph.get_user_details("figurehead@a.co")
+    assert set(details["groups"]) == {"tech-ops", "security-team", "team-infra", "all-teams"}
+    assert details["groups"]["tech-ops"]["rolename"] == "np-owner"
+    assert details["groups"]["all-teams"]["distance"] == 3
+    assert {p["permission"] for p in details["permissions"]} == {"sudo"}
+
+    details = graph.get_user_details("figurehead@a.co", cutoff=2)
+    assert set(details["groups"]) == {"tech-ops", "security-team", "team-infra"}
+    assert details["groups"]["team-infra"]["path"] == [
+        "figurehead@a.co", "security-team", "team-infra"]
+    assert details["permissions"][0]["path"] == details["groups"]["team-infra"]["path"]
+
+
+def test_compact_engine(session, standard_graph, users, groups):  # noqa
+    def without_paths(data):
+        if isinstance(data, dict):
+            return {k: without_paths(v) for k, v in data.iteritems() if k != "path"}
+        if isinstance(data, list):
+            return sorted(without_paths(v) for v in data)
+        return data
+
+    add_member(groups["sad-team"], groups["tech-ops"])
+    session.commit()
+
+    networkx_graph = GroupGraph()
+    networkx_graph.update_from_db(session)
+    compact_graph = GroupGraph()
+    compact_graph.engine = CompactEngine
+    compact_graph.update_from_db(session)
+
+    assert sorted(compact_graph.nodes) == sorted(networkx_graph.nodes)
+    assert sorted(compact_graph.edges) == sorted(networkx_graph.edges)
+
+    # Paths may differ where there are several shortest ones, but nothing else should.
+    networkx_contents = graph_contents(networkx_graph)
+    compact_contents = graph_contents(compact_graph)
+    for key in networkx_contents:
+        assert without_paths(compact_contents[key]) == without_paths(networkx_contents[key])
+    assert (without_paths(compact_graph.get_group_details("team-infra", cutoff=1)) ==
+            without_paths(networkx_graph.get_group_details("team-infra", cutoff=1)))
+    assert (without_paths(compact_graph.get_permission_details("ssh")) ==
+            without_paths(networkx_graph.get_permission_details("ssh")))
+    assert compact_graph.get_groups(audited=True) == networkx_graph.get_groups(audited=True)
+
+    # Incremental refreshes work the same way on either engine.
+    revoke_member(groups["team-sre"], users["zay@a.co"])
+    session.commit()
+    compact_graph.update_from_db(session, incremental=True)
+    networkx_graph.update_from_db(session)
+    assert (without_paths(graph_contents(compact_graph)) ==
+            without_paths(graph_contents(networkx_graph)))
+
+
+def test_lock_wait_metrics(session, standard_graph, users, groups, mocker):  # noqa
+    log_rate = mocker.patch("grouper.graph.stats.log_rate")
+    graph = GroupGraph()
+    graph.update_from_db(session)
+    graph.get_user_details("zebu@a.co")
+
+    # Readers and the swap no longer take GroupGraph.lock; only refreshers still serialize.
+    stat_names = set(call[0][0] for call in log_rate.call_args_list)
+    assert "graph_update_lock_wait_ms" in stat_names
+    assert "graph_lock_wait_ms" not in stat_names
+    assert "graph_lock_updater_wait_ms" not in stat_names
+
+
+@pytest.mark.parametrize("engine", sorted(GRAPH_ENGINES))
+def test_user_closures(engine):
+    rng = random.Random(0)
+    groups = [("Group", "group-{}".format(i)) for i in range(60)]
+    users = [("User", "user-{}".format(i)) for i in range(100)]
+    edges = []
+    for i, group in enumerate(groups[3:], 3):
+        for parent in rng.sample(groups[:i], rng.randint(1, 3)):
+            edges.append((parent, group, 0))
+    for user in users:
+        for parent in rng.sample(groups, rng.randint(0, 6)):
+            edges.append((parent, user, rng.choice((0, 1, 2, 3))))
+    graph = GRAPH_ENGINES[engine](groups + users, edges)
+    edge_set = set(graph.edges())
+
+    closures = GroupGraph._get_user_closures(graph, {})
+    for user in users:
+        # The closure from walking up from each direct group separately and keeping the shortest.
+        distances = {}
+        for group, role in graph.parents(user):
+            if role == 3:  # np-owner
+                continue
+            for parent, path in graph.reverse_shortest_paths(group).iteritems():
+                distances[parent[1]] = min(distances.get(parent[1], len(path)), len(path))
+
+        closure = closures[user[1]]
+        assert {g.name: g.distance for g in closure.groups} == distances
+        for group in closure.groups:
+            path = [("User", group.path[0])] + [("Group", name) for name in group.path[1:]]
+            assert len(path) == group.distance + 1
+            assert all((parent, member) in edge_set for member, parent in zip(path, path[1:]))
+            assert group.role == graph.role(path[-1], path[-2])
+
+
+def test_user_details_many(standard_graph):  # noqa
+    graph = standard_graph
+    details = graph.get_user_details_many(["zay@a.co", "gary@a.co", "nonexistent@a.co"])
+    assert sorted(details) == ["gary@a.co", "zay@a.co"]
+    assert details["zay@a.co"] == graph.get_user_details("zay@a.co")
+
+
+def test_group_and_permission_details_many(session, standard_graph, mocker):  # noqa
+    graph = GroupGraph()
+    graph.update_from_db(session)
+
+    details = graph.get_group_details_many(["team-sre", "sad-team", "nonexistent"], cutoff=2)
+    assert sorted(details) == ["sad-team", "team-sre"]
+    assert details["team-sre"] == graph.get_group_details("team-sre", cutoff=2)
+
+    # team-sre is granted both permissions, but is only walked from once.
+    shortest_paths = mocker.spy(graph.snapshot.graph, "shortest_paths")
+    details = graph.get_permission_details_many(["ssh", "team-sre", "nonexistent"])
+    assert sorted(details) == ["ssh", "team-sre"]
+    assert shortest_paths.call_count == 2
+    assert sorted(details["ssh"]["groups"]) == ["team-sre", "tech-ops"]
+    for name in ("ssh", "team-sre"):
+        assert details[name] == graph.get_permission_details(name)
+
+
+def test_details_fields(session, standard_graph, mocker):  # noqa
+    graph = GroupGraph()
+    graph.update_from_db(session)
+    details = graph.get_user_details("gary@a.co")
+    group_details = graph.get_group_details("team-sre")
+
+    # Only what's asked for is filled in, and paths are left out unless asked for.
+    partial = graph.get_user_details("gary@a.co", fields=frozenset(["permissions"]))
+    assert partial.keys() == ["permissions"]
+    assert partial["permissions"] == [
+        {key: value for key, value in permission.iteritems() if key != "path"}
+        for permission in details["permissions"]]
+    partial = graph.get_user_details("gary@a.co", fields=frozenset(["groups", "paths"]))
+    assert partial == {"groups": details["groups"]}
+
+    # Groups are only walked in the directions needed.
+    shortest_paths = mocker.spy(graph.snapshot.graph, "shortest_paths")
+    reverse_shortest_paths = mocker.spy(graph.snapshot.graph, "reverse_shortest_paths")
+    partial = graph.get_group_details("team-sre", fields=frozenset(["users", "paths"]))
+    assert partial == {"users": group_details["users"]}
+    assert (shortest_paths.call_count, reverse_shortest_paths.call_count) == (1, 0)
+    partial = graph.get_group_details("team-sre", fields=frozenset(["permissions", "audited"]))
+    assert sorted(partial) == ["audited", "permissions"]
+    assert partial["audited"] == group_details["audited"]
+    assert len(partial["permissions"]) == len(group_details["permissions"])
+    assert (shortest_paths.call_count, reverse_shortest_paths.call_count) == (1, 1)
+
+
+def test_snapshot_swap(session, standard_graph, users, groups):  # noqa
+    graph = GroupGraph()
+    graph.update_from_db(session)
+    old_snapshot = graph.snapshot
+
+    add_member(groups["sad-team"], users["zebu@a.co"])
+    session.commit()
+    graph.update_from_db(session)
+
+    # Refreshing publishes a new snapshot and leaves the one readers may still hold untouched.
+    assert graph.snapshot is not old_snapshot
+    assert graph.checkpoint == old_snapshot.checkpoint + 1
+    assert "sad-team" not in old_snapshot.get_user_details("zebu@a.co")["groups"]
+    assert "sad-team" in graph.get_user_details("zebu@a.co")["groups"]
+    assert graph_contents(graph.snapshot) == graph_contents(graph)
+
+
+def test_parallel_loaders(session, standard_graph, users, groups, mocker):  # noqa
+    log_rate = mocker.spy(stats, "log_rate")
+    graph = GroupGraph()
+    graph.loader_threads = 4
+    graph.update_from_db(session)
+    assert_matches_full_rebuild(session, graph)
+
+    timed = {args[0] for args, _ in log_rate.call_args_list}
+    assert {"graph_loader_ms_edges", "graph_loader_ms_group_metadata"} <= timed
+
+    revoke_member(groups["team-sre"], users["zay@a.co"])
+    session.commit()
+    graph.update_from_db(session, incremental=True)
+    assert_matches_full_rebuild(session, graph)
+
+
+def test_snapshot_file(session, standard_graph, users, groups, tmpdir):  # noqa
+    path = str(tmpdir.join("graph.snapshot"))
+    for engine in GRAPH_ENGINES.values():
+        graph = GroupGraph()
+        graph.engine = engine
+        assert not graph.load_snapshot(path)
+
+        graph.update_from_db(session)
+        graph.write_snapshot(path)
+        assert GraphSnapshot.read_checkpoint(path) == graph.checkpoint
+
+        loaded = GroupGraph()
+        loaded.engine = engine
+        assert loaded.load_snapshot(path)
+        assert loaded.checkpoint == graph.checkpoint
+        assert graph_contents(loaded) == graph_contents(graph)
+
+        # A loaded graph catches up with the database from the snapshot's checkpoint.
+        revoke_member(groups["team-sre"], users["zay@a.co"])
+        session.commit()
+        loaded.update_from_db(session, incremental=True)
+        assert_matches_full_rebuild(session, loaded)
+
+        # Snapshots that aren't newer, or are damaged, are ignored.
+        assert not loaded.load_snapshot(path)
+        with open(path, "r+b") as snapshot_file:
+            snapshot_file.seek(len(SNAPSHOT_MAGIC) + 10)
+            snapshot_file.write("garbage")
+        assert not GroupGraph().load_snapshot(path)
+        loaded.snapshot.write(path)
+        with open(path, "r+b") as snapshot_file:
+            snapshot_file.truncate(os.path.getsize(path) / 2)
+        assert not GroupGraph().load_snapshot(path)
+        tmpdir.join("graph.snapshot").remove()
+
+
+def test_snapshot_file_arrays(session, standard_graph, users, groups, tmpdir):  # noqa
+    path = str(tmpdir.join("graph.snapshot"))
+    graph = GroupGraph()
+    graph.engine = CompactEngine
+    graph.update_from_db(session)
+    graph.write_snapshot(path)
+
+    # Loaded from the file, the compact engine's arrays are views of the mapped file.
+    loaded = GraphSnapshot.load(path)
+    _, arrays = loaded.graph.split_arrays()
+    assert all(isinstance(values, ctypes.Array) for values in arrays)
+    assert [list(values) for values in arrays] == [
+        list(values) for values in graph.snapshot.graph.split_arrays()[1]]
+    assert graph_contents(loaded) == graph_contents(graph.snapshot)
+
+    # They stay usable after the file is replaced, and are written out again as they were.
+    add_member(groups["sad-team"], users["zebu@a.co"])
+    session.commit()
+    graph.update_from_db(session)
+    graph.write_snapshot(path)
+    assert graph_contents(GraphSnapshot.load(path)) == graph_contents(graph.snapshot)
+    rewritten = StringIO()
+    loaded.dump(rewritten)
+    assert graph_contents(GraphSnapshot.load_from(StringIO(rewritten.getvalue()))) == (
+        graph_contents(loaded))
+
+
+def test_snapshot_file_permissions(session, standard_graph, tmpdir):  # noqa
+    path = str(tmpdir.join("graph.snapshot"))
+    standard_graph.write_snapshot(path)
+    assert os.stat(path).st_mode & 0o777 == 0o600
+
+    # Files others could have written are never unpickled.
+    os.chmod(path, 0o620)
+    assert not GroupGraph().load_snapshot(path)
+    with pytest.raises(InvalidGraphSnapshot):
+        GraphSnapshot.read_checkpoint(path)
+    os.chmod(path, 0o600)
+    assert GroupGraph().load_snapshot(path)
+
+    if os.getuid() == 0:
+        os.chown(path, 1, -1)
+        assert not GroupGraph().load_snapshot(path)
+
+
+def test_snapshot_refresh_thread(session, standard_graph, tmpdir, mocker):  # noqa
+    path = str(tmpdir.join("graph.snapshot"))
+    settings = mocker.Mock(graph_snapshot_path=path)
+    mocker.patch("grouper.database.sleep", side_effect=StopIteration)
+    follower = GroupGraph()
+
+    # Until the refreshing process writes a snapshot, followers keep what they have.
+    with pytest.raises(StopIteration):
+        SnapshotRefreshThread(settings, follower, 1).run()
+    assert follower.checkpoint == 0
+
+    standard_graph.write_snapshot(path)
+    with pytest.raises(StopIteration):
+        SnapshotRefreshThread(settings, follower, 1).run()
+    assert follower.checkpoint == standard_graph.checkpoint
+    assert graph_contents(follower) == graph_contents(standard_graph)
+
+    # The writer marks the file current each time it finds nothing changed, and so do followers.
+    follower.refreshed_at = 0
+    standard_graph.update_from_db(session)
+    standard_graph.write_snapshot(path)
+    with pytest.raises(StopIteration):
+        SnapshotRefreshThread(settings, follower, 1).run()
+    assert abs(follower.refreshed_at - standard_graph.refreshed_at) < 1
+
+
+def test_snapshot_write_failure(tmpdir, mocker):
+    path = str(tmpdir.join("missing", "graph.snapshot"))
+    settings = mocker.Mock(graph_snapshot_path=path, incremental_refresh=False)
+    mocker.patch("grouper.database.get_database_url", return_value="sqlite://")
+    mocker.patch("grouper.database.Session")
+    mocker.patch("grouper.database.sleep", side_effect=[None, StopIteration])
+    log_rate = mocker.patch("grouper.database.stats.log_rate")
+    graph = mocker.Mock()
+    graph.write_snapshot.side_effect = OSError("No such file or directory")
+    refresher = DbRefreshThread(settings, graph, 1, None)
+    crash = mocker.patch.object(refresher, "crash")
+
+    # Failing to write the snapshot is reported, but the refresher keeps going.
+    with pytest.raises(StopIteration):
+        refresher.run()
+    assert crash.call_count == 0
+    assert graph.update_from_db.call_count == 2
+    log_rate.assert_called_with("graph_snapshot_write_failures", 1)
+
+
+def test_graph_builder(session, standard_graph, users, groups, mocker):  # noqa
+    graph = GroupGraph()
+    graph.builder = GraphBuilder(timeout=60)
+    build_snapshot = mocker.spy(graph, "build_snapshot")
+    try:
+        graph.update_from_db(session)
+        assert_matches_full_rebuild(session, graph)
+
+        add_member(groups["sad-team"], groups["tech-ops"])
+        session.commit()
+        graph.update_from_db(session, incremental=True)
+        assert_matches_full_rebuild(session, graph)
+        assert build_snapshot.call_count == 0
+
+        # A builder that doesn't answer in time is stopped, and the graph is built here.
+        log_rate = mocker.spy(stats, "log_rate")
+        graph.builder.timeout = 0
+        add_member(groups["sad-team"], users["zebu@a.co"])
+        session.commit()
+        graph.update_from_db(session, incremental=True)
+        assert_matches_full_rebuild(session, graph)
+        assert build_snapshot.call_count == 1
+        log_rate.assert_any_call("graph_builder_timeouts", 1)
+    finally:
+        graph.builder.stop()
+
+
+def test_graph_builder_stalls(standard_graph, mocker):  # noqa
+    builder = GraphBuilder(timeout=1)
+
+    def start():
+        # Promise a 100-byte response, send part of it, then hang.
+        script = (
+            "import struct, sys, time\n"
+            "sys.stdout.write(struct.pack('!Q', 100) + 'x' * 10)\n"
+            "sys.stdout.flush()\n"
+            "time.sleep(60)\n"
+        )
+        builder._process = subprocess.Popen(
+            [sys.executable, "-c", script], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    mocker.patch.object(builder, "_start", side_effect=start)
+    log_rate = mocker.spy(stats, "log_rate")
+    try:
+        start_time = time.time()
+        assert builder.build(standard_graph, "sqlite://", 1, 0, None) is None
+        assert time.time() - start_time < 10
+        assert builder._process is None
+        log_rate.assert_any_call("graph_builder_timeouts", 1)
+    finally:
+        builder.stop()
+
+
+def test_details_cache(session, standard_graph, users, groups, permissions, mocker):  # noqa
+    log_rate = mocker.spy(stats, "log_rate")
+    graph = GroupGraph()
+    graph.details_cache_entries = 100
+    graph.update_from_db(session)
+
+    details = {
+        "sad-team": graph.get_group_details("sad-team"),
+        "team-infra": graph.get_group_details("team-infra"),
+        "user-admins": graph.get_group_details("user-admins"),
+        "oliver@a.co": graph.get_user_details("oliver@a.co"),
+        "tyleromeara@a.co": graph.get_user_details("tyleromeara@a.co"),
+    }
+    assert graph.get_group_details("sad-team") is details["sad-team"]
+    assert graph.get_user_details("oliver@a.co") is details["oliver@a.co"]
+    assert graph.get_user_details("oliver@a.co", cutoff=1) is not details["oliver@a.co"]
+    assert log_rate.call_args_list.count(mocker.call("graph_cache_hits", 1)) == 2
+
+    # Only results that depend on what changed are dropped by an incremental refresh.
+    revoke_member(groups["sad-team"], users["oliver@a.co"])
+    session.commit()
+    graph.update_from_db(session, incremental=True)
+    assert graph.get_group_details("user-admins") is details["user-admins"]
+    assert graph.get_user_details("tyleromeara@a.co") is details["tyleromeara@a.co"]
+    for name in ("sad-team", "team-infra"):
+        assert graph.get_group_details(name) is not details[name]
+    assert graph.get_user_details("oliver@a.co") is not details["oliver@a.co"]
+    assert_matches_full_rebuild(session, graph)
+
+    # A full refresh starts over.
+    grant_permission(groups["sad-team"], permissions["ssh"], argument="*")
+    session.commit()
+    graph.update_from_db(session)
+    assert graph.get_group_details("user-admins") is not details["user-admins"]
+
+    # The least recently used results are evicted.
+    graph.snapshot.details_cache = DetailsCache(max_entries=2)
+    for name in ("sad-team", "team-infra", "user-admins", "sad-team"):
+        graph.get_group_details(name)
+    assert len(graph.snapshot.details_cache) == 2
+    assert log_rate.call_args_list.count(mocker.call("graph_cache_evictions", 1)) == 2
+
+
+def test_permission_grants(session, standard_graph, service_accounts, permissions):  # noqa
+    graph = standard_graph
+    account = service_accounts["service@a.co"]
+    grant_permission_to_service_account(session, account, permissions["sudo"], "*")
+    session.commit()
+    graph.update_from_db(session)
+
+    grants = graph.permission_grants["sudo"]
+    assert set(grants.direct_groups) == {"team-infra"}
+    assert grants.groups == {"team-infra", "serving-team", "security-team", "team-sre", "tech-ops"}
+    assert set(grants.service_accounts) == {"service@a.co"}
+    assert [(p.groupname, p.argument) for p in graph.get_direct_grants("ssh")] == [
+        ("team-sre", "*"), ("tech-ops", "shell")]
+    assert graph.get_direct_grants("nonexistent") == []
+
+    details = graph.get_permission_details("sudo")
+    assert set(details["groups"]) == grants.groups
+    assert details["groups"]["tech-ops"]["permissions"][0]["path"] == [
+        "tech-ops", "serving-team", "team-infra"]
+    assert details["service_accounts"]["service@a.co"]["permissions"][0]["argument"] == "*"
+
+
+def test_audited_groups(standard_graph):  # noqa
+    graph = standard_graph
+
+    assert graph.directly_audited_groups == {"serving-team", "audited-team"}
+    assert graph.audited_groups == {"serving-team", "team-sre", "tech-ops", "audited-team"}
+    for groupname in graph.groups:
+        assert graph.is_audited(groupname) == graph.get_group_details(groupname)["audited"]
+    assert [g.groupname for g in graph.get_groups(audited=True)] == sorted(graph.audited_groups)
+    with pytest.raises(NoSuchGroup):
+        graph.is_audited("nonexistent")
+
+    assert graph.auditors == {"zorkian@a.co"}
+    assert graph.is_auditor("zorkian@a.co")
+    assert not graph.is_auditor("service@a.co")
+    with pytest.raises(NoSuchUser):
+        graph.is_auditor("nonexistent@a.co")
+
+
+def _count_graph_load_queries(session):
+    # Load in a fresh session, so lazy loads can't be answered from objects already in memory.
+    load_session = Session(bind=session.bind)
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(session.bind, "before_cursor_execute", count)
+    try:
+        GroupGraph().update_from_db(load_session)
+    finally:
+        event.remove(session.bind, "before_cursor_execute", count)
+        load_session.close()
+    return len(statements)
+
+
+def test_load_query_count(session, standard_graph, users, groups, service_accounts,  # noqa
+                          permissions):
+    queries = _count_graph_load_queries(session)
+
+    tag = PublicKeyTag(name="some-tag", description="a tag")
+    tag.add(session)
+    for i in range(5):
+        user = User(username="extra{}@a.co".format(i))
+        user.add(session)
+        group = Group(groupname="extra-team-{}".format(i))
+        group.add(session)
+        session.flush()
+        add_member(group, user, role="owner")
+        add_member(groups["team-sre"], group)
+        grant_permission(group, permissions["ssh"], "extra{}".format(i))
+        if i < 2:
+            key = add_public_key(session, user, (SSH_KEY_1, SSH_KEY_2)[i])
+            add_tag_to_public_key(session, key, tag)
+        account = create_service_account(
+            session, user, "extra-service{}@a.co".format(i), "an account", "some machines", group)
+        grant_permission_to_service_account(session, account, permissions["sudo"], "*")
+    session.commit()
+
+    assert _count_graph_load_queries(session) == queries
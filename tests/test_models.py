@@ -1,6 +1,7 @@
 from fixtures import graph, groups, service_accounts, permissions, session, standard_graph, users  # noqa
 
 from grouper.permissions import get_groups_by_permission
+from grouper.models.base.session import get_db_engine
 from grouper.models.group import Group
 from grouper.models.group_edge import GROUP_EDGE_ROLES
 from grouper.models.permission import Permission
@@ -23,3 +24,25 @@ def test_permission_exclude_inactive(session, standard_graph):
     assert "team-sre" in [g[0] for g in get_groups_by_permission(session, permission)]
     group.disable()
     assert "team-sre" not in [g[0] for g in get_groups_by_permission(session, permission)]
+
+
+def test_db_engine_pool(mocker, tmpdir):
+    stats = mocker.patch("grouper.models.base.session.stats")
+
+    # sqlite files aren't pooled, so the pool settings don't apply.
+    url = "sqlite:///{}".format(tmpdir.join("pool.sqlite"))
+    engine = get_db_engine(url, pool_size=1, max_overflow=0, pool_timeout=1)
+    connection = engine.connect()
+    stats.log_rate.assert_called_with("db_pool_checkout_ms", mocker.ANY)
+    stats.log_gauge.assert_called_with("db_pool_checked_out", 1)
+    connection.close()
+    stats.log_gauge.assert_called_with("db_pool_checked_out", 0)
+
+    # In-memory sqlite keeps one connection per thread, so a dead one is found by the ping.
+    engine = get_db_engine("sqlite://", pre_ping=True)
+    connection = engine.connect()
+    dbapi_connection = connection.connection.connection
+    connection.close()
+    dbapi_connection.close()
+    assert engine.execute("SELECT 1").scalar() == 1
+    stats.log_rate.assert_any_call("db_pool_ping_failures", 1)
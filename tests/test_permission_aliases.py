@@ -6,10 +6,28 @@ from fixtures import api_app as app  # noqa
 from fixtures import standard_graph, graph, users, groups, service_accounts, session, permissions  # noqa
 from grouper.models.counter import Counter
 from grouper.plugin import PluginProxy
+from grouper.plugin.base import BasePlugin
 from plugins.permission_aliases import PermissionAliasesPlugin
 from url_util import url
 
 
+class BatchAliasesPlugin(BasePlugin):
+    def __init__(self, cacheable_aliases=True):
+        self.cacheable_aliases = cacheable_aliases
+        self.calls = []
+
+    def get_aliases_for_mapped_permission(self, session, permission, argument):
+        raise AssertionError("The batch hook should have been used")
+
+    def get_aliases_for_mapped_permissions(self, session, permissions):
+        self.calls.append(permissions)
+        return {
+            (permission, argument): [("sudo", "team-sre")]
+            for permission, argument in permissions
+            if permission == "team-sre"
+        }
+
+
 @pytest.mark.gen_test
 def test_groups_aliased_permissions(mocker, session, standard_graph, http_client, base_url):
     proxy = PluginProxy([PermissionAliasesPlugin()])
@@ -76,3 +94,57 @@ def test_permissions_aliased_permissions(mocker, session, standard_graph, http_c
     ]
 
     assert ('sad-team', 'owner=sad-team') in permissions
+
+
+def test_batched_aliases(session):  # noqa
+    batch_plugin = BatchAliasesPlugin()
+    uncached_plugin = BatchAliasesPlugin(cacheable_aliases=False)
+    proxy = PluginProxy([PermissionAliasesPlugin(), batch_plugin, uncached_plugin])
+
+    aliases = proxy.get_aliases_for_mapped_permissions(
+        session, [("owner", "sad-team"), ("team-sre", "*"), ("ssh", "*")])
+    assert aliases == {
+        ("owner", "sad-team"): [("ssh", "owner=sad-team"), ("sudo", "sad-team")],
+        ("team-sre", "*"): [("sudo", "team-sre"), ("sudo", "team-sre")],
+        ("ssh", "*"): [],
+    }
+    assert len(batch_plugin.calls) == 1
+    assert sorted(batch_plugin.calls[0]) == [("owner", "sad-team"), ("ssh", "*"), ("team-sre", "*")]
+
+    # Plugins with cacheable_aliases are only asked about permissions they haven't seen; the
+    # others are asked about everything every time.
+    aliases = proxy.get_aliases_for_mapped_permissions(session, [("ssh", "*"), ("sudo", "*")])
+    assert aliases == {("ssh", "*"): [], ("sudo", "*"): []}
+    assert batch_plugin.calls[1:] == [[("sudo", "*")]]
+    assert uncached_plugin.calls[1:] == [[("ssh", "*"), ("sudo", "*")]]
+
+    # A lookup of all grants forgets the aliases of anything not granted any more.
+    proxy.get_aliases_for_mapped_permissions(session, [("sudo", "*")], all_grants=True)
+    assert batch_plugin.calls[2:] == []
+    proxy.get_aliases_for_mapped_permissions(session, [("ssh", "*")])
+    assert batch_plugin.calls[2:] == [[("ssh", "*")]]
+
+
+def test_batched_aliases_in_graph(mocker, session, standard_graph):  # noqa
+    batch_plugin = BatchAliasesPlugin()
+    row_plugin = PermissionAliasesPlugin()
+    row_lookups = mocker.spy(row_plugin, "get_aliases_for_mapped_permission")
+    proxy = PluginProxy([batch_plugin, row_plugin])
+    mocker.patch('grouper.graph.get_plugin_proxy', return_value=proxy)
+    proxy.get_aliases_for_mapped_permissions(session, [("revoked", "*")])
+
+    Counter.incr(session, "updates")
+    standard_graph.update_from_db(session)
+    assert len(batch_plugin.calls) == 2
+    assert ("revoked", "*") not in proxy._aliases[batch_plugin]
+    permissions = [(p["permission"], p["argument"], p["alias"])
+                   for p in standard_graph.get_group_details("team-sre")["permissions"]]
+    assert ("sudo", "team-sre", True) in permissions
+
+    # A rebuild with no new grants doesn't ask the cacheable plugin again, but still asks the
+    # plugin that answers one grant at a time.
+    row_lookups.reset_mock()
+    Counter.incr(session, "updates")
+    standard_graph.update_from_db(session)
+    assert len(batch_plugin.calls) == 2
+    assert row_lookups.call_count > 0
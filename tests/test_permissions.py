@@ -491,3 +491,20 @@ def test_grant_and_revoke(session, standard_graph, graph, groups, permissions,
 
     graph.update_from_db(session)
     assert not _check_graph_for_perm(graph), "permissions revoked successfully"
+
+
+@pytest.mark.gen_test
+def test_permission_view(session, standard_graph, groups, permissions, http_client, base_url):
+    fe_url = url(base_url, "/permissions/ssh")
+    resp = yield http_client.fetch(fe_url, headers={'X-Grouper-User': "zorkian@a.co"})
+    assert resp.code == 200
+    assert "/groups/team-sre" in resp.body
+    assert "/groups/tech-ops" in resp.body
+    assert "/groups/sad-team" not in resp.body
+
+    # A grant shows up once the graph is refreshed.
+    grant_permission(Group.get(session, name="sad-team"), permissions["ssh"], argument="*")
+    session.commit()
+    resp = yield http_client.fetch(fe_url + "?refresh=yes",
+            headers={'X-Grouper-User': "zorkian@a.co"})
+    assert "/groups/sad-team" in resp.body